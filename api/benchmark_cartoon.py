@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark du filtre cartoon : compare l'implémentation historique
+(aller-retour RGB -> BGR -> RGB et copies intermédiaires) à apply_cartoon_filter.
+Affiche le temps par mégapixel pour plusieurs tailles d'image.
+
+Usage : python benchmark_cartoon.py [nombre_de_threads_opencv]
+"""
+
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from photo_utils import apply_cartoon_filter, configure_opencv_threads
+
+
+def legacy_cartoon_filter(pil_img: Image.Image) -> Image.Image:
+    """Version d'origine du filtre, conservée comme référence."""
+    img = np.array(pil_img)
+    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.medianBlur(gray, 3)
+    edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 7, 5)
+    color = cv2.bilateralFilter(img, 5, 200, 200)
+    cartoon = cv2.bitwise_and(color, color, mask=edges)
+    return Image.fromarray(cv2.cvtColor(cartoon, cv2.COLOR_BGR2RGB))
+
+
+def ms_per_megapixel(func, img: Image.Image, repeat: int = 5) -> float:
+    func(img)  # Échauffement
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(img)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed * 1000 / (img.width * img.height / 1_000_000)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    configure_opencv_threads(threads)
+    print(f"Threads OpenCV : {cv2.getNumThreads()}")
+
+    rng = np.random.default_rng(0)
+    for width, height in [(640, 427), (1280, 853), (2560, 1707)]:
+        img = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+        assert legacy_cartoon_filter(img).tobytes() == apply_cartoon_filter(img).tobytes()
+        before = ms_per_megapixel(legacy_cartoon_filter, img)
+        after = ms_per_megapixel(apply_cartoon_filter, img)
+        print(f"{width}x{height} : avant {before:.1f} ms/MP, après {after:.1f} ms/MP ({before / after:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
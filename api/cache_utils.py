@@ -0,0 +1,838 @@
+import os
+import json
+import hashlib
+import logging
+import time
+import fcntl
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from PIL import Image, ImageFont
+
+from http_utils import http_get
+
+logger = logging.getLogger(__name__)
+
+# Dossier local (par worker) du cache des templates
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "photo_arc", "templates"))
+# Taille maximale du cache disque en octets (0 désactive le cache)
+TEMPLATE_CACHE_MAX_BYTES = int(os.getenv("TEMPLATE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Budget mémoire (octets de pixels) des templates décodés gardés par processus (0 désactive)
+TEMPLATE_MEMORY_CACHE_MAX_BYTES = int(os.getenv("TEMPLATE_MEMORY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Cache des photos sources (octets d'origine + niveaux réduits décodés)
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "photo_arc", "sources"))
+SOURCE_CACHE_MAX_BYTES = int(os.getenv("SOURCE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Durée (secondes) pendant laquelle une photo source en cache est réutilisée sans contacter le
+# serveur (jobs d'un même lot) ; au-delà, elle est revalidée par un GET conditionnel
+SOURCE_CACHE_TTL = int(os.getenv("SOURCE_CACHE_TTL", "60"))
+# Budget mémoire (octets) des filigranes pré-rendus gardés par processus (0 désactive)
+WATERMARK_CACHE_MAX_BYTES = int(os.getenv("WATERMARK_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Budget mémoire (octets) des masques de texte rastérisés gardés par processus (0 désactive)
+TEXT_MASK_CACHE_MAX_BYTES = int(os.getenv("TEXT_MASK_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Nombre de polices (fichier, taille) gardées chargées par processus
+FONT_CACHE_MAX_ENTRIES = int(os.getenv("FONT_CACHE_MAX_ENTRIES", "64"))
+# Dossier des verrous partagés par tous les processus du nœud (single-flight)
+SINGLE_FLIGHT_DIR = os.getenv("SINGLE_FLIGHT_DIR", os.path.join(tempfile.gettempdir(), "photo_arc", "locks"))
+
+
+def is_transient_fetch_error(error: BaseException) -> bool:
+    """
+    Erreur de téléchargement passagère (réseau, délai dépassé, erreur 5xx du serveur),
+    pour laquelle une copie en cache peut être servie. Un 4xx (contenu supprimé ou
+    refusé) ou un rejet par validation (budget de pixels) n'en est pas une.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        return response is not None and response.status_code >= 500
+    return False
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Écrit via un fichier temporaire puis os.replace (sûr entre processus)."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@dataclass
+class CachedContent:
+    content: bytes
+    sha256: str
+    from_cache: bool = False
+
+
+class TemplateDiskCache:
+    """
+    Cache disque adressé par contenu pour les téléchargements de templates.
+
+    entries/<hash de l'URL>.json contient l'URL, l'ETag, le Last-Modified et le
+    sha256 du contenu ; blobs/<sha256> contient les octets. Chaque lecture est
+    revalidée par un GET conditionnel. L'éviction est LRU (date de dernier accès
+    des blobs) dès que la taille totale dépasse max_bytes.
+    """
+
+    def __init__(self, cache_dir: str = TEMPLATE_CACHE_DIR, max_bytes: int = TEMPLATE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        self.blobs_dir = os.path.join(cache_dir, "blobs")
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.entries_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256)
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+    def _read_entry(self, url: str) -> Optional[Dict]:
+        """Retourne les métadonnées et le contenu en cache, ou None."""
+        try:
+            with open(self._entry_path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry.get("url") != url:
+                return None
+            blob_path = self._blob_path(entry["sha256"])
+            with open(blob_path, "rb") as f:
+                entry["content"] = f.read()
+            # Mise à jour de la date d'accès pour l'éviction LRU
+            os.utime(blob_path)
+            return entry
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, url: str, content: bytes, etag: Optional[str], last_modified: Optional[str]) -> str:
+        sha256 = hashlib.sha256(content).hexdigest()
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+        blob_path = self._blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.utime(blob_path)
+        else:
+            atomic_write(blob_path, content)
+
+        entry = {"url": url, "sha256": sha256, "etag": etag, "last_modified": last_modified, "size": len(content)}
+        self._write_entry(url, entry)
+        self._evict()
+        return sha256
+
+    def _write_entry(self, url: str, entry: Dict) -> None:
+        entry = {k: v for k, v in entry.items() if k != "content"}
+        # Date de la dernière confirmation par le serveur (voir read_fresh)
+        entry["validated_at"] = time.time()
+        atomic_write(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+
+    def read_fresh(self, url: str, since: float) -> Optional[CachedContent]:
+        """
+        Retourne l'entrée en cache si elle a été téléchargée ou revalidée après since,
+        sans contacter le serveur. Sert aux tâches qui ont attendu qu'une autre
+        termine le même téléchargement.
+        """
+        if not self.enabled:
+            return None
+        entry = self._read_entry(url)
+        if not entry or entry.get("validated_at", 0) < since:
+            return None
+        self._count("hits")
+        return CachedContent(entry["content"], entry["sha256"], from_cache=True)
+
+    def _evict(self) -> None:
+        """Supprime les blobs les moins récemment utilisés au-delà de max_bytes."""
+        try:
+            blobs = []
+            for name in os.listdir(self.blobs_dir):
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(self.blobs_dir, name)
+                st = os.stat(path)
+                blobs.append((st.st_mtime, st.st_size, path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self._count("evictions")
+                logger.info(f"Template évincé du cache disque: {os.path.basename(path)}")
+            except OSError:
+                continue
+
+    def fetch(self, url: str, timeout: Optional[float] = None, probe: Optional[Callable[[bytes], bool]] = None) -> CachedContent:
+        """
+        Retourne le contenu de l'URL, depuis le cache si le serveur confirme
+        qu'il n'a pas changé (304), sinon depuis le réseau (voir http_get pour probe).
+
+        Raises:
+            requests.exceptions.RequestException: Si le téléchargement échoue et qu'aucune
+                copie n'est en cache, ou si le serveur répond 4xx (la copie n'est servie
+                que sur une erreur passagère, voir is_transient_fetch_error)
+            ValueError: Si probe rejette le contenu
+        """
+        if not self.enabled:
+            response = http_get(url, timeout=timeout, probe=probe)
+            response.raise_for_status()
+            return CachedContent(response.content, hashlib.sha256(response.content).hexdigest())
+
+        entry = self._read_entry(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = http_get(url, timeout=timeout, probe=probe, headers=headers)
+            if entry and response.status_code == 304:
+                self._count("hits")
+                self._count("revalidated")
+                try:
+                    self._write_entry(url, entry)
+                except OSError:
+                    pass
+                logger.info(f"Template revalidé (304), servi depuis le cache: {url}")
+                return CachedContent(entry["content"], entry["sha256"], from_cache=True)
+            response.raise_for_status()
+        except Exception as e:
+            if entry and is_transient_fetch_error(e):
+                # Serveur indisponible : on sert la dernière version connue
+                self._count("hits")
+                self._count("stale")
+                logger.warning(f"Revalidation impossible, template servi depuis le cache: {url}")
+                return CachedContent(entry["content"], entry["sha256"], from_cache=True)
+            raise
+
+        content = response.content
+        if entry and hashlib.sha256(content).hexdigest() == entry["sha256"]:
+            # Serveur sans validateurs mais contenu identique
+            self._count("hits")
+        else:
+            self._count("misses")
+        try:
+            sha256 = self._store(url, content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        except OSError as e:
+            logger.warning(f"Impossible d'écrire le template dans le cache disque: {str(e)}")
+            sha256 = hashlib.sha256(content).hexdigest()
+        return CachedContent(content, sha256)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats)
+
+
+_template_cache: Optional[TemplateDiskCache] = None
+_template_cache_lock = threading.Lock()
+
+
+def get_template_cache() -> TemplateDiskCache:
+    """Retourne le cache disque des templates du processus courant."""
+    global _template_cache
+    if _template_cache is None:
+        with _template_cache_lock:
+            if _template_cache is None:
+                _template_cache = TemplateDiskCache()
+    return _template_cache
+
+
+class SourcePyramidCache:
+    """
+    Cache disque des photos sources sous forme de pyramide de niveaux réduits.
+
+    Pour chaque URL : <hash>.json (métadonnées, dont ETag et Last-Modified),
+    <hash>.src (octets d'origine) et <hash>.<facteur>.raw, les pixels déjà décodés
+    et orientés (EXIF) à l'échelle 1/facteur (facteur puissance de deux, la pleine
+    résolution n'est jamais stockée : elle doublerait le .src). Les niveaux sont
+    créés à la demande, au premier placement qui en a besoin, puis relus directement
+    par les jobs suivants. Une photo est réutilisée sans réseau pendant ttl secondes,
+    puis revalidée par un GET conditionnel comme les templates ; si son contenu a
+    changé, ses niveaux sont invalidés.
+    """
+
+    EVICT_INTERVAL = 30  # Secondes minimum entre deux passes d'éviction
+
+    def __init__(self, cache_dir: str = SOURCE_CACHE_DIR, max_bytes: int = SOURCE_CACHE_MAX_BYTES, ttl: int = SOURCE_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.last_evict = 0.0
+        self.stats = {"source_hits": 0, "source_misses": 0, "revalidated": 0, "stale": 0,
+                      "level_hits": 0, "level_misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, url: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + suffix)
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+    def _read_meta(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._path(url, ".json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            return meta if meta.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, url: str, meta: Dict) -> None:
+        atomic_write(self._path(url, ".json"), json.dumps(meta).encode("utf-8"))
+
+    def get_source(self, url: str) -> Optional[bytes]:
+        """Retourne les octets d'origine si la photo est en cache depuis moins de ttl secondes."""
+        if not self.enabled:
+            return None
+        meta = self._read_meta(url)
+        if not meta or time.time() - meta.get("stored_at", 0) > self.ttl:
+            self._count("source_misses")
+            return None
+        content = self._read_source_file(url)
+        if content is None:
+            self._count("source_misses")
+            return None
+        self._count("source_hits")
+        return content
+
+    def _read_source_file(self, url: str) -> Optional[bytes]:
+        try:
+            path = self._path(url, ".src")
+            with open(path, "rb") as f:
+                content = f.read()
+            os.utime(path)
+            return content
+        except OSError:
+            return None
+
+    def read_fresh(self, url: str, since: float) -> Optional[bytes]:
+        """
+        Retourne les octets en cache s'ils ont été téléchargés ou revalidés après since,
+        sans contacter le serveur. Sert aux processus qui ont attendu qu'un autre
+        termine le même téléchargement.
+        """
+        if not self.enabled:
+            return None
+        meta = self._read_meta(url)
+        if not meta or meta.get("stored_at", 0) < since:
+            return None
+        content = self._read_source_file(url)
+        if content is not None:
+            self._count("source_hits")
+        return content
+
+    def revalidation_headers(self, url: str) -> Dict[str, str]:
+        """En-têtes du GET conditionnel (If-None-Match / If-Modified-Since) d'une photo en cache."""
+        if not self.enabled:
+            return {}
+        meta = self._read_meta(url)
+        if not meta or not os.path.exists(self._path(url, ".src")):
+            return {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def confirm_source(self, url: str) -> Optional[bytes]:
+        """Le serveur a confirmé la photo (304) : relance le délai ttl et retourne les octets en cache."""
+        meta = self._read_meta(url)
+        content = self._read_source_file(url) if meta else None
+        if content is None:
+            return None
+        try:
+            meta["stored_at"] = time.time()
+            self._write_meta(url, meta)
+        except OSError:
+            pass
+        self._count("source_hits")
+        self._count("revalidated")
+        return content
+
+    def read_stale(self, url: str) -> Optional[bytes]:
+        """Octets en cache quel que soit leur âge (serveur momentanément indisponible)."""
+        if not self.enabled or not self._read_meta(url):
+            return None
+        content = self._read_source_file(url)
+        if content is not None:
+            self._count("stale")
+        return content
+
+    def put_source(self, url: str, content: bytes, full_size: Tuple[int, int],
+                   etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """Enregistre les octets d'origine et leurs validateurs ; invalide les niveaux si le contenu a changé."""
+        if not self.enabled:
+            return
+        sha256 = hashlib.sha256(content).hexdigest()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            meta = self._read_meta(url)
+            if meta and meta.get("sha256") == sha256:
+                levels = meta.get("levels", {})
+            else:
+                if meta:
+                    for factor in meta.get("levels", {}):
+                        self._remove(self._path(url, f".{factor}.raw"))
+                levels = {}
+            atomic_write(self._path(url, ".src"), content)
+            self._write_meta(url, {
+                "url": url, "sha256": sha256, "stored_at": time.time(),
+                "etag": etag, "last_modified": last_modified,
+                "size": list(full_size), "levels": levels,
+            })
+        except OSError as e:
+            logger.warning(f"Impossible d'écrire la photo source dans le cache: {str(e)}")
+            return
+        self._maybe_evict()
+
+    def get_full_size(self, url: str) -> Optional[Tuple[int, int]]:
+        """Dimensions pleine résolution (après orientation EXIF) de la photo en cache."""
+        meta = self._read_meta(url)
+        return tuple(meta["size"]) if meta and "size" in meta else None
+
+    def get_level(self, url: str, factor: int) -> Optional[Image.Image]:
+        """Retourne le niveau 1/factor de la photo s'il est en cache."""
+        if not self.enabled:
+            return None
+        meta = self._read_meta(url)
+        level = meta.get("levels", {}).get(str(factor)) if meta else None
+        if level:
+            try:
+                path = self._path(url, f".{factor}.raw")
+                with open(path, "rb") as f:
+                    img = Image.frombytes(level["mode"], tuple(level["size"]), f.read())
+                os.utime(path)
+                self._count("level_hits")
+                return img
+            except (OSError, ValueError):
+                pass
+        self._count("level_misses")
+        return None
+
+    def put_level(self, url: str, factor: int, img: Image.Image) -> None:
+        """Enregistre le niveau 1/factor (pixels bruts, déjà orientés ; jamais la pleine résolution)."""
+        if not self.enabled or factor <= 1 or img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "CMYK", "I;16"):
+            return
+        meta = self._read_meta(url)
+        if not meta:
+            return
+        try:
+            atomic_write(self._path(url, f".{factor}.raw"), img.tobytes())
+            # Relecture juste avant l'écriture pour limiter les mises à jour perdues entre processus
+            meta = self._read_meta(url) or meta
+            meta.setdefault("levels", {})[str(factor)] = {"mode": img.mode, "size": list(img.size)}
+            self._write_meta(url, meta)
+        except OSError as e:
+            logger.warning(f"Impossible d'écrire le niveau 1/{factor} dans le cache: {str(e)}")
+            return
+        self._maybe_evict()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _maybe_evict(self) -> None:
+        """Éviction LRU (date de dernier accès des fichiers), au plus tous les EVICT_INTERVAL."""
+        with self.lock:
+            if time.time() - self.last_evict < self.EVICT_INTERVAL:
+                return
+            self.last_evict = time.time()
+
+        try:
+            files = []
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.startswith(".tmp-"):
+                        continue
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            self._count("evictions")
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats)
+
+
+_source_cache: Optional[SourcePyramidCache] = None
+
+
+def get_source_cache() -> SourcePyramidCache:
+    """Retourne le cache pyramidal des photos sources du processus courant."""
+    global _source_cache
+    if _source_cache is None:
+        with _template_cache_lock:
+            if _source_cache is None:
+                _source_cache = SourcePyramidCache()
+    return _source_cache
+
+
+def image_nbytes(img: Image.Image) -> int:
+    """Taille approximative en mémoire des pixels d'une image."""
+    bits = {"1": 1, "L": 8, "P": 8, "I;16": 16}.get(img.mode, 8 * len(img.getbands()))
+    return (img.width * img.height * bits + 7) // 8
+
+
+class DecodedTemplateCache:
+    """
+    Cache LRU en mémoire des templates décodés, indexé par (URL, sha256 du contenu).
+
+    Les images en cache sont partagées entre les tâches du processus et ne doivent
+    jamais être modifiées : chaque tâche travaille sur sa propre copie.
+    """
+
+    def __init__(self, max_bytes: int = TEMPLATE_MEMORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, str], Image.Image]" = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, url: str, sha256: str) -> Optional[Image.Image]:
+        with self.lock:
+            img = self.entries.get((url, sha256))
+            if img is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end((url, sha256))
+            self.stats["hits"] += 1
+            return img
+
+    def put(self, url: str, sha256: str, img: Image.Image) -> None:
+        size = image_nbytes(img)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            key = (url, sha256)
+            if key in self.entries:
+                self.current_bytes -= image_nbytes(self.entries.pop(key))
+            # Une autre version du même template devient obsolète
+            for old_key in [k for k in self.entries if k[0] == url]:
+                self.current_bytes -= image_nbytes(self.entries.pop(old_key))
+
+            self.entries[key] = img
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= image_nbytes(evicted)
+                self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.current_bytes)
+
+
+_decoded_template_cache: Optional[DecodedTemplateCache] = None
+
+
+def get_decoded_template_cache() -> DecodedTemplateCache:
+    """Retourne le cache mémoire des templates décodés du processus courant."""
+    global _decoded_template_cache
+    if _decoded_template_cache is None:
+        with _template_cache_lock:
+            if _decoded_template_cache is None:
+                _decoded_template_cache = DecodedTemplateCache()
+    return _decoded_template_cache
+
+
+class WatermarkTileCache:
+    """
+    Cache LRU en mémoire des filigranes déjà rastérisés, indexé par
+    (texte, police, taille, couleur, transparence).
+
+    Chaque entrée est une tuile RGBA limitée à l'emprise du texte et son décalage
+    par rapport au point d'ancrage. Les tuiles sont partagées et ne doivent pas être modifiées.
+    """
+
+    def __init__(self, max_bytes: int = WATERMARK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple, Tuple[Image.Image, Tuple[int, int]]]" = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: Tuple) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: Tuple, tile: Image.Image, offset: Tuple[int, int]) -> None:
+        size = image_nbytes(tile)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= image_nbytes(self.entries.pop(key)[0])
+            self.entries[key] = (tile, offset)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.current_bytes -= image_nbytes(evicted)
+                self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.current_bytes)
+
+
+_watermark_cache: Optional[WatermarkTileCache] = None
+
+
+def get_watermark_cache() -> WatermarkTileCache:
+    """Retourne le cache des filigranes pré-rendus du processus courant."""
+    global _watermark_cache
+    if _watermark_cache is None:
+        with _template_cache_lock:
+            if _watermark_cache is None:
+                _watermark_cache = WatermarkTileCache()
+    return _watermark_cache
+
+
+class TextMaskCache(WatermarkTileCache):
+    """
+    Cache LRU en mémoire des lignes de texte déjà rastérisées, indexé par
+    (texte, police, taille, stratégie, position sous-pixel).
+
+    Chaque entrée est un masque de couverture L limité à l'emprise de la ligne et son
+    décalage par rapport au point d'ancrage : un texte répété d'un job à l'autre (nom
+    de l'école, année, classe) est posé en remplissant sa couleur à travers le masque.
+    Les masques sont partagés et ne doivent pas être modifiés.
+    """
+
+    def __init__(self, max_bytes: int = TEXT_MASK_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_text_mask_cache: Optional[TextMaskCache] = None
+
+
+def get_text_mask_cache() -> TextMaskCache:
+    """Retourne le cache des masques de texte du processus courant."""
+    global _text_mask_cache
+    if _text_mask_cache is None:
+        with _template_cache_lock:
+            if _text_mask_cache is None:
+                _text_mask_cache = TextMaskCache()
+    return _text_mask_cache
+
+
+class FontCache:
+    """
+    Cache LRU en mémoire des polices FreeType chargées, indexé par (chemin résolu, taille).
+
+    Les polices sont partagées par tous les chemins de rendu du texte (add_text,
+    TextRenderer, filigranes) : un fichier TTF n'est analysé qu'une fois par taille
+    et par processus. Un fichier introuvable est aussi mémorisé pour ne pas être
+    recherché à chaque bloc de texte.
+    """
+
+    def __init__(self, max_entries: int = FONT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, int], Optional[ImageFont.FreeTypeFont]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_font(self, font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+        """
+        Retourne la police chargée pour ce fichier et cette taille.
+
+        Raises:
+            OSError: Si le fichier de police est introuvable ou illisible
+        """
+        key = (font_path, font_size)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                font = self.entries[key]
+            else:
+                self.stats["misses"] += 1
+                try:
+                    font = ImageFont.truetype(font_path, font_size)
+                except OSError:
+                    font = None
+                self.entries[key] = font
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        if font is None:
+            raise OSError(f"Police introuvable : {font_path}")
+        return font
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
+
+
+_font_cache: Optional[FontCache] = None
+
+
+def get_font_cache() -> FontCache:
+    """Retourne le cache des polices du processus courant."""
+    global _font_cache
+    if _font_cache is None:
+        with _template_cache_lock:
+            if _font_cache is None:
+                _font_cache = FontCache()
+    return _font_cache
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Garantit qu'un seul téléchargement par clé est en cours sur le nœud.
+
+    Dans un processus, les threads qui demandent une clé déjà en cours attendent
+    le résultat du premier. Entre processus (workers Celery forkés), un verrou
+    fichier par clé sérialise les téléchargements : un processus qui a dû attendre
+    le verrou appelle d'abord reuse(), qui peut retourner le résultat déposé par
+    le précédent (par exemple dans le cache disque) au lieu de retélécharger.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = SINGLE_FLIGHT_DIR):
+        self.lock_dir = lock_dir
+        self.lock = threading.Lock()
+        self.flights: Dict[str, _Flight] = {}
+        self.stats = {"executed": 0, "suppressed": 0}
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+    def do(self, key: str, fn: Callable[[], Any], reuse: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Exécute fn pour la clé, ou attend et partage le résultat d'une exécution en cours.
+
+        Args:
+            key (str): Clé du téléchargement (typiquement l'URL)
+            fn (Callable[[], Any]): Téléchargement à effectuer
+            reuse (Optional[Callable[[], Any]]): Récupère le résultat laissé par un autre
+                processus, ou None ; sans reuse, la coordination reste interne au processus
+
+        Returns:
+            Any: Le résultat de fn (ou de reuse)
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            self._count("suppressed")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._run_locked(key, fn, reuse)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def _run_locked(self, key: str, fn: Callable[[], Any], reuse: Optional[Callable[[], Any]]) -> Any:
+        if reuse is None or not self.lock_dir:
+            self._count("executed")
+            return fn()
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        lock_path = os.path.join(self.lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".lock")
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except BlockingIOError:
+                logger.info(f"Téléchargement déjà en cours sur le nœud, attente: {key}")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                waited = True
+
+            try:
+                if waited:
+                    result = reuse()
+                    if result is not None:
+                        self._count("suppressed")
+                        return result
+                self._count("executed")
+                return fn()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats)
+
+
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """Retourne le coordinateur single-flight du processus courant."""
+    global _single_flight
+    if _single_flight is None:
+        with _template_cache_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_init
 import os
 import logging
 
@@ -31,3 +32,15 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=3600,
 )
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Configuration propre à chaque processus enfant du worker."""
+    from photo_utils import configure_opencv_threads, warm_font_cache
+    from imaging_utils import get_imaging_backend
+    configure_opencv_threads()
+    # Polices analysées une fois par processus, avant le premier job
+    warm_font_cache()
+    # Choix du moteur d'imagerie (IMAGING_BACKEND) dès le démarrage du processus
+    get_imaging_backend()
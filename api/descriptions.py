@@ -20,6 +20,7 @@ Cet endpoint déclenche le traitement de l'image avec les paramètres spécifié
 | `dpi` (facultatif)      | Résolution de l'image finale en DPI.                                                              | `300`                                              |
 | `watermark_text` (facultatif) | Texte du filigrane à ajouter sur l'image.                                                      | `Confidential`                                      |
 | `result_w` (facultatif) | Largeur en pixels de l'image finale, avec conservation du ratio.                                   | `800`                                              |
+| `resize_quality` (facultatif) | Compromis vitesse/qualité des redimensionnements : `fast`, `balanced` ou `high`.             | `high`                                             |
 
 ---
 
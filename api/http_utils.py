@@ -0,0 +1,345 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Nombre d'hôtes distincts dont le pool de connexions est conservé
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+# Nombre maximum de connexions keep-alive conservées par hôte
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+# Nombre de nouvelles tentatives sur erreur réseau ou 502/503/504
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.3"))
+# Taille maximale d'un téléchargement en octets
+MAX_DOWNLOAD_BYTES = int(os.getenv("MAX_DOWNLOAD_BYTES", str(50 * 1024 * 1024)))
+# Taille des blocs lus sur le flux
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Timeouts de lecture adaptatifs : p99 du temps jusqu'au premier octet de l'hôte x multiplicateur,
+# borné entre min et max (secondes). C'est une limite d'inactivité entre deux lectures, pas de durée totale
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MIN_TIMEOUT = float(os.getenv("HTTP_MIN_TIMEOUT", "2"))
+HTTP_MAX_TIMEOUT = float(os.getenv("HTTP_MAX_TIMEOUT", "30"))
+HTTP_TIMEOUT_MULTIPLIER = float(os.getenv("HTTP_TIMEOUT_MULTIPLIER", "3"))
+# Durée maximale (secondes) d'un téléchargement complet, corps compris
+HTTP_DOWNLOAD_DEADLINE = float(os.getenv("HTTP_DOWNLOAD_DEADLINE", "120"))
+# Nombre de mesures conservées par hôte, et minimum avant d'adapter les délais
+HTTP_LATENCY_WINDOW = int(os.getenv("HTTP_LATENCY_WINDOW", "200"))
+HTTP_LATENCY_MIN_SAMPLES = int(os.getenv("HTTP_LATENCY_MIN_SAMPLES", "20"))
+# Requêtes de relance (hedging) : désactivées par défaut
+HTTP_HEDGING_ENABLED = os.getenv("HTTP_HEDGING_ENABLED", "0") == "1"
+HTTP_HEDGE_DELAY = float(os.getenv("HTTP_HEDGE_DELAY", "1.0"))
+HTTP_HEDGE_WORKERS = int(os.getenv("HTTP_HEDGE_WORKERS", "16"))
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """La réponse dépasse la taille maximale autorisée."""
+
+
+class DownloadDeadlineExceeded(requests.exceptions.Timeout):
+    """Le téléchargement complet dépasse HTTP_DOWNLOAD_DEADLINE."""
+
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    """Construit une session avec pool de connexions et politique de retry."""
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=HTTP_MAX_RETRIES,
+        status=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+        pool_block=False,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Retourne la session HTTP partagée du processus courant.
+    Les workers Celery forkent après l'import : une nouvelle session est créée
+    dans chaque processus enfant pour ne jamais partager de socket entre processus.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = _build_session()
+            _session_pid = pid
+            logger.info(
+                f"Session HTTP initialisée (pid={pid}, pools={HTTP_POOL_CONNECTIONS}, "
+                f"connexions/hôte={HTTP_POOL_MAXSIZE}, retries={HTTP_MAX_RETRIES})"
+            )
+    return _session
+
+
+class HostLatencyTracker:
+    """
+    Temps jusqu'au premier octet observés par hôte, pour adapter les timeouts de
+    lecture et le délai de relance.
+
+    Une tentative en échec (réseau, délai dépassé) est comptée au timeout de lecture
+    qu'elle avait : sans cela seuls les succès seraient mesurés et le timeout ne
+    pourrait que baisser. Tant qu'un hôte compte moins de HTTP_LATENCY_MIN_SAMPLES
+    mesures, les valeurs par défaut (HTTP_MAX_TIMEOUT, HTTP_HEDGE_DELAY) s'appliquent.
+    """
+
+    def __init__(self, window: int = HTTP_LATENCY_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples: Dict[str, deque] = {}
+
+    def record(self, host: str, seconds: float) -> None:
+        with self.lock:
+            self.samples.setdefault(host, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, host: str, q: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.samples.get(host, ()))
+        if len(samples) < HTTP_LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+    def timeout_for(self, host: str) -> float:
+        """Timeout de lecture (inactivité) : p99 de l'hôte multiplié par HTTP_TIMEOUT_MULTIPLIER, borné."""
+        p99 = self.percentile(host, 99)
+        if p99 is None:
+            return HTTP_MAX_TIMEOUT
+        return min(HTTP_MAX_TIMEOUT, max(HTTP_MIN_TIMEOUT, p99 * HTTP_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay_for(self, host: str) -> float:
+        """Délai avant relance : p95 de l'hôte, ou HTTP_HEDGE_DELAY sans historique."""
+        p95 = self.percentile(host, 95)
+        return HTTP_HEDGE_DELAY if p95 is None else p95
+
+
+_latency_tracker = HostLatencyTracker()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_pid: Optional[int] = None
+_fetch_stats = {"hedged": 0, "hedge_wins": 0}
+_fetch_stats_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """Pool de threads des requêtes relancées, recréé dans chaque processus forké."""
+    global _hedge_executor, _hedge_executor_pid
+
+    pid = os.getpid()
+    with _session_lock:
+        if _hedge_executor is None or _hedge_executor_pid != pid:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HTTP_HEDGE_WORKERS, thread_name_prefix="http_hedge")
+            _hedge_executor_pid = pid
+    return _hedge_executor
+
+
+def _count(name: str) -> None:
+    with _fetch_stats_lock:
+        _fetch_stats[name] += 1
+
+
+def http_get(
+    url: str,
+    timeout: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+    probe: Optional[Callable[[bytes], bool]] = None,
+    hedge: Optional[bool] = None,
+    **kwargs
+) -> requests.Response:
+    """
+    Effectue un GET via la session partagée (connexions réutilisées).
+
+    Le corps est lu en flux et le téléchargement est interrompu dès qu'il dépasse
+    max_bytes (annoncé par Content-Length ou constaté en cours de lecture).
+    Tant que probe retourne False, il est appelé avec les octets déjà reçus : il peut
+    lever une exception pour rejeter la réponse avant la fin du téléchargement.
+
+    Sans timeout explicite, le timeout de lecture s'adapte aux temps de premier octet
+    observés sur l'hôte ; le téléchargement complet reste borné par
+    HTTP_DOWNLOAD_DEADLINE. Avec hedge, une seconde requête identique est envoyée si la première
+    n'a pas abouti après le délai de relance, et la première réponse reçue l'emporte.
+
+    Args:
+        url (str): URL à télécharger
+        timeout (Optional[float]): Timeout de connexion et de lecture en secondes
+            (par défaut adaptatif, voir HostLatencyTracker)
+        max_bytes (Optional[int]): Taille maximale du corps (par défaut MAX_DOWNLOAD_BYTES)
+        probe (Optional[Callable[[bytes], bool]]): Inspection des premiers octets,
+            retourne True quand elle n'a plus besoin de données
+        hedge (Optional[bool]): Active la requête de relance (par défaut HTTP_HEDGING_ENABLED)
+
+    Returns:
+        requests.Response: La réponse, dont le contenu est entièrement lu
+
+    Raises:
+        ResponseTooLarge: Si le corps dépasse max_bytes
+        DownloadDeadlineExceeded: Si le téléchargement dépasse HTTP_DOWNLOAD_DEADLINE
+    """
+    host = urlsplit(url).netloc
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, _latency_tracker.timeout_for(host))
+    hedge = HTTP_HEDGING_ENABLED if hedge is None else hedge
+
+    def attempt() -> requests.Response:
+        return _timed_download(url, host, timeout, max_bytes, probe, **kwargs)
+
+    if not hedge:
+        return attempt()
+    return _hedged(url, host, attempt)
+
+
+def _hedged(url: str, host: str, attempt: Callable[[], requests.Response]) -> requests.Response:
+    """Lance attempt, puis une relance si elle tarde ; retourne le premier succès."""
+    executor = _get_hedge_executor()
+    futures = [executor.submit(attempt)]
+    done, _ = wait(futures, timeout=_latency_tracker.hedge_delay_for(host))
+    if not done:
+        logger.info(f"Réponse lente, envoi d'une requête de relance: {url}")
+        _count("hedged")
+        futures.append(executor.submit(attempt))
+
+    error: Optional[BaseException] = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not futures[0]:
+                    _count("hedge_wins")
+                # La requête perdante se termine en arrière-plan, son résultat est ignoré
+                for other in pending:
+                    other.add_done_callback(_close_discarded)
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def _close_discarded(future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def _timed_download(url, host, timeout, max_bytes, probe, **kwargs) -> requests.Response:
+    try:
+        response = _download(url, timeout, max_bytes, probe, **kwargs)
+    except DownloadDeadlineExceeded:
+        # Corps trop long à transférer : le serveur répondait, rien à corriger côté timeout de lecture
+        raise
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        # Échec compté au timeout atteint, pour que le p99 (et donc le timeout) puisse remonter
+        _latency_tracker.record(host, timeout[1] if isinstance(timeout, tuple) else timeout)
+        raise
+    # Avec stream=True, elapsed s'arrête à la réception des en-têtes : temps jusqu'au premier octet
+    _latency_tracker.record(host, response.elapsed.total_seconds())
+    return response
+
+
+def _download(
+    url: str,
+    timeout,
+    max_bytes: Optional[int],
+    probe: Optional[Callable[[bytes], bool]],
+    **kwargs
+) -> requests.Response:
+    max_bytes = MAX_DOWNLOAD_BYTES if max_bytes is None else max_bytes
+    deadline = time.monotonic() + HTTP_DOWNLOAD_DEADLINE
+    response = get_session().get(url, timeout=timeout, stream=True, **kwargs)
+
+    try:
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise ResponseTooLarge(f"Réponse trop volumineuse ({content_length} octets > {max_bytes}): {url}")
+
+        buffer = bytearray()
+        probing = probe is not None
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise ResponseTooLarge(f"Réponse trop volumineuse (> {max_bytes} octets): {url}")
+            if time.monotonic() > deadline:
+                raise DownloadDeadlineExceeded(f"Téléchargement trop long (> {HTTP_DOWNLOAD_DEADLINE}s): {url}")
+            if probing and response.ok:
+                probing = not probe(bytes(buffer))
+    except BaseException:
+        response.close()
+        raise
+
+    # Le contenu est déjà lu : response.content reste utilisable normalement
+    response._content = bytes(buffer)
+    response._content_consumed = True
+    return response
+
+
+def get_fetch_stats() -> Dict[str, int]:
+    """Compteurs de relances (hedged : relances envoyées, hedge_wins : relances gagnantes)."""
+    with _fetch_stats_lock:
+        return dict(_fetch_stats)
+
+
+def get_connection_stats() -> Dict[str, int]:
+    """
+    Compteurs de réutilisation des connexions de la session du processus.
+
+    Returns:
+        Dict[str, int]: requests (requêtes émises), connections (connexions ouvertes)
+            et reused (requêtes servies par une connexion déjà ouverte)
+    """
+    stats = {"requests": 0, "connections": 0, "reused": 0}
+    if _session is None or _session_pid != os.getpid():
+        return stats
+
+    seen = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                # Pool évincé entre la lecture des clés et l'accès
+                continue
+            stats["requests"] += pool.num_requests
+            stats["connections"] += pool.num_connections
+
+    stats["reused"] = max(0, stats["requests"] - stats["connections"])
+    return stats
+
+
+def reset_session() -> None:
+    """Ferme la session partagée ; la prochaine requête en recréera une."""
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
@@ -0,0 +1,539 @@
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Any, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from photo_utils import (
+    FILTER_OVERSAMPLING,
+    MAX_IMAGE_PIXELS,
+    TILED_MAX_IMAGE_PIXELS,
+    ResizeQuality,
+    add_text_layer,
+    apply_crop,
+    apply_filter,
+    apply_resize_template,
+    apply_rotation,
+    apply_watermark,
+    check_image_pixels,
+    load_font,
+    load_source,
+    oriented_size,
+    plan_placement,
+    pyramid_factor,
+    render_filtered_placement,
+    render_text_mask,
+    resize_image,
+    layout_text_lines,
+    resolve_resize_quality,
+    TextConfig,
+    template_pixel_limit,
+)
+
+try:
+    import pyvips
+except (ImportError, OSError):  # pyvips ou la bibliothèque libvips absents
+    pyvips = None
+
+logger = logging.getLogger(__name__)
+
+# Moteur d'imagerie du worker : pillow (référence) ou vips (pyvips + libvips, installés
+# dans l'image Docker ; ailleurs : pip install pyvips-binary)
+IMAGING_BACKEND = os.getenv("IMAGING_BACKEND", "pillow")
+
+# Taille de sortie (pixels) à partir de laquelle un job est rendu par bandes (0 désactive)
+TILED_RENDER_MIN_PIXELS = int(os.getenv("TILED_RENDER_MIN_PIXELS", str(24_000_000)))
+
+# Mode Pillow correspondant au nombre de bandes d'une image libvips 8 bits
+_PIL_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+# Noyau libvips équivalent à chaque qualité de redimensionnement
+_VIPS_KERNELS = {
+    ResizeQuality.FAST: "linear",
+    ResizeQuality.BALANCED: "cubic",
+    ResizeQuality.HIGH: "lanczos3",
+}
+
+
+class ImagingBackend(ABC):
+    """
+    Opérations de composition d'une image finale.
+
+    Les images manipulées sont propres à chaque moteur. Les opérations qui modifient
+    le canevas (paste, text_layer) retournent le canevas à utiliser ensuite.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def load_source(self, image_url: str, content: bytes, target_size: Optional[Tuple[int, int]] = None) -> Any:
+        """Décode une photo source, réduite si possible tout en couvrant target_size."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def new_canvas(self, template: Image.Image, width: Optional[int] = None,
+                   quality: Optional[Union[str, ResizeQuality]] = None) -> Any:
+        """Crée le canevas mutable du job à partir du template (réduit à width si précisé)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def size(self, img: Any) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def crop(self, img: Any, crop_top: float, crop_bottom: float) -> Any:
+        """Rogne en haut et en bas selon des pourcentages (comme apply_crop)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def rotate(self, img: Any, angle: float) -> Any:
+        """Rotation anti-horaire avec agrandissement du cadre (comme apply_rotation)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def resize(self, img: Any, size: Tuple[int, int],
+               quality: Optional[Union[str, ResizeQuality]] = None) -> Any:
+        raise NotImplementedError
+
+    def resize_to_width(self, img: Any, width: int,
+                        quality: Optional[Union[str, ResizeQuality]] = None) -> Any:
+        """Redimensionne à width en conservant le ratio (comme apply_resize_template)."""
+        img_width, img_height = self.size(img)
+        return self.resize(img, (width, int(width / (img_width / img_height))), quality)
+
+    @abstractmethod
+    def greyscale(self, img: Any) -> Any:
+        """Niveaux de gris (luminance ITU-R 601, comme Pillow), alpha conservé."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def filter(self, img: Any, _filter: str) -> Any:
+        """Applique un filtre de apply_filter ('nb', 'cartoon' ou aucun)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def watermark(self, img: Any, text: str) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def paste(self, canvas: Any, img: Any, position: Tuple[int, int]) -> Any:
+        """Colle img sur le canevas, avec son alpha s'il en a un."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def text_layer(self, canvas: Any, blocks: List[TextConfig]) -> Any:
+        """
+        Ajoute en une passe tous les blocs de texte d'un job
+        (positions en pourcentage, lignes séparées par <br>).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_jpeg(self, canvas: Any, dpi: int) -> bytes:
+        raise NotImplementedError
+
+    def place(
+        self,
+        img: Any,
+        crop_top: float,
+        crop_bottom: float,
+        rotation: float,
+        target_width: int,
+        _filter: str,
+        quality: Optional[Union[str, ResizeQuality]] = None,
+    ) -> Any:
+        """
+        Produit l'image placée et filtrée à sa taille finale (celle calculée par plan_placement).
+
+        Args:
+            img: La photo source
+            crop_top (float): Pourcentage à rogner depuis le haut (0-100)
+            crop_bottom (float): Pourcentage à rogner depuis le bas (0-100)
+            rotation (float): Angle de rotation en degrés
+            target_width (int): Largeur finale en pixels
+            _filter (str): Le filtre à appliquer
+            quality (Optional[Union[str, ResizeQuality]]): Compromis vitesse/qualité
+
+        Returns:
+            L'image placée
+
+        Raises:
+            ValueError: Si les dimensions finales sont nulles ou négatives
+        """
+        size = plan_placement(self.size(img), crop_top, crop_bottom, rotation, target_width).size
+        img = self.rotate(self.crop(img, crop_top, crop_bottom), rotation)
+        if _filter == 'nb':
+            return self.resize(self.greyscale(img), size, quality)
+        if _filter == 'cartoon' and FILTER_OVERSAMPLING > 1:
+            work_size = (int(round(size[0] * FILTER_OVERSAMPLING)), int(round(size[1] * FILTER_OVERSAMPLING)))
+            return self.resize(self.filter(self.resize(img, work_size, quality), _filter), size, quality)
+        return self.filter(self.resize(img, size, quality), _filter)
+
+
+class PillowBackend(ImagingBackend):
+    """Moteur de référence : les fonctions de photo_utils, canevas modifié en place."""
+
+    name = "pillow"
+
+    def load_source(self, image_url, content, target_size=None):
+        return load_source(image_url, content, target_size)
+
+    def new_canvas(self, template, width=None, quality=None):
+        if width and width < template.width:
+            return apply_resize_template(template, width, quality)
+        # Le template est partagé par le cache mémoire : la copie est le canevas du job
+        return template.copy()
+
+    def size(self, img):
+        return img.size
+
+    def crop(self, img, crop_top, crop_bottom):
+        return apply_crop(img, crop_top, crop_bottom)
+
+    def rotate(self, img, angle):
+        return apply_rotation(img, angle)
+
+    def resize(self, img, size, quality=None):
+        return resize_image(img, size, quality)
+
+    def resize_to_width(self, img, width, quality=None):
+        return apply_resize_template(img, width, quality)
+
+    def greyscale(self, img):
+        return apply_filter(img, 'nb')
+
+    def filter(self, img, _filter):
+        return apply_filter(img, _filter)
+
+    def watermark(self, img, text):
+        return apply_watermark(img, text, in_place=True)
+
+    def paste(self, canvas, img, position):
+        mask = img if img.mode in ("LA", "RGBA") else None
+        canvas.paste(img, position, mask)
+        return canvas
+
+    def text_layer(self, canvas, blocks):
+        return add_text_layer(canvas, blocks, in_place=True)
+
+    def save_jpeg(self, canvas, dpi):
+        with BytesIO() as bio:
+            canvas.save(bio, format='JPEG', dpi=(dpi, dpi))
+            return bio.getvalue()
+
+    def place(self, img, crop_top, crop_bottom, rotation, target_width, _filter, quality=None):
+        # Rognage, rotation et redimensionnement fusionnés en une seule passe
+        return render_filtered_placement(img, crop_top, crop_bottom, rotation, target_width, _filter, quality=quality)
+
+
+class VipsBackend(ImagingBackend):
+    """
+    Moteur libvips : chaque opération ajoute une étape à un pipeline paresseux, les
+    pixels ne sont calculés que par bandes lors de l'encodage JPEG final.
+
+    Le filtre cartoon et le filigrane passent par Pillow sur l'image placée
+    (déjà à sa petite taille finale) ; le texte est rastérisé par Pillow sur sa
+    seule emprise pour rester identique au moteur de référence.
+    """
+
+    name = "vips"
+
+    def __init__(self):
+        if pyvips is None:
+            raise ValueError("Le moteur vips nécessite pyvips et libvips")
+
+    @staticmethod
+    def from_pil(img: Image.Image) -> "pyvips.Image":
+        """Image libvips (8 bits) à partir d'une image Pillow L, LA, RGB ou RGBA."""
+        if img.mode not in _PIL_MODES.values():
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        vips_img = pyvips.Image.new_from_memory(img.tobytes(), img.width, img.height, len(img.getbands()), "uchar")
+        return vips_img.copy(interpretation="b-w" if img.mode in ("L", "LA") else "srgb")
+
+    @staticmethod
+    def to_pil(img: "pyvips.Image") -> Image.Image:
+        """Évalue une image libvips 8 bits en image Pillow."""
+        return Image.frombytes(_PIL_MODES[img.bands], (img.width, img.height), img.write_to_memory())
+
+    @staticmethod
+    def _normalize(img: "pyvips.Image") -> "pyvips.Image":
+        """Ramène une source en niveaux de gris ou sRGB 8 bits ; alpha gardé seulement s'il sert."""
+        if img.interpretation == "cmyk":
+            # Profil ICC embarqué, ou profil CMYK par défaut de libvips
+            img = img.colourspace("srgb")
+        elif img.format != "uchar" or img.interpretation not in ("b-w", "srgb"):
+            img = img.colourspace("b-w" if img.bands - img.hasalpha() == 1 else "srgb")
+        if img.hasalpha() and img.extract_band(img.bands - 1).min() >= 255:
+            img = img.extract_band(0, n=img.bands - 1)
+        return img
+
+    def load_source(self, image_url, content, target_size=None):
+        with Image.open(BytesIO(content)) as header:
+            check_image_pixels(header.size)
+            full_size = oriented_size(header)
+            is_jpeg = header.format == "JPEG"
+        factor = pyramid_factor(full_size, target_size)
+
+        # Réduction au décodage (JPEG : jusqu'à 1/8 par libjpeg), puis moyenne de blocs
+        shrink = min(factor, 8) if is_jpeg else 1
+        img = pyvips.Image.new_from_buffer(content, "", shrink=shrink) if shrink > 1 \
+            else pyvips.Image.new_from_buffer(content, "")
+        img = img.autorot()
+        remaining = max(1, round(factor * img.width / full_size[0])) if full_size[0] else 1
+        if remaining > 1:
+            img = img.shrink(remaining, remaining)
+        return self._normalize(img)
+
+    def new_canvas(self, template, width=None, quality=None):
+        canvas = self.from_pil(template)
+        if width and width < template.width:
+            canvas = self.resize_to_width(canvas, width, quality)
+        return canvas
+
+    def size(self, img):
+        return img.width, img.height
+
+    def crop(self, img, crop_top, crop_bottom):
+        if crop_top == 0 and crop_bottom == 0:
+            return img
+        top = int((crop_top / 100) * img.height)
+        bottom = int(img.height - ((crop_bottom / 100) * img.height))
+        return img.crop(0, top, img.width, bottom - top)
+
+    def rotate(self, img, angle):
+        angle = angle % 360
+        match angle:
+            case 0:
+                return img
+            case 90:
+                return img.rot270()
+            case 180:
+                return img.rot180()
+            case 270:
+                return img.rot90()
+        # libvips tourne dans le sens horaire ; coins découverts en noir (transparents avec alpha)
+        interpolate = pyvips.Interpolate.new("bicubic")
+        if img.hasalpha():
+            return img.premultiply().rotate(-angle, interpolate=interpolate).unpremultiply().cast("uchar")
+        return img.rotate(-angle, interpolate=interpolate).cast("uchar")
+
+    def resize(self, img, size, quality=None):
+        width, height = size
+        if (img.width, img.height) == (width, height):
+            return img
+        kernel = _VIPS_KERNELS[resolve_resize_quality(quality)]
+        source = img.premultiply() if img.hasalpha() else img
+        resized = source.resize(width / img.width, vscale=height / img.height, kernel=kernel)
+        if img.hasalpha():
+            resized = resized.unpremultiply()
+        resized = resized.cast("uchar")
+        if (resized.width, resized.height) != (width, height):
+            # Arrondi de libvips : on recadre au pixel près
+            resized = resized.embed(0, 0, width, height, extend="copy")
+        return resized
+
+    def greyscale(self, img):
+        colour_bands = img.bands - img.hasalpha()
+        if colour_bands == 1:
+            return img
+        # Mêmes coefficients et même arrondi que la conversion 'L' de Pillow
+        grey = (img.extract_band(0, n=3).recomb([[0.299, 0.587, 0.114]]) + 0.5).cast("uchar")
+        if img.hasalpha():
+            grey = grey.bandjoin(img.extract_band(img.bands - 1))
+        return grey.copy(interpretation="b-w")
+
+    def filter(self, img, _filter):
+        match _filter:
+            case 'nb':
+                return self.greyscale(img)
+            case 'cartoon':
+                return self.from_pil(apply_filter(self.to_pil(img), _filter))
+            case _:
+                return img
+
+    def watermark(self, img, text):
+        return self.from_pil(apply_watermark(self.to_pil(img), text, in_place=True))
+
+    def paste(self, canvas, img, position):
+        x, y = position
+        if img.bands - img.hasalpha() == 1:
+            # Niveaux de gris étendus en RGB seulement au moment du collage
+            grey = img.extract_band(0)
+            img = grey.bandjoin([grey, grey]) if not img.hasalpha() \
+                else grey.bandjoin([grey, grey, img.extract_band(1)])
+            img = img.copy(interpretation="srgb")
+        if img.hasalpha():
+            return canvas.composite2(img, "over", x=x, y=y).extract_band(0, n=canvas.bands).cast("uchar")
+        return canvas.insert(img, x, y)
+
+    def _text_overlay(self, canvas, block):
+        """Calque RGBA d'un bloc de texte limité à son emprise sur le canevas, et sa position."""
+        font = load_font(block.font_name, block.font_size)
+        # Masques de couverture des lignes, rastérisés par Pillow (cache des masques de texte)
+        masks = [render_text_mask(line, font, pos_x, pos_y)
+                 for pos_x, pos_y, line in layout_text_lines(block, (canvas.width, canvas.height))]
+
+        # Emprise de toutes les lignes, limitée au canevas
+        left = max(0, min(x for _, (x, _) in masks))
+        top = max(0, min(y for _, (_, y) in masks))
+        right = min(canvas.width, max(x + mask.width for mask, (x, _) in masks))
+        bottom = min(canvas.height, max(y + mask.height for mask, (_, y) in masks))
+        if right <= left or bottom <= top:
+            return None
+
+        # Couverture du bloc, couleur posée par libvips
+        coverage = Image.new("L", (right - left, bottom - top), 0)
+        for mask, (x, y) in masks:
+            coverage.paste(255, (x - left, y - top), mask)
+        rgb = [int(block.color[i:i + 2], 16) for i in (0, 2, 4)]
+        alpha = self.from_pil(coverage)
+        return alpha.new_from_image(rgb).bandjoin(alpha).copy(interpretation="srgb"), left, top
+
+    def text_layer(self, canvas, blocks):
+        overlays = [self._text_overlay(canvas, block) for block in blocks if block.text is not None]
+        overlays = [overlay for overlay in overlays if overlay is not None]
+        if not overlays:
+            return canvas
+        # Tous les blocs composés en une seule opération
+        images, xs, ys = zip(*overlays)
+        composed = canvas.composite(list(images), ["over"] * len(images), x=list(xs), y=list(ys))
+        return composed.extract_band(0, n=canvas.bands).cast("uchar")
+
+    def save_jpeg(self, canvas, dpi):
+        # libvips exprime la résolution en pixels par millimètre
+        pixels_per_mm = dpi / 25.4
+        return canvas.copy(xres=pixels_per_mm, yres=pixels_per_mm).jpegsave_buffer(Q=75)
+
+
+class TiledBackend(PillowBackend):
+    """
+    Rendu par bandes des très grands templates (affiches, A3 à 300 dpi).
+
+    Les images placées sont produites par Pillow (référence) à leur taille finale. Le
+    template n'est jamais décodé en entier : libvips le lit séquentiellement depuis ses
+    octets, y compose placements et textes bande par bande et encode chaque bande dans
+    le flux JPEG au fur et à mesure. La mémoire du job ne dépend plus de la taille de sortie.
+    """
+
+    name = "tiled"
+
+    def __init__(self):
+        self.canvas_backend = VipsBackend()
+
+    def open_canvas(self, content: bytes, width: Optional[int] = None,
+                    quality: Optional[Union[str, ResizeQuality]] = None) -> "pyvips.Image":
+        """
+        Ouvre le template comme canevas lu en flux (réduit à width si précisé).
+
+        Args:
+            content (bytes): Octets du template
+            width (Optional[int]): Largeur de sortie si elle réduit le template
+            quality (Optional[Union[str, ResizeQuality]]): Compromis vitesse/qualité
+
+        Returns:
+            pyvips.Image: Le canevas RGB 8 bits, évalué seulement à l'encodage
+        """
+        with template_pixel_limit(), Image.open(BytesIO(content)) as header:
+            check_image_pixels(header.size, TILED_MAX_IMAGE_PIXELS)
+            orientation = header.getexif().get(0x0112, 1)
+        # Une orientation EXIF autre qu'identité impose un accès aléatoire au template
+        access = "sequential" if orientation == 1 else "random"
+        canvas = pyvips.Image.new_from_buffer(content, "", access=access).autorot()
+
+        if canvas.interpretation == "cmyk":
+            canvas = canvas.colourspace("srgb")
+        elif canvas.format != "uchar" or canvas.interpretation not in ("b-w", "srgb"):
+            canvas = canvas.colourspace("b-w" if canvas.bands - canvas.hasalpha() == 1 else "srgb")
+        if canvas.hasalpha():
+            # Même fond blanc que normalize_template_mode
+            canvas = canvas.flatten(background=[255] * (canvas.bands - 1)).cast("uchar")
+        if canvas.bands == 1:
+            canvas = canvas.bandjoin([canvas, canvas]).copy(interpretation="srgb")
+
+        if width and width < canvas.width:
+            canvas = self.canvas_backend.resize_to_width(canvas, width, quality)
+        return canvas
+
+    def new_canvas(self, template, width=None, quality=None):
+        return self.canvas_backend.new_canvas(template, width, quality)
+
+    def size(self, img):
+        return self.canvas_backend.size(img) if pyvips is not None and isinstance(img, pyvips.Image) else img.size
+
+    def paste(self, canvas, img, position):
+        return self.canvas_backend.paste(canvas, self.canvas_backend.from_pil(img), position)
+
+    def text_layer(self, canvas, blocks):
+        return self.canvas_backend.text_layer(canvas, blocks)
+
+    def resize_to_width(self, img, width, quality=None):
+        return self.canvas_backend.resize_to_width(img, width, quality)
+
+    def save_jpeg(self, canvas, dpi):
+        return self.canvas_backend.save_jpeg(canvas, dpi)
+
+
+_imaging_backend: Optional[ImagingBackend] = None
+_imaging_backend_lock = threading.Lock()
+
+
+def create_imaging_backend(name: str) -> ImagingBackend:
+    """
+    Instancie un moteur d'imagerie par son nom.
+
+    Raises:
+        ValueError: Si le moteur est inconnu ou indisponible
+    """
+    match name:
+        case "pillow":
+            return PillowBackend()
+        case "vips":
+            return VipsBackend()
+        case _:
+            raise ValueError(f"Moteur d'imagerie inconnu : {name}")
+
+
+def get_imaging_backend() -> ImagingBackend:
+    """
+    Retourne le moteur d'imagerie du processus (IMAGING_BACKEND).
+    Si libvips est demandé mais indisponible, le worker reste sur Pillow.
+    """
+    global _imaging_backend
+    if _imaging_backend is None:
+        with _imaging_backend_lock:
+            if _imaging_backend is None:
+                try:
+                    _imaging_backend = create_imaging_backend(IMAGING_BACKEND)
+                except ValueError as e:
+                    logger.warning(f"{str(e)} : utilisation du moteur pillow")
+                    _imaging_backend = PillowBackend()
+                logger.info(f"Moteur d'imagerie: {_imaging_backend.name}")
+    return _imaging_backend
+
+
+def select_imaging_backend(output_size: Tuple[int, int],
+                           template_size: Optional[Tuple[int, int]] = None) -> ImagingBackend:
+    """
+    Choisit le moteur d'un job : le moteur du worker, ou le rendu par bandes si
+    l'image de sortie atteint TILED_RENDER_MIN_PIXELS ou si le template dépasse
+    MAX_IMAGE_PIXELS (et que libvips est disponible).
+
+    Args:
+        output_size (Tuple[int, int]): Dimensions de l'image finale
+        template_size (Optional[Tuple[int, int]]): Dimensions du template d'origine
+
+    Returns:
+        ImagingBackend: Le moteur à utiliser pour ce job
+    """
+    backend = get_imaging_backend()
+    large_output = bool(TILED_RENDER_MIN_PIXELS) and output_size[0] * output_size[1] >= TILED_RENDER_MIN_PIXELS
+    # Un template au-delà de MAX_IMAGE_PIXELS ne peut être rendu que par bandes
+    large_template = template_size is not None and template_size[0] * template_size[1] > MAX_IMAGE_PIXELS
+    if not (large_output or large_template):
+        return backend
+    if pyvips is None:
+        logger.warning(f"Rendu par bandes impossible sans libvips, rendu complet en mémoire: {output_size}")
+        return backend
+    return TiledBackend()
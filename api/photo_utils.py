@@ -1,12 +1,104 @@
 import requests
+from contextlib import contextmanager
 from typing import Optional, List, Union, Tuple
-from PIL import Image, ImageOps, ImageDraw, ImageFont
+from PIL import Image, ImageColor, ImageOps, ImageDraw, ImageFont
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from enum import Enum
 from dataclasses import dataclass
 import logging
+import math
+import os
+import time
+import hashlib
+import threading
+from http_utils import http_get
+from cache_utils import (
+    CachedContent, get_template_cache, get_decoded_template_cache, get_single_flight, get_source_cache,
+    get_watermark_cache, get_font_cache, get_text_mask_cache, is_transient_fetch_error
+)
+
+try:
+    from PIL import ImageCms
+except ImportError:  # Pillow compilé sans littlecms : conversion CMYK générique
+    ImageCms = None
+
+# Nombre maximum de téléchargements simultanés pour une liste d'images
+MAX_DOWNLOAD_WORKERS = int(os.getenv("MAX_DOWNLOAD_WORKERS", "6"))
+# Nombre maximum de pixels d'une image téléchargée (rejetée avant décodage au-delà)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "60000000"))
+# Nombre maximum de pixels d'un template rendu par bandes (libvips, jamais décodé en entier)
+TILED_MAX_IMAGE_PIXELS = int(os.getenv("TILED_MAX_IMAGE_PIXELS", "400000000"))
+# Octets lus au maximum pour identifier le format et les dimensions d'une image
+IMAGE_PROBE_BYTES = 512 * 1024
+# Plus forte réduction (puissance de deux) conservée dans la pyramide des photos sources
+PYRAMID_MAX_FACTOR = 32
+# Threads OpenCV par processus (les enfants prefork de Celery se partagent déjà les cœurs)
+OPENCV_NUM_THREADS = int(os.getenv("OPENCV_NUM_THREADS", "1"))
+# Marge de suréchantillonnage des filtres non ponctuels (cartoon), appliqués à la taille placée
+FILTER_OVERSAMPLING = float(os.getenv("FILTER_OVERSAMPLING", "1.5"))
+# Compromis vitesse/qualité des redimensionnements quand le job n'en précise pas (fast, balanced, high)
+RESIZE_QUALITY = os.getenv("RESIZE_QUALITY", "balanced")
+# Dossier des polices (api/fonts, soit /app/fonts dans l'image Docker)
+FONT_DIR = os.getenv("FONT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts"))
+# Tailles chargées dans le cache des polices au démarrage du worker, pour chaque police de l'API
+# (polices x tailles doit rester sous FONT_CACHE_MAX_ENTRIES)
+FONT_PRELOAD_SIZES = [int(size) for size in os.getenv("FONT_PRELOAD_SIZES", "20,24,32,48,64").split(",") if size.strip()]
+
+# Fichier de chaque nom de police accepté par l'API
+_FONT_FILES = {
+    "arial": "arial.ttf",
+    "tnr": "TimesNewRoman.ttf",
+    "helvetica": "Helvetica.ttf",
+    "verdana": "Verdana.ttf",
+    "avenir": "AvenirNextCyr-Regular.ttf",
+    "roboto": "Roboto-Medium.ttf",
+}
+
+def resolve_font_path(font_name: Optional[str]) -> str:
+    """
+    Chemin du fichier d'une police dans FONT_DIR : fichier d'un nom connu de l'API,
+    sinon le nom lui-même comme nom de fichier (sans extension).
+    """
+    name = (font_name or "arial").lower()
+    return os.path.join(FONT_DIR, _FONT_FILES.get(name, f"{font_name}.ttf"))
+
+def get_font(font_name: Optional[str], font_size: int) -> ImageFont.FreeTypeFont:
+    """
+    Police TrueType partagée par le processus pour ce nom et cette taille.
+
+    Raises:
+        OSError: Si le fichier de police est introuvable ou illisible
+    """
+    return get_font_cache().get_font(resolve_font_path(font_name), font_size)
+
+def warm_font_cache(sizes: Optional[List[int]] = None) -> int:
+    """
+    Charge chaque police de l'API dans le cache des polices du processus, aux tailles
+    FONT_PRELOAD_SIZES (démarrage du worker) : les premiers jobs trouvent ces polices
+    déjà analysées. Une police introuvable est signalée dès le démarrage.
+
+    Args:
+        sizes (Optional[List[int]]): Tailles à charger (par défaut FONT_PRELOAD_SIZES)
+
+    Returns:
+        int: Nombre de polices chargées dans le cache
+    """
+    logger = logging.getLogger(__name__)
+    sizes = FONT_PRELOAD_SIZES if sizes is None else sizes
+    loaded = 0
+    for font_name in sorted(_FONT_FILES):
+        for size in sizes:
+            try:
+                get_font(font_name, size)
+                loaded += 1
+            except OSError as e:
+                logger.warning(f"Police {font_name} non préchargée: {str(e)}")
+                break
+    logger.info(f"{loaded} police(s) préchargée(s) depuis {FONT_DIR} (tailles {sizes})")
+    return loaded
 
 def apply_watermark(
     img: Image,
@@ -15,11 +107,15 @@ def apply_watermark(
     color: str = "000000",  # Noir par défaut
     transparency: int = 100,  # De 0 (transparent) à 255 (opaque)
     repeat_count: int = 5,  # Nombre de répétitions du texte sur l'image
+    in_place: bool = False,
 ) -> Image:
     """
     Applique un filigrane sur une image avec des répétitions diagonales.
     La taille de la police est automatiquement proportionnelle à la taille de l'image.
 
+    Le texte est rastérisé une seule fois par processus (cache des filigranes) puis
+    fusionné uniquement sur les zones qu'il recouvre.
+
     Args:
         img (Image): L'image sur laquelle appliquer le filigrane.
         text (str): Le texte du filigrane.
@@ -27,24 +123,11 @@ def apply_watermark(
         color (str): Couleur hexadécimale du texte (par défaut noir "000000").
         transparency (int): Transparence du texte (0 transparent, 255 opaque).
         repeat_count (int): Nombre de répétitions du texte en diagonale.
+        in_place (bool): Fusionne directement dans `img` si son mode est conservé (L, RGB, RGBA).
 
     Returns:
         Image: L'image avec le filigrane appliqué.
     """
-    # Sélectionner un chemin de police dynamique
-    font_path = ''
-    match font_name:
-        case "arial":
-            font_path = "/usr/share/fonts/arial.ttf"
-        case "tnr":
-            font_path = "/usr/share/fonts/TimesNewRoman.ttf"
-        case "helvetica":
-            font_path = "/usr/share/fonts/Helvetica.ttf"
-        case "verdana":
-            font_path = "/usr/share/fonts/Verdana.ttf"
-        case "avenir":
-            font_path = "/usr/share/fonts/AvenirNextCyr-Regular.ttf"
-
     # Obtenir les dimensions de l'image
     img_width, img_height = img.size
 
@@ -52,43 +135,141 @@ def apply_watermark(
     base_font_size = min(img_width, img_height) // 20  # 5% de la plus petite dimension
     font_size = max(base_font_size, 10)  # S'assurer que la taille de police est raisonnable
 
+    tile, (offset_x, offset_y) = get_watermark_tile(text, font_name, font_size, color, transparency)
+
+    # Les niveaux de gris restent sur un canal si le filigrane est lui-même gris
+    neutral = color[0:2].lower() == color[2:4].lower() == color[4:6].lower()
+    if img.mode == "L" and not neutral:
+        result = convert_mode(img, "RGB")
+    elif img.mode == "LA":
+        result = convert_mode(img, "RGBA")
+    elif img.mode not in ("L", "RGB", "RGBA"):
+        result = convert_mode(img, "RGB")
+    else:
+        result = img if in_place else img.copy()
+
+    # Répartir les filigranes en diagonale
+    step_x = img_width // (repeat_count + 1)  # Espacement horizontal entre les filigranes
+    step_y = img_height // (repeat_count + 1)  # Espacement vertical entre les filigranes
+
+    for i in range(repeat_count + 1):
+        # Position relative en diagonale, fusion limitée à l'emprise du texte
+        position = (step_x * i + offset_x, step_y * i + offset_y)
+        if result.mode == "RGBA":
+            # Composition alpha : la transparence de l'image placée est préservée
+            # (alpha_composite refuse les positions négatives : la tuile est alors rognée)
+            skip_x, skip_y = max(0, -position[0]), max(0, -position[1])
+            result.alpha_composite(tile, (position[0] + skip_x, position[1] + skip_y), (skip_x, skip_y))
+        else:
+            result.paste(tile, position, tile)
+
+    return result
+
+
+def get_watermark_tile(
+    text: str,
+    font_name: str,
+    font_size: int,
+    color: str,
+    transparency: int,
+) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Retourne le texte d'un filigrane rastérisé sur une tuile RGBA à sa seule emprise.
+
+    Args:
+        text (str): Le texte du filigrane.
+        font_name (str): Nom de la police.
+        font_size (int): Taille de la police en pixels.
+        color (str): Couleur hexadécimale du texte.
+        transparency (int): Opacité du texte (0 à 255).
+
+    Returns:
+        Tuple[Image.Image, Tuple[int, int]]: La tuile (partagée, à ne pas modifier) et son
+        décalage par rapport à la position d'ancrage du texte.
+    """
+    key = (text, font_name, font_size, color, transparency)
+    cache = get_watermark_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
     try:
-        font = ImageFont.truetype(font_path, font_size)
+        font = get_font(font_name, font_size)
     except IOError:
-        print("Font not found. Using default font.")
+        logging.getLogger(__name__).warning(f"Police {font_name} introuvable, police par défaut utilisée pour le filigrane")
         font = ImageFont.load_default()
 
-    # Crée un calque transparent pour le filigrane
-    watermark_layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
-    draw = ImageDraw.Draw(watermark_layer)
-
     # Convertir la couleur hexadécimale en RGBA avec transparence
     color_with_transparency = tuple(int(color[i:i+2], 16) for i in (0, 2, 4)) + (transparency,)
 
-    # Répartir les filigranes en diagonale
-    step_x = img_width // (repeat_count + 1)  # Espacement horizontal entre les filigranes
-    step_y = img_height // (repeat_count + 1)  # Espacement vertical entre les filigranes
+    # Emprise exacte du texte par rapport à son point d'ancrage
+    left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text, font=font)
+    tile = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (255, 255, 255, 0))
+    ImageDraw.Draw(tile).text((-left, -top), text, font=font, fill=color_with_transparency)
 
-    for i in range(repeat_count + 1):
-        # Position relative en diagonale
-        x = step_x * i
-        y = step_y * i
+    cache.put(key, tile, (left, top))
+    return tile, (left, top)
 
-        # Ajouter le texte en diagonale
-        draw.text((x, y), text, font=font, fill=color_with_transparency)
 
-    # Combiner le filigrane avec l'image d'origine
-    return Image.alpha_composite(img.convert("RGBA"), watermark_layer).convert("RGB")
 
+class ResizeQuality(str, Enum):
+    FAST = "fast"             # Réduction entière maximale puis BILINEAR
+    BALANCED = "balanced"     # Réduction entière jusqu'à 2x de la cible puis BICUBIC
+    HIGH = "high"             # Réduction entière jusqu'à 3x de la cible puis LANCZOS
 
+# Filtre final et écart conservé après la réduction entière (reducing_gap) de chaque niveau
+_RESIZE_SETTINGS = {
+    ResizeQuality.FAST: (Image.Resampling.BILINEAR, 1.0),
+    ResizeQuality.BALANCED: (Image.Resampling.BICUBIC, 2.0),
+    ResizeQuality.HIGH: (Image.Resampling.LANCZOS, 3.0),
+}
 
-def apply_resize_template(result_img: Image.Image, new_width: int) -> Image.Image:
+def resolve_resize_quality(quality: Optional[Union[str, ResizeQuality]] = None) -> ResizeQuality:
+    """
+    Convertit la qualité demandée par un job en ResizeQuality (RESIZE_QUALITY par défaut).
+    
+    Raises:
+        ValueError: Si la qualité demandée est inconnue
+    """
+    try:
+        return ResizeQuality(quality or RESIZE_QUALITY)
+    except ValueError:
+        raise ValueError(f"Qualité de redimensionnement inconnue : {quality}")
+
+def resize_image(
+    img: Image.Image,
+    size: Tuple[int, int],
+    quality: Optional[Union[str, ResizeQuality]] = None,
+    box: Optional[Tuple[float, float, float, float]] = None,
+) -> Image.Image:
+    """
+    Redimensionne une image en deux temps pour les fortes réductions : une réduction
+    entière par blocs (Image.reduce) peu coûteuse, puis le filtre final sur le reste.
+    
+    Args:
+        img (Image.Image): L'image à redimensionner
+        size (Tuple[int, int]): Dimensions finales
+        quality (Optional[Union[str, ResizeQuality]]): Compromis vitesse/qualité (RESIZE_QUALITY par défaut)
+        box (Optional[Tuple]): Zone de l'image source à redimensionner (toute l'image par défaut)
+        
+    Returns:
+        Image.Image: L'image redimensionnée
+    """
+    resample, reducing_gap = _RESIZE_SETTINGS[resolve_resize_quality(quality)]
+    return img.resize(size, resample, box=box, reducing_gap=reducing_gap)
+
+def apply_resize_template(
+    result_img: Image.Image,
+    new_width: int,
+    quality: Optional[Union[str, ResizeQuality]] = None,
+) -> Image.Image:
     """
     Redimensionne une image en préservant la qualité maximale.
     
     Args:
         result_img (Image.Image): L'image à redimensionner
         new_width (int): La nouvelle largeur souhaitée en pixels
+        quality (Optional[Union[str, ResizeQuality]]): Compromis vitesse/qualité des réductions
         
     Returns:
         Image.Image: L'image redimensionnée
@@ -103,17 +284,27 @@ def apply_resize_template(result_img: Image.Image, new_width: int) -> Image.Imag
 
     # Pour une réduction de taille
     if new_width < width:
-        # Utiliser BOX pour un meilleur rendu lors de la réduction
-        return result_img.resize((new_width, new_height), Image.Resampling.BOX)
+        # Réduction entière par blocs puis filtre final selon la qualité demandée
+        return resize_image(result_img, (new_width, new_height), quality)
     else:
         # Pour un agrandissement, utiliser BICUBIC sans filtrage
         return result_img.resize((new_width, new_height), Image.Resampling.BICUBIC, reducing_gap=None)
 
 
 
+def configure_opencv_threads(num_threads: Optional[int] = None) -> None:
+    """
+    Fixe le nombre de threads utilisés par OpenCV dans le processus courant.
+    Chaque enfant prefork de Celery occupe déjà un cœur : par défaut OpenCV reste
+    mono-thread pour ne pas surcharger la machine (OPENCV_NUM_THREADS).
+    """
+    cv2.setNumThreads(OPENCV_NUM_THREADS if num_threads is None else num_threads)
+
 def apply_cartoon_filter(pil_img: Image.Image) -> Image.Image:
     """
     Applique un filtre cartoon à une image PIL avec un minimum de traitement.
+    Le traitement se fait directement sur le tampon RGB (sans passage par BGR)
+    et le masque des contours est appliqué sur place.
     
     Args:
         pil_img (Image.Image): L'image PIL à transformer
@@ -121,68 +312,564 @@ def apply_cartoon_filter(pil_img: Image.Image) -> Image.Image:
     Returns:
         Image.Image: L'image avec le filtre cartoon appliqué
     """
-    print(f"Type de l'image reçue : {type(pil_img)}")
-    
-    img = np.array(pil_img)
-    print(f"Shape de l'image convertie en NumPy : {img.shape}")
-    
-    if img.shape[-1] == 3:  # RGB image
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    else:
+    if pil_img.mode != 'RGB':
         raise ValueError("L'image d'entrée n'est pas au format RGB.")
 
+    # Une seule copie : PIL -> tableau NumPy (H, W, 3) contigu
+    img = np.asarray(pil_img)
+
     # Réduction du flou médian pour préserver plus de détails
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
     gray = cv2.medianBlur(gray, 3)  # Réduit de 5 à 3 pour moins de flou
     
     # Ajustement des paramètres pour moins de distorsion
     edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
                                 cv2.THRESH_BINARY, 7, 5)  # Réduit de 9 à 7
                                 
-    # Réduction de l'intensité du filtre bilatéral
+    # Réduction de l'intensité du filtre bilatéral (symétrique en canaux : RGB ou BGR indifférent)
     color = cv2.bilateralFilter(img, 5, 200, 200)  # Réduit de 9 à 5
     
-    cartoon = cv2.bitwise_and(color, color, mask=edges)
-    cartoon_rgb = cv2.cvtColor(cartoon, cv2.COLOR_BGR2RGB)
-    print("Filtre cartoon appliqué avec succès.")
-    return Image.fromarray(cartoon_rgb)
+    # Les contours valent 0 ou 255 : le ET binaire met les contours en noir, sur place
+    cv2.bitwise_and(color, cv2.merge((edges, edges, edges)), dst=color)
+    return Image.fromarray(color, 'RGB')
 
 
-def load_image(image_url: Union[str, List[str]], is_template: bool = False) -> Union[Image.Image, List[Image.Image]]:
+def fetch_images(image_urls: List[str], max_workers: Optional[int] = None) -> List[bytes]:
     """
-    Charge une image ou une liste d'images depuis une URL ou une liste d'URLs.
+    Télécharge une liste d'images en parallèle, sans les décoder.
+    Les contenus sont retournés dans l'ordre des URLs, quel que soit l'ordre d'arrivée ;
+    chaque URL distincte n'est téléchargée qu'une fois.
     
     Args:
-        image_url (Union[str, List[str]]): URL unique ou liste d'URLs des images à charger
-        is_template (bool): Si True, l'URL est considérée comme unique même si c'est une liste
+        image_urls (List[str]): Liste des URLs des images à télécharger
+        max_workers (Optional[int]): Nombre maximum de téléchargements simultanés
+            (par défaut MAX_DOWNLOAD_WORKERS)
         
     Returns:
-        Union[Image.Image, List[Image.Image]]: Une image ou une liste d'images PIL
+        List[bytes]: Le contenu brut de chaque image, dans l'ordre de image_urls
         
     Raises:
-        ValueError: Si l'URL est invalide ou si l'image ne peut pas être chargée
+        ValueError: Si l'une des images ne peut pas être téléchargée
     """
-    logger = logging.getLogger(__name__)
+    if not image_urls:
+        return []
+
+    # Une URL répétée dans la liste n'est téléchargée qu'une fois
+    unique_urls = list(dict.fromkeys(image_urls))
+    workers = max(1, min(max_workers or MAX_DOWNLOAD_WORKERS, len(unique_urls)))
+    if workers == 1:
+        contents = [fetch_image(url) for url in unique_urls]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch_image") as executor:
+            # map conserve l'ordre et propage la première erreur rencontrée
+            contents = list(executor.map(fetch_image, unique_urls))
+
+    by_url = dict(zip(unique_urls, contents))
+    return [by_url[url] for url in image_urls]
+
+def load_images(
+    image_urls: List[str],
+    max_workers: Optional[int] = None,
+    target_sizes: Optional[List[Optional[Tuple[int, int]]]] = None,
+) -> List[Image.Image]:
+    """
+    Charge une liste d'images en parallèle.
+    Les images sont retournées dans l'ordre des URLs, quel que soit l'ordre d'arrivée.
+    Une URL répétée est chargée une seule fois : ses occurrences partagent la même
+    image, qui ne doit donc pas être modifiée sur place.
     
-    if isinstance(image_url, list) and not is_template:
-        return [load_image(url, is_template=True) for url in image_url]
+    Args:
+        image_urls (List[str]): Liste des URLs des images à charger
+        max_workers (Optional[int]): Nombre maximum de téléchargements simultanés
+            (par défaut MAX_DOWNLOAD_WORKERS)
+        target_sizes (Optional[List[Optional[Tuple[int, int]]]]): Taille minimale utile
+            de chaque image (voir decode_image), None pour un décodage pleine résolution
+        
+    Returns:
+        List[Image.Image]: Les images PIL, dans l'ordre de image_urls
+        
+    Raises:
+        ValueError: Si l'une des images ne peut pas être chargée
+    """
+    if not image_urls:
+        return []
+
+    sizes = list(target_sizes or [])
+    sizes += [None] * (len(image_urls) - len(sizes))
+
+    # Une URL répétée n'est chargée qu'une fois, à la plus grande taille demandée
+    sizes_by_url = {}
+    for url, size in zip(image_urls, sizes):
+        sizes_by_url.setdefault(url, []).append(size)
+    unique_urls = list(sizes_by_url)
+    unique_sizes = [largest_target_size(sizes_by_url[url]) for url in unique_urls]
+
+    workers = max(1, min(max_workers or MAX_DOWNLOAD_WORKERS, len(unique_urls)))
+    if workers == 1:
+        images = [load_image(url, True, size) for url, size in zip(unique_urls, unique_sizes)]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load_image") as executor:
+            # map conserve l'ordre et propage la première erreur rencontrée
+            images = list(executor.map(lambda url, size: load_image(url, True, size), unique_urls, unique_sizes))
+
+    by_url = dict(zip(unique_urls, images))
+    return [by_url[url] for url in image_urls]
+
+def check_image_pixels(size: Tuple[int, int], max_pixels: Optional[int] = None) -> None:
+    """
+    Vérifie qu'une image reste dans le budget de pixels du worker.
     
-    if isinstance(image_url, list):
-        image_url = image_url[0]
+    Raises:
+        ValueError: Si l'image dépasse max_pixels (par défaut MAX_IMAGE_PIXELS)
+    """
+    max_pixels = max_pixels or MAX_IMAGE_PIXELS
+    width, height = size
+    if width * height > max_pixels:
+        raise ValueError(f"Image trop grande ({width}x{height} = {width * height} pixels > {max_pixels})")
+
+_pillow_limit_lock = threading.Lock()
+
+@contextmanager
+def template_pixel_limit():
+    """
+    Relève le garde-fou de Pillow contre les bombes de décompression au budget
+    TILED_MAX_IMAGE_PIXELS, le temps de lire l'en-tête d'un template (rendu par bandes
+    au-delà de MAX_IMAGE_PIXELS, jamais décodé en entier par Pillow). Le reste du
+    processus garde la limite de Pillow ; à n'utiliser qu'autour d'une lecture d'en-tête.
+    """
+    with _pillow_limit_lock:
+        previous = Image.MAX_IMAGE_PIXELS
+        if previous is not None:
+            Image.MAX_IMAGE_PIXELS = max(previous, TILED_MAX_IMAGE_PIXELS)
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = previous
+
+def probe_template_header(buffer: bytes) -> bool:
+    """probe_image_header pour un template : budget TILED_MAX_IMAGE_PIXELS."""
+    with template_pixel_limit():
+        return probe_image_header(buffer, TILED_MAX_IMAGE_PIXELS)
+
+def probe_image_header(buffer: bytes, max_pixels: Optional[int] = None) -> bool:
+    """
+    Identifie le format et les dimensions d'une image à partir de ses premiers octets.
+    Utilisé pendant le téléchargement pour rejeter une image trop grande avant de
+    recevoir la totalité du contenu.
     
+    Args:
+        buffer (bytes): Les octets reçus jusqu'ici
+        max_pixels (Optional[int]): Budget de pixels (par défaut MAX_IMAGE_PIXELS)
+        
+    Returns:
+        bool: True si l'en-tête a pu être lu (ou si l'on renonce), False s'il faut plus de données
+        
+    Raises:
+        ValueError: Si les dimensions annoncées dépassent le budget de pixels
+    """
     try:
-        logger.info(f"Tentative de chargement de l'image: {image_url}")
-        response = requests.get(image_url, timeout=30)  # Timeout après 30 secondes
-        response.raise_for_status()  # Lève une exception si le status n'est pas 2xx
+        with Image.open(BytesIO(buffer)) as img:
+            size, fmt = img.size, img.format
+    except Exception:
+        # En-tête incomplet : on attend la suite, dans la limite de IMAGE_PROBE_BYTES
+        return len(buffer) >= IMAGE_PROBE_BYTES
+
+    check_image_pixels(size, max_pixels)
+    logging.getLogger(__name__).info(f"En-tête lu après {len(buffer)} octets: {fmt} {size[0]}x{size[1]}")
+    return True
+
+def decode_image(content: bytes, target_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    Décode le contenu d'une image et corrige son orientation selon les métadonnées EXIF.
+    
+    Si target_size est fourni et que l'image est un JPEG, le décodage se fait à
+    échelle réduite (mode draft de libjpeg : 1/2, 1/4 ou 1/8) en choisissant la plus
+    petite échelle dont les deux dimensions restent supérieures ou égales à target_size.
+    
+    Args:
+        content (bytes): Les octets de l'image (JPEG, PNG, WebP...)
+        target_size (Optional[Tuple[int, int]]): Taille minimale (largeur, hauteur) utile
         
-        img = Image.open(BytesIO(response.content))
+    Returns:
+        Image.Image: L'image PIL correctement orientée
+    """
+    img = Image.open(BytesIO(content))
+    check_image_pixels(img.size)
+    if target_size and img.format == "JPEG":
+        original_size = img.size
+        # draft ne fait rien pour les formats autres que JPEG
+        img.draft(img.mode, target_size)
+        if img.size != original_size:
+            logging.getLogger(__name__).info(f"Décodage réduit (draft): {original_size} -> {img.size}")
+    return ImageOps.exif_transpose(img)
+
+# Compteurs des conversions de mode explicites du processus (ex. "CMYK->RGB")
+_conversion_stats: dict = {}
+_conversion_stats_lock = threading.Lock()
+# Transformations ICC CMYK -> sRGB déjà construites, indexées par l'empreinte du profil
+_cmyk_transforms: dict = {}
+_cmyk_transforms_lock = threading.Lock()
+
+def get_conversion_stats() -> dict:
+    """Compteurs des conversions de mode effectuées par le processus, par paire de modes."""
+    with _conversion_stats_lock:
+        return dict(_conversion_stats)
+
+def _count_conversion(source_mode: str, mode: str) -> None:
+    with _conversion_stats_lock:
+        key = f"{source_mode}->{mode}"
+        _conversion_stats[key] = _conversion_stats.get(key, 0) + 1
+
+def convert_mode(img: Image.Image, mode: str) -> Image.Image:
+    """Convertit une image dans un autre mode en comptant la passe de conversion."""
+    if img.mode == mode:
+        return img
+    _count_conversion(img.mode, mode)
+    return img.convert(mode)
+
+def has_transparency(img: Image.Image) -> bool:
+    """Indique si l'image a réellement des pixels non opaques (pas seulement un canal alpha)."""
+    if img.mode in ("RGBA", "LA", "PA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+def _get_cmyk_transform(profile: bytes):
+    """Transformation ICC du profil CMYK vers sRGB, construite une seule fois par processus."""
+    key = hashlib.sha1(profile).hexdigest()
+    with _cmyk_transforms_lock:
+        transform = _cmyk_transforms.get(key)
+        if transform is None:
+            transform = ImageCms.buildTransform(
+                ImageCms.ImageCmsProfile(BytesIO(profile)),
+                ImageCms.createProfile("sRGB"),
+                "CMYK",
+                "RGB",
+            )
+            _cmyk_transforms[key] = transform
+        return transform
+
+def cmyk_to_rgb(img: Image.Image) -> Image.Image:
+    """
+    Convertit une image CMYK en RGB. Avec un profil ICC embarqué (JPEG des laboratoires
+    d'impression), la transformation du profil est réutilisée d'une image à l'autre ;
+    sinon la conversion directe de Pillow est utilisée.
+    """
+    profile = img.info.get("icc_profile")
+    if profile and ImageCms is not None:
+        try:
+            transform = _get_cmyk_transform(profile)
+        except (OSError, ImageCms.PyCMSError) as e:
+            logging.getLogger(__name__).warning(f"Profil ICC CMYK inutilisable, conversion directe: {str(e)}")
+        else:
+            _count_conversion("CMYK", "RGB")
+            return ImageCms.applyTransform(img, transform)
+    return convert_mode(img, "RGB")
+
+def normalize_source_mode(img: Image.Image) -> Image.Image:
+    """
+    Ramène une photo source à l'un des modes L, LA, RGB ou RGBA.
+    Les images en niveaux de gris restent sur un canal, et le canal alpha n'est
+    conservé que si l'image a réellement des zones transparentes.
+    
+    Args:
+        img (Image.Image): La photo décodée
         
-        # Corriger l'orientation automatiquement selon les métadonnées EXIF
-        img = ImageOps.exif_transpose(img)
+    Returns:
+        Image.Image: La photo dans un mode géré par tout le pipeline
+    """
+    match img.mode:
+        case "L" | "RGB":
+            return img
+        case "LA" | "RGBA":
+            return img if has_transparency(img) else convert_mode(img, img.mode[:-1])
+        case "CMYK":
+            return cmyk_to_rgb(img)
+        case "1":
+            return convert_mode(img, "L")
+        case "P" | "PA":
+            return convert_mode(img, "RGBA" if has_transparency(img) else "RGB")
+        case "I;16" | "I;16L" | "I;16B":
+            # 16 bits par pixel : on garde les 8 bits de poids fort (convert('L') écrêterait)
+            _count_conversion(img.mode, "L")
+            return Image.fromarray((np.asarray(img) >> 8).astype(np.uint8), "L")
+        case _:
+            return convert_mode(img, "RGB")
+
+def normalize_template_mode(img: Image.Image) -> Image.Image:
+    """
+    Ramène un template en RGB, le mode du canevas et du JPEG final.
+    Les zones réellement transparentes sont posées sur un fond blanc.
+    """
+    img = normalize_source_mode(img)
+    if img.mode in ("LA", "RGBA"):
+        _count_conversion(img.mode, "RGB")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, (0, 0), img)
+        return background
+    return convert_mode(img, "RGB")
+
+def oriented_size(img: Image.Image) -> Tuple[int, int]:
+    """Dimensions d'une image ouverte (non décodée) une fois l'orientation EXIF appliquée."""
+    orientation = img.getexif().get(0x0112, 1)
+    return (img.height, img.width) if orientation in (5, 6, 7, 8) else img.size
+
+def pyramid_factor(full_size: Tuple[int, int], target_size: Optional[Tuple[int, int]]) -> int:
+    """
+    Choisit le niveau de pyramide d'une photo source : la plus forte réduction
+    1/facteur (puissance de deux) dont les deux dimensions couvrent encore target_size.
+    """
+    if not target_size:
+        return 1
+    factor = 1
+    while (factor * 2 <= PYRAMID_MAX_FACTOR
+           and full_size[0] // (factor * 2) >= target_size[0]
+           and full_size[1] // (factor * 2) >= target_size[1]):
+        factor *= 2
+    return factor
+
+def decode_level(content: bytes, factor: int) -> Image.Image:
+    """
+    Décode une image réduite d'un facteur puissance de deux, orientation EXIF appliquée.
+    Les JPEG sont réduits jusqu'à 1/8 par libjpeg (draft), le reste par moyenne de blocs.
+    """
+    img = Image.open(BytesIO(content))
+    check_image_pixels(img.size)
+    source_width = img.width
+    if factor > 1 and img.format == "JPEG":
+        img.draft(img.mode, (img.width // factor, img.height // factor))
+    # Réduction restante après le décodage réduit
+    remaining = max(1, round(factor * img.width / source_width))
+    if remaining > 1:
+        if img.mode in ("1", "P", "PA") or img.mode.startswith("I;16"):
+            # reduce refuse ces modes (ou moyennerait des indices de palette) : normalisés avant
+            img = normalize_source_mode(ImageOps.exif_transpose(img))
+        img = img.reduce(remaining)
+    return ImageOps.exif_transpose(img)
+
+def load_source(image_url: str, content: bytes, target_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    Retourne une photo source au plus petit niveau de pyramide couvrant target_size.
+    Le niveau est relu depuis le cache des sources s'il existe, sinon décodé puis enregistré.
+    
+    Args:
+        image_url (str): URL de la photo (clé du cache)
+        content (bytes): Octets d'origine de la photo
+        target_size (Optional[Tuple[int, int]]): Taille minimale utile, None pour la pleine résolution
         
-        logger.info(f"Image chargée avec succès. Dimensions: {img.size}")
+    Returns:
+        Image.Image: La photo orientée, réduite d'un facteur puissance de deux
+    """
+    source_cache = get_source_cache()
+    with Image.open(BytesIO(content)) as header:
+        full_size = oriented_size(header)
+    factor = pyramid_factor(full_size, target_size)
+
+    # La pleine résolution n'est pas conservée comme niveau : elle se redécode depuis le .src
+    img = source_cache.get_level(image_url, factor) if factor > 1 else None
+    if img is not None:
+        logging.getLogger(__name__).info(f"Niveau 1/{factor} relu depuis le cache des sources: {img.size}")
+        return normalize_source_mode(img)
+
+    # Mode normalisé avant la mise en cache : une photo CMYK n'est convertie qu'une fois par niveau
+    img = normalize_source_mode(decode_level(content, factor))
+    source_cache.put_level(image_url, factor, img)
+    return img
+
+def largest_target_size(sizes: List[Optional[Tuple[int, int]]]) -> Optional[Tuple[int, int]]:
+    """
+    Combine les tailles cibles de plusieurs placements d'une même image.
+    None (pleine résolution) l'emporte sur toute taille réduite.
+    """
+    if not sizes or any(size is None for size in sizes):
+        return None
+    return (max(w for w, _ in sizes), max(h for _, h in sizes))
+
+def compute_target_size(
+    template_width: int,
+    width_percentage: float,
+    crop_top: float = 0,
+    crop_bottom: float = 0,
+) -> Optional[Tuple[int, int]]:
+    """
+    Calcule la taille minimale à décoder pour une image placée sur le template.
+    
+    L'image placée fait width_percentage % de la largeur du template après rognage
+    et rotation. Quelle que soit la rotation, la largeur placée provient d'au moins
+    min(largeur, hauteur rognée) pixels source : exiger cette taille sur les deux
+    côtés garantit qu'on ne décode jamais moins de pixels que nécessaire.
+    
+    Args:
+        template_width (int): Largeur du template en pixels
+        width_percentage (float): Largeur de l'image placée (en % du template)
+        crop_top (float): Pourcentage rogné en haut
+        crop_bottom (float): Pourcentage rogné en bas
+        
+    Returns:
+        Optional[Tuple[int, int]]: Taille minimale (carrée), ou None si aucune réduction possible
+    """
+    kept = 1 - (crop_top + crop_bottom) / 100
+    if template_width <= 0 or width_percentage <= 0 or kept <= 0:
+        return None
+
+    placed_width = width_percentage / 100 * template_width
+    side = int(np.ceil(placed_width / kept))
+    return (side, side)
+
+def fetch_template(template_url: str) -> CachedContent:
+    """
+    Télécharge un template, ou le revalide dans le cache disque du worker, sans le décoder.
+    Le cache revalide chaque entrée par un GET conditionnel (ETag / Last-Modified).
+    
+    Args:
+        template_url (str): URL du template
+        
+    Returns:
+        CachedContent: Les octets du template et leur empreinte
+        
+    Raises:
+        ValueError: Si le template ne peut pas être téléchargé
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Tentative de chargement du template: {template_url}")
+        # Un seul téléchargement du template à la fois sur le nœud : les tâches qui
+        # attendent relisent ensuite le cache disque mis à jour par la première
+        disk_cache = get_template_cache()
+        wait_start = time.time()
+        return get_single_flight().do(
+            f"template:{template_url}",
+            # Budget des templates rendus par bandes : un template plus grand que
+            # MAX_IMAGE_PIXELS n'est jamais décodé en entier par Pillow
+            lambda: disk_cache.fetch(template_url, probe=probe_template_header),
+            reuse=lambda: disk_cache.read_fresh(template_url, since=wait_start),
+        )
+        
+    except requests.exceptions.Timeout:
+        logger.error(f"Timeout lors du chargement du template: {template_url}")
+        raise ValueError(f"Le chargement de l'image a pris trop de temps: {template_url}")
+        
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Erreur lors du chargement du template {template_url}: {str(e)}")
+        raise ValueError(f"Impossible de charger l'image depuis l'URL: {template_url}. Erreur: {str(e)}")
+        
+    except Exception as e:
+        logger.error(f"Erreur inattendue lors du chargement du template {template_url}: {str(e)}")
+        raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
+
+def template_size(cached: CachedContent) -> Tuple[int, int]:
+    """
+    Dimensions d'un template (orientation EXIF appliquée), lues dans l'en-tête seul.
+
+    Raises:
+        ValueError: Si les octets ne sont pas une image lisible
+    """
+    try:
+        with template_pixel_limit(), Image.open(BytesIO(cached.content)) as header:
+            return oriented_size(header)
+    except Exception as e:
+        raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
+
+def load_template(template_url: str, cached: Optional[CachedContent] = None) -> Image.Image:
+    """
+    Charge un template en passant par le cache disque du worker.
+    Le template décodé est conservé en mémoire : il est partagé entre les tâches
+    du processus et doit être copié avant toute modification.
+    
+    Args:
+        template_url (str): URL du template
+        cached (Optional[CachedContent]): Octets déjà obtenus par fetch_template
+        
+    Returns:
+        Image.Image: Le template PIL (partagé, en lecture seule)
+        
+    Raises:
+        ValueError: Si le template ne peut pas être chargé
+    """
+    logger = logging.getLogger(__name__)
+    if cached is None:
+        cached = fetch_template(template_url)
+    
+    try:
+        decoded_cache = get_decoded_template_cache()
+        img = decoded_cache.get(template_url, cached.sha256)
+        if img is not None:
+            logger.info(f"Template décodé servi depuis la mémoire. Dimensions: {img.size}")
+            return img
+
+        # Mode RGB fixé une fois pour toutes avant la mise en cache (load force aussi le
+        # décodage complet avant de partager l'image entre threads)
+        img = decode_image(cached.content)
+        img.load()
+        img = normalize_template_mode(img)
+        decoded_cache.put(template_url, cached.sha256, img)
+        logger.info(f"Template chargé {'depuis le cache' if cached.from_cache else 'depuis le réseau'}. Dimensions: {img.size}")
         return img
         
+    except Exception as e:
+        logger.error(f"Erreur inattendue lors du chargement du template {template_url}: {str(e)}")
+        raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
+
+def _download_image(image_url: str) -> bytes:
+    source_cache = get_source_cache()
+    content = source_cache.get_source(image_url)
+    if content is not None:
+        return content
+
+    # Photo en cache mais plus récente que SOURCE_CACHE_TTL : GET conditionnel
+    headers = source_cache.revalidation_headers(image_url)
+    try:
+        # Session partagée, timeout adapté à l'hôte, rejet dès l'en-tête si l'image est trop grande
+        response = http_get(image_url, probe=probe_image_header, headers=headers)
+        if headers and response.status_code == 304:
+            content = source_cache.confirm_source(image_url)
+            if content is not None:
+                return content
+            # Copie évincée entre-temps : téléchargement complet
+            response = http_get(image_url, probe=probe_image_header)
+        response.raise_for_status()  # Lève une exception si le status n'est pas 2xx
+    except Exception as e:
+        stale = source_cache.read_stale(image_url) if headers and is_transient_fetch_error(e) else None
+        if stale is None:
+            raise
+        logging.getLogger(__name__).warning(f"Revalidation impossible, photo servie depuis le cache: {image_url}")
+        return stale
+
+    with Image.open(BytesIO(response.content)) as header:
+        source_cache.put_source(image_url, response.content, oriented_size(header),
+                                response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.content
+
+def fetch_image(image_url: str) -> bytes:
+    """
+    Télécharge le contenu brut d'une image via la session HTTP partagée, ou le relit
+    depuis le cache des photos sources s'il y est depuis moins de SOURCE_CACHE_TTL (au-delà,
+    la copie en cache est revalidée par un GET conditionnel).
+    Les demandes simultanées de la même URL dans le processus partagent un seul téléchargement.
+    
+    Args:
+        image_url (str): URL de l'image
+        
+    Returns:
+        bytes: Le contenu de l'image
+        
+    Raises:
+        ValueError: Si l'URL est invalide, si l'image ne peut pas être téléchargée
+            ou si elle dépasse MAX_DOWNLOAD_BYTES / MAX_IMAGE_PIXELS
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Tentative de chargement de l'image: {image_url}")
+        # Un seul téléchargement de la photo à la fois sur le nœud : les processus qui
+        # attendent relisent ensuite le cache des sources mis à jour par le premier
+        wait_start = time.time()
+        return get_single_flight().do(
+            f"image:{image_url}",
+            lambda: _download_image(image_url),
+            reuse=lambda: get_source_cache().read_fresh(image_url, since=wait_start),
+        )
+        
     except requests.exceptions.Timeout:
         logger.error(f"Timeout lors du chargement de l'image: {image_url}")
         raise ValueError(f"Le chargement de l'image a pris trop de temps: {image_url}")
@@ -195,6 +882,45 @@ def load_image(image_url: Union[str, List[str]], is_template: bool = False) -> U
         logger.error(f"Erreur inattendue lors du chargement de l'image {image_url}: {str(e)}")
         raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
 
+def load_image(
+    image_url: Union[str, List[str]],
+    is_template: bool = False,
+    target_size: Optional[Tuple[int, int]] = None,
+) -> Union[Image.Image, List[Image.Image]]:
+    """
+    Charge une image ou une liste d'images depuis une URL ou une liste d'URLs.
+    Les listes sont téléchargées en parallèle (voir load_images).
+    
+    Args:
+        image_url (Union[str, List[str]]): URL unique ou liste d'URLs des images à charger
+        is_template (bool): Si True, l'URL est considérée comme unique même si c'est une liste
+        target_size (Optional[Tuple[int, int]]): Taille minimale utile, permet de charger
+            un niveau réduit de la photo (voir load_source)
+        
+    Returns:
+        Union[Image.Image, List[Image.Image]]: Une image ou une liste d'images PIL
+        
+    Raises:
+        ValueError: Si l'URL est invalide ou si l'image ne peut pas être chargée
+    """
+    logger = logging.getLogger(__name__)
+    
+    if isinstance(image_url, list) and not is_template:
+        return load_images(image_url)
+    
+    if isinstance(image_url, list):
+        image_url = image_url[0]
+    
+    content = fetch_image(image_url)
+    try:
+        img = load_source(image_url, content, target_size)
+        logger.info(f"Image chargée avec succès. Dimensions: {img.size}")
+        return img
+        
+    except Exception as e:
+        logger.error(f"Erreur inattendue lors du chargement de l'image {image_url}: {str(e)}")
+        raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
+
 def apply_rotation(img: Image.Image, rotation: int) -> Image.Image:
     """
     Applique une rotation à une image en préservant la qualité.
@@ -238,6 +964,171 @@ def apply_crop(img: Image.Image, dh: float, db: float) -> Image.Image:
     bottom = int(height - ((db / 100) * height))
     return img.crop((0, top, width, bottom))
 
+@dataclass
+class PlacementPlan:
+    """Géométrie d'une image placée : rognage, rotation et redimensionnement en une passe."""
+    crop_box: Tuple[int, int, int, int]
+    rotation: float
+    size: Tuple[int, int]
+    reduce_factor: int = 1
+    matrix: Optional[Tuple[float, ...]] = None
+
+def plan_placement(
+    src_size: Tuple[int, int],
+    crop_top: float,
+    crop_bottom: float,
+    rotation: float,
+    target_width: int,
+) -> PlacementPlan:
+    """
+    Calcule la géométrie finale d'une image placée, équivalente à
+    apply_crop -> apply_rotation -> resize((target_width, hauteur proportionnelle)).
+    
+    Pour un angle quelconque, la rotation (expand=True, comme apply_rotation) et la mise
+    à l'échelle sont combinées en une seule transformation affine exprimée dans l'image
+    rognée, précédée d'une réduction entière par blocs qui limite la réduction restante
+    à moins de 2x (la transformation affine ne filtre pas les hautes fréquences).
+    
+    Args:
+        src_size (Tuple[int, int]): Dimensions de l'image source
+        crop_top (float): Pourcentage à rogner depuis le haut (0-100)
+        crop_bottom (float): Pourcentage à rogner depuis le bas (0-100)
+        rotation (float): Angle de rotation en degrés (sens anti-horaire)
+        target_width (int): Largeur finale en pixels
+        
+    Returns:
+        PlacementPlan: La géométrie à appliquer avec render_placement
+        
+    Raises:
+        ValueError: Si les dimensions finales sont nulles ou négatives
+    """
+    width, height = src_size
+    top = int((crop_top / 100) * height)
+    bottom = int(height - ((crop_bottom / 100) * height))
+    crop_w, crop_h = width, bottom - top
+    angle = rotation % 360
+
+    if angle in (0, 180):
+        rotated_w, rotated_h = crop_w, crop_h
+    elif angle in (90, 270):
+        rotated_w, rotated_h = crop_h, crop_w
+    else:
+        # Même matrice et même boîte englobante que Image.rotate(expand=True)
+        radians = -math.radians(angle)
+        a, b = round(math.cos(radians), 15), round(math.sin(radians), 15)
+        d, e = -b, a
+        cx, cy = crop_w / 2.0, crop_h / 2.0
+        c = a * -cx + b * -cy + cx
+        f = d * -cx + e * -cy + cy
+        xs, ys = [], []
+        for x, y in ((0, 0), (crop_w, 0), (crop_w, crop_h), (0, crop_h)):
+            xs.append(a * x + b * y + c)
+            ys.append(d * x + e * y + f)
+        rotated_w = math.ceil(max(xs)) - math.floor(min(xs))
+        rotated_h = math.ceil(max(ys)) - math.floor(min(ys))
+        shift_x, shift_y = -(rotated_w - crop_w) / 2.0, -(rotated_h - crop_h) / 2.0
+        c, f = a * shift_x + b * shift_y + c, d * shift_x + e * shift_y + f
+
+    if crop_w <= 0 or crop_h <= 0 or rotated_h <= 0:
+        raise ValueError(f"Dimensions invalides après rognage : width={crop_w}, height={crop_h}")
+    target_height = int(target_width / (rotated_w / rotated_h))
+    if target_width <= 0 or target_height <= 0:
+        raise ValueError(f"Dimensions invalides : width={target_width}, height={target_height}")
+
+    plan = PlacementPlan((0, top, width, bottom), angle, (target_width, target_height))
+    if angle in (0, 90, 180, 270):
+        return plan
+
+    # Réduction entière préalable : la réduction restante reste inférieure à 2x
+    scale_x, scale_y = rotated_w / target_width, rotated_h / target_height
+    plan.reduce_factor = max(1, int(min(scale_x, scale_y)))
+    k = plan.reduce_factor
+    plan.matrix = (a * scale_x / k, b * scale_y / k, c / k, d * scale_x / k, e * scale_y / k, f / k)
+    return plan
+
+def render_placement(
+    img: Image.Image,
+    plan: PlacementPlan,
+    quality: Optional[Union[str, ResizeQuality]] = None,
+) -> Image.Image:
+    """
+    Produit l'image placée décrite par plan_placement en une seule passe de rééchantillonnage.
+    Les coins découverts par une rotation sont remplis comme par apply_rotation.
+    """
+    quality = resolve_resize_quality(quality)
+    if img.mode in ("1", "P"):
+        img = convert_mode(img, "RGB")
+
+    if plan.matrix is None:
+        # Angle droit : rognage et redimensionnement en une passe, puis permutation exacte des pixels
+        size = plan.size if plan.rotation in (0, 180) else plan.size[::-1]
+        placed = resize_image(img, size, quality, box=plan.crop_box)
+        match plan.rotation:
+            case 90:
+                return placed.transpose(Image.Transpose.ROTATE_90)
+            case 180:
+                return placed.transpose(Image.Transpose.ROTATE_180)
+            case 270:
+                return placed.transpose(Image.Transpose.ROTATE_270)
+        return placed
+
+    if plan.reduce_factor > 1:
+        img = img.reduce(plan.reduce_factor, box=plan.crop_box)
+    else:
+        img = img.crop(plan.crop_box)
+    # La transformation affine n'accepte que NEAREST, BILINEAR et BICUBIC
+    resample = Image.Resampling.BILINEAR if quality is ResizeQuality.FAST else Image.Resampling.BICUBIC
+    return img.transform(plan.size, Image.Transform.AFFINE, plan.matrix, resample=resample)
+
+def filter_commutes_with_geometry(_filter: str) -> bool:
+    """
+    Indique si le filtre donne le même résultat avant ou après le rééchantillonnage
+    (filtres point à point), ce qui permet de fusionner rognage, rotation et redimensionnement.
+    """
+    return _filter != 'cartoon'
+
+def render_filtered_placement(
+    img: Image.Image,
+    crop_top: float,
+    crop_bottom: float,
+    rotation: float,
+    target_width: int,
+    _filter: str,
+    oversampling: Optional[float] = None,
+    quality: Optional[Union[str, ResizeQuality]] = None,
+) -> Image.Image:
+    """
+    Produit l'image placée et filtrée, en appliquant le filtre à la résolution de sortie.
+    
+    Les filtres point à point sont appliqués sur l'image déjà placée. Les autres
+    (cartoon) sont appliqués sur l'image placée suréchantillonnée de oversampling,
+    puis ramenée à la taille finale : leur coût ne dépend plus de la résolution source.
+    
+    Args:
+        img (Image.Image): L'image source
+        crop_top (float): Pourcentage à rogner depuis le haut (0-100)
+        crop_bottom (float): Pourcentage à rogner depuis le bas (0-100)
+        rotation (float): Angle de rotation en degrés
+        target_width (int): Largeur finale en pixels
+        _filter (str): Le filtre à appliquer (voir apply_filter)
+        oversampling (Optional[float]): Marge de suréchantillonnage (par défaut FILTER_OVERSAMPLING)
+        quality (Optional[Union[str, ResizeQuality]]): Compromis vitesse/qualité des redimensionnements
+        
+    Returns:
+        Image.Image: L'image placée, filtrée, à sa taille finale
+    """
+    plan = plan_placement(img.size, crop_top, crop_bottom, rotation, target_width)
+    oversampling = FILTER_OVERSAMPLING if oversampling is None else oversampling
+    if _filter == 'nb':
+        # Passage en niveaux de gris avant la géométrie : un seul canal à rééchantillonner
+        img = apply_filter(img, _filter)
+    if filter_commutes_with_geometry(_filter) or oversampling <= 1:
+        return apply_filter(render_placement(img, plan, quality), _filter)
+
+    work_plan = plan_placement(img.size, crop_top, crop_bottom, rotation, int(round(target_width * oversampling)))
+    filtered = apply_filter(render_placement(img, work_plan, quality), _filter)
+    return resize_image(filtered, plan.size, quality)
+
 def apply_filter(img: Image.Image, _filter: str) -> Image.Image:
     """
     Applique un filtre spécifique à une image PIL.
@@ -250,16 +1141,21 @@ def apply_filter(img: Image.Image, _filter: str) -> Image.Image:
     Returns:
         Image.Image: L'image avec le filtre appliqué
     """
-    print(f"Filtre demandé : {_filter}, Type de l'image : {type(img)}")
+    logging.getLogger(__name__).debug(f"Filtre demandé : {_filter}, mode de l'image : {img.mode}")
 
     match _filter:
         case 'nb':
-            # Conversion directe en niveaux de gris sans post-traitement
-            return img.convert('L')
+            # Conversion directe en niveaux de gris sans post-traitement (alpha conservé)
+            return convert_mode(img, 'LA' if img.mode in ('RGBA', 'LA') else 'L')
         case 'cartoon':
-            return apply_cartoon_filter(img)
+            if img.mode in ('RGBA', 'LA'):
+                # Le filtre travaille en RGB, la transparence est reportée telle quelle
+                result = apply_cartoon_filter(convert_mode(img, 'RGB'))
+                result.putalpha(img.getchannel('A'))
+                return result
+            return apply_cartoon_filter(convert_mode(img, 'RGB'))
         case _:
-            print(f"Filtre inconnu : {_filter}. Aucun filtre appliqué.")
+            logging.getLogger(__name__).debug(f"Filtre inconnu : {_filter}. Aucun filtre appliqué.")
             return img
 
 class TextRenderStrategy(str, Enum):
@@ -283,6 +1179,7 @@ class TextConfig:
     stroke_width: int = 0
     shadow_offset: Tuple[int, int] = (2, 2)
     background_blur: bool = False
+    line_gap: float = 5
 
 class TextRenderer:
     def __init__(self, config: TextConfig):
@@ -290,36 +1187,21 @@ class TextRenderer:
         self._prepare_font()
 
     def _prepare_font(self):
-        """Prépare la police avec le bon chemin et la bonne taille."""
-        font_path = ''
-        match self.config.font_name.lower():
-            case "arial":
-                font_path = "/app/fonts/arial.ttf"
-            case "tnr":
-                font_path = "/app/fonts/TimesNewRoman.ttf"
-            case "helvetica":
-                font_path = "/app/fonts/Helvetica.ttf"
-            case "verdana":
-                font_path = "/app/fonts/Verdana.ttf"
-            case "avenir":
-                font_path = "/app/fonts/AvenirNextCyr-Regular.ttf"
-            case "roboto":
-                font_path = "/app/fonts/Roboto-Medium.ttf"
-            case _:
-                font_path = "/app/fonts/arial.ttf"  # Police par défaut
+        """Prépare la police avec le bon chemin et la bonne taille (cache de polices du processus)."""
+        font_path = resolve_font_path(self.config.font_name)
         
         logger = logging.getLogger(__name__)
-        logger.info(f"Chargement de la police : {font_path}")
+        logger.debug(f"Chargement de la police : {font_path}")
         
         try:
-            self.font = ImageFont.truetype(font_path, self.config.font_size)
-            logger.info(f"Police chargée avec succès : {self.config.font_name}, taille={self.config.font_size}")
+            self.font = get_font_cache().get_font(font_path, self.config.font_size)
+            logger.debug(f"Police chargée avec succès : {self.config.font_name}, taille={self.config.font_size}")
         except Exception as e:
             logger.error(f"Erreur lors du chargement de la police {font_path}: {str(e)}")
             logger.warning("Tentative de chargement de la police de secours (arial.ttf)")
             try:
                 # Essayer de charger arial comme police de secours avec la taille demandée
-                self.font = ImageFont.truetype("/app/fonts/arial.ttf", self.config.font_size)
+                self.font = get_font("arial", self.config.font_size)
                 logger.info("Police de secours (arial.ttf) chargée avec succès")
             except Exception as e:
                 logger.error(f"Échec du chargement de la police de secours : {str(e)}")
@@ -334,11 +1216,7 @@ class TextRenderer:
         return draw.textsize(text, font=self.font)
 
     def _render_basic(self, img: Image.Image) -> Image.Image:
-        """Rendu basique du texte avec qualité optimisée."""
-        # Créer une image temporaire avec canal alpha
-        text_overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(text_overlay)
-        
+        """Rendu basique du texte avec qualité optimisée, limité à l'emprise du texte."""
         width, height = img.size
         x = (self.config.x / 100) * width
         y = (self.config.y / 100) * height
@@ -350,73 +1228,153 @@ class TextRenderer:
         if hasattr(self, 'scale_factor'):
             line_height = int(line_height * self.scale_factor)
         
-        for i, line in enumerate(lines):
-            pos_x, pos_y = x, y + i * line_height
-            
-            if hasattr(self, 'scale_factor'):
-                # Pour la police par défaut, créer une image plus grande
-                large_overlay = Image.new('RGBA', 
-                    (int(width * self.scale_factor), int(height * self.scale_factor)), 
+        measure = ImageDraw.Draw(Image.new('L', (1, 1)))
+        fill = "#" + self.config.color
+        
+        if hasattr(self, 'scale_factor'):
+            # Police par défaut : chaque ligne est dessinée dans un espace agrandi de
+            # scale_factor puis réduite avec BOX, sur la seule zone de la ligne
+            large_size = (int(width * self.scale_factor), int(height * self.scale_factor))
+            step_x, step_y = large_size[0] / width, large_size[1] / height
+            layers = []
+            for i, line in enumerate(lines):
+                scaled_x = x * self.scale_factor
+                scaled_y = (y + i * line_height) * self.scale_factor
+                left, top, right, bottom = measure.textbbox((scaled_x, scaled_y), line, font=self.font, align=self.config.align)
+                # Zone de sortie couverte par la ligne, limitée au canevas
+                box = (max(0, math.floor(left / step_x)), max(0, math.floor(top / step_y)),
+                       min(width, math.ceil(right / step_x)), min(height, math.ceil(bottom / step_y)))
+                if box[2] <= box[0] or box[3] <= box[1]:
+                    continue
+                # Origine entière dans l'espace agrandi, avant le point d'ancrage : même
+                # position sous-pixel qu'en pleine page (Pillow arrondit autrement en négatif)
+                origin_x = max(0, min(math.floor(box[0] * step_x), math.floor(scaled_x)))
+                origin_y = max(0, min(math.floor(box[1] * step_y), math.floor(scaled_y)))
+                large_overlay = Image.new('RGBA',
+                    (math.ceil(box[2] * step_x) - origin_x, math.ceil(box[3] * step_y) - origin_y),
                     (255, 255, 255, 0))
-                temp_draw = ImageDraw.Draw(large_overlay)
-                
-                # Dessiner le texte à haute résolution
-                scaled_x = pos_x * self.scale_factor
-                scaled_y = pos_y * self.scale_factor
-                temp_draw.text(
-                    (scaled_x, scaled_y), 
+                ImageDraw.Draw(large_overlay).text(
+                    (scaled_x - origin_x, scaled_y - origin_y), 
                     line, 
                     font=self.font, 
-                    fill="#" + self.config.color, 
+                    fill=fill, 
                     align=self.config.align,
                     antialias=True
                 )
                 
                 # Redimensionner avec BOX pour un meilleur rendu
-                resized_text = large_overlay.resize(img.size, Image.Resampling.BOX)
-                text_overlay = Image.alpha_composite(text_overlay, resized_text)
-            else:
-                # Pour les polices TrueType, utiliser le rendu antialiasé natif
+                resized_text = large_overlay.resize(
+                    (box[2] - box[0], box[3] - box[1]), Image.Resampling.BOX,
+                    box=(box[0] * step_x - origin_x, box[1] * step_y - origin_y,
+                         box[2] * step_x - origin_x, box[3] * step_y - origin_y))
+                layers.append((resized_text, box))
+            if not layers:
+                return img
+            left, top = min(b[0] for _, b in layers), min(b[1] for _, b in layers)
+            right, bottom = max(b[2] for _, b in layers), max(b[3] for _, b in layers)
+            text_overlay = Image.new('RGBA', (right - left, bottom - top), (255, 255, 255, 0))
+            for layer, box in layers:
+                text_overlay.alpha_composite(layer, dest=(box[0] - left, box[1] - top))
+        else:
+            # Polices TrueType : rendu antialiasé natif dans un calque à la taille du texte.
+            # L'origine du calque est entière et avant le point d'ancrage : la position
+            # sous-pixel des glyphes est la même qu'en pleine page
+            boxes = [measure.textbbox((x, y + i * line_height), line, font=self.font, align=self.config.align)
+                     for i, line in enumerate(lines)]
+            left = max(0, math.floor(min(x, *(b[0] for b in boxes))))
+            top = max(0, math.floor(min(y, *(b[1] for b in boxes))))
+            right = min(width, math.ceil(max(b[2] for b in boxes)))
+            bottom = min(height, math.ceil(max(b[3] for b in boxes)))
+            if right <= left or bottom <= top:
+                return img
+            text_overlay = Image.new('RGBA', (right - left, bottom - top), (255, 255, 255, 0))
+            draw = ImageDraw.Draw(text_overlay)
+            for i, line in enumerate(lines):
                 draw.text(
-                    (pos_x, pos_y), 
+                    (x - left, y + i * line_height - top), 
                     line, 
                     font=self.font, 
-                    fill="#" + self.config.color, 
+                    fill=fill, 
                     align=self.config.align,
                     antialias=True
                 )
         
-        # Fusionner le texte avec l'image d'origine
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        result = Image.alpha_composite(img, text_overlay)
+        # Fusionner le texte avec l'image d'origine, sur la seule zone couverte par le texte
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        bbox = text_overlay.getbbox()
+        if bbox is not None:
+            region = text_overlay.crop(bbox)
+            dest = (left + bbox[0], top + bbox[1])
+            if img.mode == 'RGBA':
+                img.alpha_composite(region, dest=dest)
+            else:
+                img.paste(region, dest, region)
         
-        return result.convert('RGB') if img.mode == 'RGBA' else result
+        return img.convert('RGB') if img.mode == 'RGBA' else img
 
     def _render_high_res(self, img: Image.Image) -> Image.Image:
-        """Rendu haute résolution avec downscaling optimisé."""
+        """
+        Rendu haute résolution avec downscaling optimisé, limité à l'emprise du texte.
+        
+        Le texte est rastérisé en masque de couverture à 4 fois la résolution sur sa seule
+        zone, réduit avec BOX sur la grille des pixels de la page, puis la couleur est posée
+        à travers ce masque.
+        """
+        if hasattr(self, 'scale_factor'):
+            # Police par défaut (taille fixe) : déjà suréchantillonnée par le rendu basique
+            return self._render_basic(img)
+        
         # Augmenter la résolution de travail
         scale_factor = 4  # Facteur fixe pour une meilleure qualité
+        try:
+            font = get_font_cache().get_font(self.font.path, self.config.font_size * scale_factor)
+        except (AttributeError, OSError):
+            return self._render_basic(img)
         
-        # Créer une image temporaire haute résolution
-        temp_img = Image.new('RGBA', 
-            (img.width * scale_factor, img.height * scale_factor),
-            (255, 255, 255, 0))
-        
-        # Ajuster la taille de la police pour la haute résolution
-        original_size = self.config.font_size
-        self.config.font_size = int(original_size * scale_factor)
-        self._prepare_font()
+        width, height = img.size
+        x = (self.config.x / 100) * width * scale_factor
+        y = (self.config.y / 100) * height * scale_factor
+        lines = self.config.text.split("<br>")
+        line_height = self.config.font_size * scale_factor + 5
         
-        # Rendre le texte en haute résolution
-        temp_img = self._render_basic(temp_img)
+        # Zone de la page couverte par le texte. L'origine (multiple du facteur, avant le
+        # point d'ancrage) garde les glyphes à la même position que sur une page agrandie
+        measure = ImageDraw.Draw(Image.new('L', (1, 1)))
+        boxes = [measure.textbbox((x, y + i * line_height), line, font=font, align=self.config.align)
+                 for i, line in enumerate(lines)]
+        left = max(0, math.floor(min(x, *(b[0] for b in boxes)) / scale_factor))
+        top = max(0, math.floor(min(y, *(b[1] for b in boxes)) / scale_factor))
+        right = min(width, math.ceil(max(b[2] for b in boxes) / scale_factor))
+        bottom = min(height, math.ceil(max(b[3] for b in boxes) / scale_factor))
+        if right <= left or bottom <= top:
+            return img
         
-        # Restaurer la taille de police originale
-        self.config.font_size = original_size
-        self._prepare_font()
+        # Masque haute résolution de la seule zone du texte
+        mask = Image.new('L', ((right - left) * scale_factor, (bottom - top) * scale_factor), 0)
+        draw = ImageDraw.Draw(mask)
+        for i, line in enumerate(lines):
+            draw.text(
+                (x - left * scale_factor, y + i * line_height - top * scale_factor),
+                line,
+                font=font,
+                fill=255,
+                align=self.config.align
+            )
         
         # Redimensionner avec BOX pour un meilleur rendu
-        return temp_img.resize(img.size, Image.Resampling.BOX)
+        mask = mask.reduce(scale_factor)
+        
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        color = tuple(int(self.config.color[i:i + 2], 16) for i in (0, 2, 4))
+        if img.mode == 'RGBA':
+            layer = Image.new('RGBA', mask.size, color + (0,))
+            layer.putalpha(mask)
+            img.alpha_composite(layer, dest=(left, top))
+            return img.convert('RGB')
+        img.paste(color, (left, top, right, bottom), mask)
+        return img
 
     def _render_outlined(self, img: Image.Image) -> Image.Image:
         """Rendu avec contour."""
@@ -494,6 +1452,25 @@ class TextRenderer:
                 return self._render_high_res(img)
         return img
 
+def load_font(font_name: str, font_size: int) -> ImageFont.ImageFont:
+    """
+    Charge la police d'un bloc de texte, avec repli sur Arial puis sur la police par défaut.
+    
+    Args:
+        font_name (str): Nom de la police, ou nom du fichier (sans extension) dans FONT_DIR
+        font_size (int): Taille de la police en pixels
+        
+    Returns:
+        ImageFont.ImageFont: La police chargée (partagée par le cache de polices)
+    """
+    try:
+        return get_font(font_name, font_size)
+    except OSError:
+        try:
+            return get_font("arial", font_size)
+        except OSError:
+            return ImageFont.load_default()
+
 def add_text(
     img: Image.Image,
     text: Optional[str] = None,  # Changé de "Sample Text" à None
@@ -504,46 +1481,120 @@ def add_text(
     color: str = "FFFFFF",
     align: Optional[str] = "left",
     strategy: TextRenderStrategy = TextRenderStrategy.BASIC,
-    dpi: int = 300
+    dpi: int = 300,
+    in_place: bool = False
 ) -> Image.Image:
     """
     Ajoute du texte sur une image.
     Si aucun texte n'est spécifié, retourne l'image inchangée.
+
+    Args:
+        in_place: Dessine directement sur `img` au lieu d'une copie. À réserver au
+            canevas mutable d'un job (jamais à une image partagée par un cache).
     """
     # Si pas de texte, retourner l'image inchangée
     if text is None:
         return img
 
-    # Créer une copie de l'image
-    result = img.copy()
-    draw = ImageDraw.Draw(result)
+    block = TextConfig(text=text, font_name=font_name, font_size=font_size, x=x, y=y,
+                       color=color, align=align, strategy=strategy, dpi=dpi)
+    return add_text_layer(img, [block], in_place=in_place)
+
+def layout_text_lines(block: TextConfig, size: Tuple[int, int]) -> List[Tuple[float, float, str]]:
+    """
+    Position (en pixels) de chaque ligne d'un bloc de texte sur une image de cette taille.
+    Les lignes sont séparées par <br> et espacées de font_size + line_gap pixels.
+    """
+    width, height = size
+    pos_x = (block.x / 100) * width
+    pos_y = (block.y / 100) * height
+    line_height = block.font_size + block.line_gap
+    return [(pos_x, pos_y + i * line_height, line) for i, line in enumerate(block.text.split("<br>"))]
+
+def render_text_mask(
+    line: str,
+    font: ImageFont.ImageFont,
+    pos_x: float,
+    pos_y: float,
+    align: Optional[str] = "left",
+    strategy: TextRenderStrategy = TextRenderStrategy.BASIC
+) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Masque de couverture d'une ligne de texte, servi par le cache des masques de texte.
     
-    # Charger la police
-    try:
-        font = ImageFont.truetype(f"/app/fonts/{font_name}.ttf", font_size)
-    except:
-        try:
-            font = ImageFont.truetype("/app/fonts/arial.ttf", font_size)
-        except:
-            font = ImageFont.load_default()
+    La clé contient la position sous-pixel du point d'ancrage (au 1/64 de pixel, la
+    précision de FreeType) : un masque servi par le cache donne les mêmes pixels qu'un
+    nouveau rendu à cette position.
     
-    # Calculer les positions en pixels
-    width, height = img.size
-    pos_x = (x / 100) * width
-    pos_y = (y / 100) * height
-    
-    # Gérer le texte multiligne
-    lines = text.split("<br>")
-    line_height = font_size + 5
-    
-    # Dessiner chaque ligne
-    for i, line in enumerate(lines):
-        draw.text(
-            (pos_x, pos_y + i * line_height),
-            line,
-            font=font,
-            fill="#" + color,
-            align=align
-        )
+    Args:
+        line (str): Ligne de texte
+        font (ImageFont.ImageFont): Police chargée
+        pos_x (float): Abscisse du point d'ancrage sur la page
+        pos_y (float): Ordonnée du point d'ancrage sur la page
+        align (Optional[str]): Alignement (lignes contenant des retours à la ligne)
+        strategy (TextRenderStrategy): Rendu qui a produit le masque
+        
+    Returns:
+        Tuple[Image.Image, Tuple[int, int]]: Le masque L (partagé, à ne pas modifier) et
+        la position de son coin haut gauche sur la page
+    """
+    anchor_x, anchor_y = math.floor(pos_x), math.floor(pos_y)
+    frac_x = math.floor((pos_x - anchor_x) * 64) / 64
+    frac_y = math.floor((pos_y - anchor_y) * 64) / 64
+    
+    # Polices chargées depuis un fichier uniquement (la police par défaut n'a pas de chemin)
+    font_path = getattr(font, "path", None)
+    key = (line, font_path, font.size, align, strategy.value, frac_x, frac_y) if isinstance(font_path, str) else None
+    cache = get_text_mask_cache()
+    entry = cache.get(key) if key is not None else None
+    if entry is None:
+        # Emprise de la ligne, origine entière avant le point d'ancrage (jamais de position
+        # négative, que Pillow arrondirait autrement)
+        bbox = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((frac_x, frac_y), line, font=font, align=align)
+        left, top = min(0, math.floor(bbox[0])), min(0, math.floor(bbox[1]))
+        right, bottom = math.ceil(bbox[2]), math.ceil(bbox[3])
+        mask = Image.new('L', (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((frac_x - left, frac_y - top), line, font=font, fill=255, align=align)
+        entry = (mask, (left, top))
+        if key is not None:
+            cache.put(key, mask, (left, top))
+    mask, (left, top) = entry
+    return mask, (anchor_x + left, anchor_y + top)
+
+def add_text_layer(
+    img: Image.Image,
+    blocks: List[TextConfig],
+    in_place: bool = False
+) -> Image.Image:
+    """
+    Ajoute en une seule passe tous les blocs de texte d'un job.
+    Le canevas est copié au plus une fois ; chaque ligne est posée à travers son
+    masque de couverture, partagé entre les jobs par le cache des masques de texte.
+
+    Args:
+        img (Image.Image): Image sur laquelle écrire
+        blocks (List[TextConfig]): Blocs de texte, dessinés dans l'ordre (text None ignoré)
+        in_place (bool): Dessine directement sur `img` au lieu d'une copie. À réserver au
+            canevas mutable d'un job (jamais à une image partagée par un cache).
+
+    Returns:
+        Image.Image: L'image avec les textes
+    """
+    blocks = [block for block in blocks if block.text is not None]
+    if not blocks:
+        return img
+
+    # Créer une copie de l'image, sauf si l'appelant possède déjà le canevas
+    result = img if in_place else img.copy()
+    
+    for block in blocks:
+        # Charger la police
+        font = load_font(block.font_name, block.font_size)
+        fill = ImageColor.getcolor("#" + block.color, result.mode)
+        
+        # Chaque ligne : couleur posée à travers son masque (rastérisé une fois par processus)
+        for pos_x, pos_y, line in layout_text_lines(block, result.size):
+            mask, position = render_text_mask(line, font, pos_x, pos_y, block.align)
+            result.paste(fill, position, mask)
     
     return result
\ No newline at end of file
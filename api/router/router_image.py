@@ -32,6 +32,11 @@ class FilterType(str, Enum):
     cartoon = "cartoon"
     none = "none"
 
+class ResizeQuality(str, Enum):
+    fast = "fast"
+    balanced = "balanced"
+    high = "high"
+
 
 @router.get("/create_image/", description=description_create_image)
 def create_image(
@@ -106,6 +111,11 @@ def create_image(
         alias="result_w",
         description="Largeur en pixels de l'image finale, avec conservation du ratio. Exemple : 800."
     ),
+    resize_quality: Optional[ResizeQuality] = Query(
+        None,
+        alias="resize_quality",
+        description="Compromis vitesse/qualité des redimensionnements (fast, balanced, high). Par défaut : configuration du worker."
+    ),
     text: list[str] = Query(
         None,
         alias="text",
@@ -236,6 +246,7 @@ def create_image(
         "image_url": image_url,
         "result_file": result_file,
         "result_w": result_w,
+        "resize_quality": resize_quality.value if resize_quality else None,
         "image_x": image_x,
         "image_y": image_y,
         "image_rotation": image_rotation,
@@ -5,10 +5,22 @@ from fastapi.testclient import TestClient
 from main import app
 from celery_worker import celery_app
 from unittest.mock import MagicMock, patch
+import cache_utils
 
 # Configure le PYTHONPATH pour accéder aux modules du projet
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    """Caches du worker vides et stockés dans un dossier temporaire propre à chaque test"""
+    monkeypatch.setattr(cache_utils, "_template_cache", cache_utils.TemplateDiskCache(str(tmp_path / "templates")))
+    monkeypatch.setattr(cache_utils, "_decoded_template_cache", cache_utils.DecodedTemplateCache())
+    monkeypatch.setattr(cache_utils, "_source_cache", cache_utils.SourcePyramidCache(str(tmp_path / "sources")))
+    monkeypatch.setattr(cache_utils, "_watermark_cache", cache_utils.WatermarkTileCache())
+    monkeypatch.setattr(cache_utils, "_font_cache", cache_utils.FontCache())
+    monkeypatch.setattr(cache_utils, "_text_mask_cache", cache_utils.TextMaskCache())
+    monkeypatch.setattr(cache_utils, "_single_flight", cache_utils.SingleFlight(str(tmp_path / "locks")))
+
 @pytest.fixture
 def test_client():
     """Fixture pour créer un client de test FastAPI"""
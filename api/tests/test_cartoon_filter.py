@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmark_cartoon import legacy_cartoon_filter
+from photo_utils import apply_cartoon_filter
+
+
+def test_cartoon_matches_legacy_implementation():
+    """Le traitement direct en RGB donne exactement le résultat de la version d'origine."""
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (120, 200, 3), dtype=np.uint8))
+
+    assert apply_cartoon_filter(img).tobytes() == legacy_cartoon_filter(img).tobytes()
+
+
+def test_cartoon_requires_rgb():
+    """Les images non RGB sont refusées comme avant."""
+    with pytest.raises(ValueError, match="RGB"):
+        apply_cartoon_filter(Image.new('L', (50, 50)))
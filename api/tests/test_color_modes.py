@@ -0,0 +1,97 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import photo_utils
+from photo_utils import (
+    apply_filter, cmyk_to_rgb, get_conversion_stats, normalize_source_mode,
+    normalize_template_mode, render_filtered_placement,
+)
+
+
+@pytest.mark.parametrize("mode, color, expected", [
+    ("L", 128, "L"),
+    ("RGB", (1, 2, 3), "RGB"),
+    ("1", 1, "L"),
+    ("CMYK", (0, 255, 255, 0), "RGB"),
+    ("RGBA", (10, 20, 30, 255), "RGB"),
+    ("RGBA", (10, 20, 30, 100), "RGBA"),
+    ("LA", (50, 255), "L"),
+    ("LA", (50, 0), "LA"),
+])
+def test_normalize_source_mode(mode, color, expected):
+    """Les sources sont ramenées en L, LA, RGB ou RGBA ; l'alpha n'est gardé que s'il sert."""
+    assert normalize_source_mode(Image.new(mode, (8, 8), color)).mode == expected
+
+
+def test_normalize_palette_with_transparency():
+    """Une image en palette avec couleur transparente devient RGBA, sinon RGB."""
+    img = Image.new("P", (8, 8), 0)
+    assert normalize_source_mode(img).mode == "RGB"
+    img.info["transparency"] = 0
+    assert normalize_source_mode(img).mode == "RGBA"
+
+
+def test_normalize_16_bit_keeps_dynamics():
+    """Les images 16 bits sont ramenées sur 8 bits sans écrêtage."""
+    img = Image.new("I;16", (4, 4), 0x8000)
+    result = normalize_source_mode(img)
+    assert result.mode == "L"
+    assert result.getpixel((0, 0)) == 0x80
+
+
+def test_template_transparency_on_white():
+    """Les zones transparentes d'un template sont posées sur du blanc."""
+    img = Image.new("RGBA", (4, 4), (0, 0, 0, 0))
+    img.putpixel((0, 0), (255, 0, 0, 255))
+    result = normalize_template_mode(img)
+    assert result.mode == "RGB"
+    assert result.getpixel((0, 0)) == (255, 0, 0)
+    assert result.getpixel((3, 3)) == (255, 255, 255)
+
+
+def test_cmyk_icc_transform_is_cached(monkeypatch):
+    """La transformation ICC d'un profil CMYK n'est construite qu'une fois par processus."""
+    cms = MagicMock()
+    cms.applyTransform.side_effect = lambda img, transform: Image.new("RGB", img.size)
+    monkeypatch.setattr(photo_utils, "ImageCms", cms)
+    monkeypatch.setattr(photo_utils, "_cmyk_transforms", {})
+
+    for _ in range(3):
+        img = Image.new("CMYK", (4, 4))
+        img.info["icc_profile"] = b"profil-labo"
+        assert cmyk_to_rgb(img).mode == "RGB"
+
+    assert cms.buildTransform.call_count == 1
+    assert cms.applyTransform.call_count == 3
+
+
+def test_grayscale_before_geometry():
+    """Le filtre nb est appliqué avant le rééchantillonnage, avec le même résultat."""
+    rng = np.random.default_rng(2)
+    img = Image.fromarray(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8))
+
+    result = render_filtered_placement(img, 0, 0, 15, 200, 'nb')
+    expected = render_filtered_placement(img, 0, 0, 15, 200, 'none').convert('L')
+
+    assert result.mode == "L" and result.size == expected.size
+    assert np.abs(np.asarray(result, dtype=int) - np.asarray(expected, dtype=int)).max() <= 2
+
+
+def test_filters_keep_alpha():
+    """Les filtres conservent la transparence des sources qui en ont."""
+    img = Image.new("RGBA", (40, 40), (200, 100, 50, 0))
+    assert apply_filter(img, 'nb').mode == "LA"
+    cartoon = apply_filter(img, 'cartoon')
+    assert cartoon.mode == "RGBA"
+    assert cartoon.getchannel("A").getextrema() == (0, 0)
+    assert apply_filter(Image.new("L", (40, 40)), 'cartoon').mode == "RGB"
+
+
+def test_conversions_are_counted():
+    """Chaque passe de conversion explicite est comptée par paire de modes."""
+    before = get_conversion_stats().get("CMYK->RGB", 0)
+    normalize_source_mode(Image.new("CMYK", (4, 4)))
+    assert get_conversion_stats()["CMYK->RGB"] == before + 1
@@ -0,0 +1,274 @@
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from PIL import Image
+
+import http_utils
+import photo_utils
+from http_utils import (
+    get_session, http_get, get_connection_stats, get_fetch_stats, reset_session,
+    ResponseTooLarge, DownloadDeadlineExceeded, HostLatencyTracker,
+)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    """Serveur HTTP local supportant le keep-alive."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    reset_session()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    reset_session()
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_is_shared():
+    """La même session est retournée pour un même processus."""
+    reset_session()
+    assert get_session() is get_session()
+    reset_session()
+
+
+def test_session_recreated_after_fork(monkeypatch):
+    """Un changement de pid (fork du worker) crée une nouvelle session."""
+    reset_session()
+    parent_session = get_session()
+    monkeypatch.setattr(http_utils.os, "getpid", lambda: -1)
+    assert get_session() is not parent_session
+    reset_session()
+
+
+def test_connections_are_reused(local_server):
+    """Les requêtes successives vers un même hôte réutilisent la connexion."""
+    for i in range(5):
+        response = http_get(f"{local_server}/{i}.jpg")
+        assert response.content == b"ok"
+
+    stats = get_connection_stats()
+    assert stats["requests"] == 5
+    assert stats["connections"] == 1
+    assert stats["reused"] == 4
+
+
+def test_stats_empty_without_session():
+    """Aucun compteur tant qu'aucune requête n'a été émise."""
+    reset_session()
+    assert get_connection_stats() == {"requests": 0, "connections": 0, "reused": 0}
+
+
+class StreamedResponse:
+    """Réponse simulée qui enregistre le nombre de blocs effectivement lus."""
+
+    def __init__(self, chunks, headers=None, first_byte=0.0, chunk_delay=0.0):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.ok = True
+        self.elapsed = timedelta(seconds=first_byte)
+        self.chunk_delay = chunk_delay
+        self.read_chunks = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        for chunk in self.chunks:
+            time.sleep(self.chunk_delay)
+            self.read_chunks += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def streamed_session(response):
+    session = MagicMock()
+    session.get.return_value = response
+    return patch('http_utils.get_session', return_value=session)
+
+
+def requests_response(chunks):
+    """Vraie réponse requests dont le corps est lu depuis un flux en mémoire."""
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = BytesIO(b"".join(chunks))
+    return response
+
+
+def test_content_length_over_cap_rejected_before_reading():
+    """Une taille annoncée trop grande est rejetée sans lire le corps."""
+    response = StreamedResponse([b"x" * 10] * 10, headers={"Content-Length": "100"})
+
+    with streamed_session(response), pytest.raises(ResponseTooLarge):
+        http_get("https://example.com/big.jpg", max_bytes=50)
+
+    assert response.read_chunks == 0
+    assert response.closed
+
+
+def test_stream_over_cap_interrupted():
+    """Sans Content-Length, le téléchargement s'arrête dès que la limite est franchie."""
+    response = StreamedResponse([b"x" * 10] * 10)
+
+    with streamed_session(response), pytest.raises(ResponseTooLarge):
+        http_get("https://example.com/big.jpg", max_bytes=35)
+
+    assert response.read_chunks == 4
+
+
+def test_stream_content_available():
+    """Le contenu lu en flux reste accessible via response.content."""
+    response = requests_response([b"abc", b"def"])
+
+    with streamed_session(response):
+        assert http_get("https://example.com/a.jpg").content == b"abcdef"
+
+
+def test_probe_rejects_oversized_image_early(monkeypatch):
+    """Une image dont l'en-tête dépasse le budget de pixels est rejetée dès les premiers blocs."""
+    with BytesIO() as bio:
+        Image.new('RGB', (200, 200)).save(bio, format='JPEG')
+        header = bio.getvalue()
+    chunks = [header] + [b"\0" * 1024] * 50
+    response = StreamedResponse(chunks)
+    monkeypatch.setattr(photo_utils, "MAX_IMAGE_PIXELS", 10_000)
+
+    with streamed_session(response), pytest.raises(ValueError, match="Image trop grande"):
+        http_get("https://example.com/huge.jpg", probe=photo_utils.probe_image_header)
+
+    assert response.read_chunks == 1
+    assert response.closed
+
+
+def test_adaptive_timeout_follows_host_latency():
+    """Le timeout suit le p99 de l'hôte une fois assez de mesures collectées."""
+    tracker = HostLatencyTracker()
+    assert tracker.timeout_for("cdn.example.com") == http_utils.HTTP_MAX_TIMEOUT
+
+    for _ in range(50):
+        tracker.record("cdn.example.com", 0.5)
+    tracker.record("cdn.example.com", 1.5)
+
+    assert tracker.timeout_for("cdn.example.com") == pytest.approx(1.5 * http_utils.HTTP_TIMEOUT_MULTIPLIER)
+    assert tracker.hedge_delay_for("cdn.example.com") == pytest.approx(0.5)
+    # Un autre hôte garde les valeurs par défaut
+    assert tracker.hedge_delay_for("autre.example.com") == http_utils.HTTP_HEDGE_DELAY
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    """Suivi des latences vierge, propre au test."""
+    tracker = HostLatencyTracker()
+    monkeypatch.setattr(http_utils, "_latency_tracker", tracker)
+    return tracker
+
+
+def test_latency_measures_first_byte_not_transfer(tracker):
+    """Le timeout de lecture se règle sur le premier octet, pas sur la durée du transfert."""
+    response = StreamedResponse([b"x"] * 5, first_byte=0.01, chunk_delay=0.05)
+
+    with streamed_session(response):
+        http_get("https://cdn.example.com/a.jpg")
+
+    assert list(tracker.samples["cdn.example.com"]) == [pytest.approx(0.01)]
+
+
+def test_failed_attempts_raise_timeout(tracker, monkeypatch):
+    """Les échecs sont comptés au timeout atteint : le timeout peut remonter."""
+    host = "cdn.example.com"
+    for _ in range(http_utils.HTTP_LATENCY_MIN_SAMPLES):
+        tracker.record(host, 0.1)
+    assert tracker.timeout_for(host) == http_utils.HTTP_MIN_TIMEOUT
+
+    def timing_out(url, timeout, max_bytes, probe, **kwargs):
+        raise requests.exceptions.ReadTimeout("lecture trop lente")
+
+    monkeypatch.setattr(http_utils, "_download", timing_out)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        http_get(f"https://{host}/a.jpg")
+    assert tracker.timeout_for(host) == pytest.approx(http_utils.HTTP_MIN_TIMEOUT * http_utils.HTTP_TIMEOUT_MULTIPLIER)
+
+    # Les échecs répétés remontent le timeout jusqu'au plafond
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            http_get(f"https://{host}/a.jpg")
+    assert tracker.timeout_for(host) == http_utils.HTTP_MAX_TIMEOUT
+
+
+def test_download_deadline_bounds_whole_transfer(tracker, monkeypatch):
+    """Un corps qui arrive au goutte-à-goutte est interrompu à HTTP_DOWNLOAD_DEADLINE."""
+    response = StreamedResponse([b"x"] * 50, first_byte=0.01, chunk_delay=0.02)
+    monkeypatch.setattr(http_utils, "HTTP_DOWNLOAD_DEADLINE", 0.1)
+
+    with streamed_session(response), pytest.raises(DownloadDeadlineExceeded):
+        http_get("https://cdn.example.com/a.jpg")
+
+    assert response.read_chunks < 50
+    assert response.closed
+    # Le serveur répondait : le timeout de lecture n'est pas pénalisé
+    assert "cdn.example.com" not in tracker.samples
+
+
+def test_hedged_request_takes_first_answer(monkeypatch):
+    """Si la première requête traîne, la relance est envoyée et sa réponse retenue."""
+    calls = []
+
+    def fake_download(url, timeout, max_bytes, probe, **kwargs):
+        calls.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        if len(calls) == 1:
+            time.sleep(0.5)
+            response._content = b"lente"
+        else:
+            response._content = b"rapide"
+        return response
+
+    monkeypatch.setattr(http_utils, "_download", fake_download)
+    monkeypatch.setattr(http_utils, "HTTP_HEDGE_DELAY", 0.05)
+    before = get_fetch_stats()
+
+    start = time.monotonic()
+    response = http_get("https://lent.example.com/a.jpg", hedge=True)
+
+    assert response.content == b"rapide"
+    assert time.monotonic() - start < 0.4
+    assert len(calls) == 2
+    assert get_fetch_stats()["hedge_wins"] == before["hedge_wins"] + 1
+
+
+def test_hedged_request_not_sent_when_fast(monkeypatch):
+    """Une réponse rapide ne déclenche pas de relance."""
+    calls = []
+
+    def fake_download(url, timeout, max_bytes, probe, **kwargs):
+        calls.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"ok"
+        return response
+
+    monkeypatch.setattr(http_utils, "_download", fake_download)
+    monkeypatch.setattr(http_utils, "HTTP_HEDGE_DELAY", 0.5)
+
+    assert http_get("https://rapide.example.com/a.jpg", hedge=True).content == b"ok"
+    assert len(calls) == 1
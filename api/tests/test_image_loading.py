@@ -0,0 +1,137 @@
+import time
+import threading
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+from photo_utils import load_image, load_images, decode_image, compute_target_size
+
+
+def make_jpeg_bytes(width, height, color='red'):
+    """Crée le contenu JPEG d'une image unie."""
+    with BytesIO() as bio:
+        Image.new('RGB', (width, height), color=color).save(bio, format='JPEG')
+        return bio.getvalue()
+
+
+def fake_get_factory(sizes, delays=None):
+    """Simule http_get : chaque URL renvoie une image de taille connue."""
+    active = {"current": 0, "max": 0}
+    lock = threading.Lock()
+
+    def fake_get(url, timeout=None, **kwargs):
+        with lock:
+            active["current"] += 1
+            active["max"] = max(active["max"], active["current"])
+        try:
+            time.sleep((delays or {}).get(url, 0.05))
+            response = MagicMock(status_code=200, headers={})
+            response.content = make_jpeg_bytes(*sizes[url])
+            response.raise_for_status.return_value = None
+            return response
+        finally:
+            with lock:
+                active["current"] -= 1
+
+    return fake_get, active
+
+
+def test_load_images_preserves_order():
+    """Les images sont retournées dans l'ordre des URLs, même si elles arrivent dans le désordre."""
+    urls = [f"https://example.com/{i}.jpg" for i in range(5)]
+    sizes = {url: (10 + i, 20 + i) for i, url in enumerate(urls)}
+    # La première URL est la plus lente
+    delays = {url: 0.2 - i * 0.04 for i, url in enumerate(urls)}
+    fake_get, _ = fake_get_factory(sizes, delays)
+
+    with patch('photo_utils.http_get', side_effect=fake_get):
+        images = load_image(urls)
+
+    assert [img.size for img in images] == [sizes[url] for url in urls]
+
+
+def test_load_images_bounded_concurrency():
+    """Le nombre de téléchargements simultanés ne dépasse pas max_workers."""
+    urls = [f"https://example.com/{i}.jpg" for i in range(8)]
+    sizes = {url: (10, 10) for url in urls}
+    fake_get, active = fake_get_factory(sizes)
+
+    with patch('photo_utils.http_get', side_effect=fake_get):
+        images = load_images(urls, max_workers=3)
+
+    assert len(images) == 8
+    assert 1 < active["max"] <= 3
+
+
+def test_load_images_propagates_errors():
+    """Une erreur de chargement sur une image remonte en ValueError."""
+    import requests
+
+    def failing_get(url, timeout=None, **kwargs):
+        raise requests.exceptions.ConnectionError("connexion refusée")
+
+    with patch('photo_utils.http_get', side_effect=failing_get):
+        with pytest.raises(ValueError, match="Impossible de charger"):
+            load_images(["https://example.com/a.jpg", "https://example.com/b.jpg"])
+
+
+def test_load_images_empty_list():
+    """Une liste vide ne déclenche aucun téléchargement."""
+    assert load_images([]) == []
+
+
+def test_decode_image_draft_covers_target():
+    """Le décodage réduit garde au moins la taille demandée sur chaque côté."""
+    content = make_jpeg_bytes(2560, 1707)
+
+    img = decode_image(content, (300, 300))
+
+    # 1707 / 4 = 427 >= 300 mais 1707 / 8 = 214 < 300 : échelle 1/4
+    assert img.size == (640, 427)
+    assert decode_image(content).size == (2560, 1707)
+
+
+def test_decode_image_draft_ignored_for_png():
+    """Le mode draft ne concerne que les JPEG."""
+    with BytesIO() as bio:
+        Image.new('RGB', (800, 600)).save(bio, format='PNG')
+        content = bio.getvalue()
+
+    assert decode_image(content, (100, 100)).size == (800, 600)
+
+
+def test_compute_target_size():
+    """La taille cible tient compte de la largeur placée et du rognage."""
+    assert compute_target_size(1000, 30) == (300, 300)
+    assert compute_target_size(1000, 30, 10, 10) == (375, 375)
+    assert compute_target_size(1000, 30, 50, 50) is None
+
+
+def test_repeated_urls_downloaded_once():
+    """Une URL placée deux fois n'est téléchargée et décodée qu'une fois."""
+    urls = ["https://example.com/a.jpg", "https://example.com/b.jpg", "https://example.com/a.jpg"]
+    sizes = {"https://example.com/a.jpg": (30, 20), "https://example.com/b.jpg": (10, 10)}
+    fake_get, _ = fake_get_factory(sizes)
+
+    with patch('photo_utils.http_get', side_effect=fake_get) as mock_get:
+        images = load_images(urls)
+
+    assert mock_get.call_count == 2
+    assert images[0] is images[2]
+    assert [img.size for img in images] == [(30, 20), (10, 10), (30, 20)]
+
+
+def test_repeated_url_decoded_at_largest_target():
+    """La source partagée est décodée à la plus grande taille demandée par ses placements."""
+    content = make_jpeg_bytes(2560, 1707)
+
+    with patch('photo_utils.fetch_image', return_value=content):
+        images = load_images(
+            ["https://example.com/a.jpg", "https://example.com/a.jpg"],
+            target_sizes=[(100, 100), (300, 300)],
+        )
+
+    assert images[0] is images[1]
+    assert images[0].size == (640, 427)
@@ -51,4 +51,92 @@ def test_image_resize_percentage():
         assert mock_load_image.call_count == 2, "load_image devrait être appelé deux fois"
         assert mock_resize.called, "resize devrait être appelé"
         assert mock_paste.called, "paste devrait être appelé"
-        assert mock_upload.called, "upload_file_ftp devrait être appelé" 
\ No newline at end of file
+        assert mock_upload.called, "upload_file_ftp devrait être appelé" 
+
+def test_composition_in_output_space():
+    """Quand result_w réduit le template, il est réduit une seule fois avant la composition."""
+    import imaging_utils
+    from io import BytesIO
+    from cache_utils import CachedContent
+
+    template = Image.new('RGB', (4000, 2000), color='white')
+    buffer = BytesIO()
+    Image.new('RGB', (3000, 2000), color='black').save(buffer, 'JPEG')
+
+    template_bytes = BytesIO()
+    template.save(template_bytes, 'PNG')
+    cached = CachedContent(template_bytes.getvalue(), "sha")
+
+    with patch('utils.fetch_template', return_value=cached), \
+         patch('utils.load_template', return_value=template), \
+         patch('utils.fetch_images', return_value=[buffer.getvalue()]), \
+         patch('imaging_utils.apply_resize_template', wraps=imaging_utils.apply_resize_template) as resize_spy, \
+         patch('imaging_utils.render_filtered_placement', wraps=imaging_utils.render_filtered_placement) as placement_spy, \
+         patch('utils.log_to_ftp'):
+        process_and_upload(
+            template_url="https://example.com/mock_template.jpg",
+            image_url=["https://example.com/mock_image.jpg"],
+            result_file=None, result_w=800,
+            xs=[10], ys=[10], rs=[0], ws=[50], cs=['none'], dhs=[0], dbs=[0],
+            ts=[], tfs=[], tcs=[], tts=[], txs=[], tys=[],
+            ftp_host="mock_host", ftp_username="mock_user", ftp_password="mock_pass",
+            dpi=300, params={}, watermark_text=None
+        )
+
+    # Une seule réduction, appliquée au template avant les placements
+    assert resize_spy.call_count == 1
+    assert resize_spy.call_args.args[0] is template
+    # La largeur placée est calculée sur le canevas de sortie (50 % de 800 px)
+    assert placement_spy.call_args.args[4] == 400
+
+
+def test_text_size_in_output_space_matches_shrunk_template():
+    """Texte composé à la taille de sortie : même emprise que s'il était dessiné sur le template puis réduit."""
+    from io import BytesIO
+    import numpy as np
+    from cache_utils import CachedContent
+    from photo_utils import add_text
+
+    template = Image.new('RGB', (4000, 2000), color='white')
+    template_bytes = BytesIO()
+    template.save(template_bytes, 'PNG')
+    photo = BytesIO()
+    Image.new('RGB', (300, 200), color='white').save(photo, 'JPEG')
+
+    def text_bbox(img):
+        ys, xs = np.nonzero(np.array(img.convert('L')) < 128)
+        return xs.max() - xs.min() + 1, ys.max() - ys.min() + 1
+
+    # Référence : police à l'échelle de result_w, dessinée sur le template plein format puis réduite
+    reference = add_text(template, "Test<br>Ligne", "arial", int(36 * 800 / 1000), 10, 10, "000000")
+    reference = reference.resize((800, 400), Image.Resampling.LANCZOS)
+
+    uploaded = {}
+
+    class FakeFTP:
+        def __init__(self, *args): pass
+        def __enter__(self): return self
+        def __exit__(self, *args): pass
+        def pwd(self): return '/'
+        def cwd(self, path): pass
+        def nlst(self): return []
+        def storbinary(self, cmd, bio): uploaded['img'] = Image.open(BytesIO(bio.read()))
+
+    with patch('utils.fetch_template', return_value=CachedContent(template_bytes.getvalue(), "sha")), \
+         patch('utils.load_template', return_value=template), \
+         patch('utils.fetch_images', return_value=[photo.getvalue()]), \
+         patch('utils.FTP', FakeFTP), \
+         patch('utils.log_to_ftp'):
+        process_and_upload(
+            template_url="https://example.com/mock_template.jpg",
+            image_url=["https://example.com/mock_image.jpg"],
+            result_file="out/result.jpg", result_w=800,
+            xs=[90], ys=[90], rs=[0], ws=[1], cs=['none'], dhs=[0], dbs=[0],
+            ts=["Test<br>Ligne"], tfs=["arial"], tcs=["000000"], tts=[36], txs=[10], tys=[10],
+            ftp_host="mock_host", ftp_username="mock_user", ftp_password="mock_pass",
+            dpi=300, params={}, watermark_text=None
+        )
+
+    expected_w, expected_h = text_bbox(reference)
+    result_w, result_h = text_bbox(uploaded['img'])
+    assert abs(result_w - expected_w) <= 2 and abs(result_h - expected_h) <= 2
@@ -0,0 +1,229 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import imaging_utils
+import photo_utils
+from imaging_utils import PillowBackend, TiledBackend, create_imaging_backend, select_imaging_backend
+
+@pytest.fixture
+def backends():
+    """Suite de parité : le moteur libvips doit donner les mêmes images que Pillow (référence)."""
+    if imaging_utils.pyvips is None:
+        pytest.skip("pyvips/libvips non installés")
+    return PillowBackend(), create_imaging_backend("vips")
+
+
+def make_gradient(width, height):
+    """Image texturée (dégradés) pour comparer les rééchantillonnages."""
+    y, x = np.mgrid[0:height, 0:width]
+    arr = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], -1)
+    return Image.fromarray(arr.astype(np.uint8))
+
+
+def assert_close(expected, result, mean=0.5, shape_only=False):
+    """Mêmes dimensions, même mode et écart moyen par pixel borné."""
+    expected, result = np.asarray(expected, dtype=float), np.asarray(result, dtype=float)
+    assert expected.shape == result.shape
+    if not shape_only:
+        assert np.abs(expected - result).mean() <= mean
+
+
+def test_load_source_parity(backends):
+    """Décodage réduit identique (même niveau de pyramide, même décodeur JPEG)."""
+    pillow, vips = backends
+    buffer = BytesIO()
+    make_gradient(1200, 800).save(buffer, "JPEG", quality=95)
+
+    expected = pillow.load_source("https://example.com/a.jpg", buffer.getvalue(), (300, 300))
+    result = vips.load_source("https://example.com/a.jpg", buffer.getvalue(), (300, 300))
+    assert_close(expected, vips.to_pil(result))
+
+
+@pytest.mark.parametrize("angle", [0, 90, 180, 270])
+def test_crop_and_right_angle_rotation_parity(backends, angle):
+    """Rognage et rotations à angle droit : pixels identiques."""
+    pillow, vips = backends
+    img = make_gradient(300, 200)
+    expected = pillow.rotate(pillow.crop(img, 10, 5), angle)
+    result = vips.rotate(vips.crop(vips.from_pil(img), 10, 5), angle)
+    assert_close(expected, vips.to_pil(result), mean=0)
+
+
+@pytest.mark.parametrize("quality", ["fast", "balanced", "high"])
+def test_resize_parity(backends, quality):
+    """Même taille exacte et rendu quasi identique pour chaque qualité."""
+    pillow, vips = backends
+    img = make_gradient(1200, 800)
+    expected = pillow.resize(img, (301, 199), quality)
+    result = vips.to_pil(vips.resize(vips.from_pil(img), (301, 199), quality))
+    assert result.size == (301, 199)
+    assert_close(expected, result)
+
+
+def test_greyscale_parity(backends):
+    """Mêmes coefficients de luminance que la conversion 'L' de Pillow."""
+    pillow, vips = backends
+    img = make_gradient(200, 100)
+    result = vips.to_pil(vips.greyscale(vips.from_pil(img)))
+    assert result.mode == "L"
+    assert_close(pillow.greyscale(img), result, mean=0.05)
+
+
+@pytest.mark.parametrize("_filter", ["none", "nb", "cartoon"])
+@pytest.mark.parametrize("rotation", [0, 90, 15])
+def test_place_parity(backends, _filter, rotation):
+    """Image placée : même taille que la passe fusionnée de Pillow, rendu très proche."""
+    pillow, vips = backends
+    img = make_gradient(1200, 800)
+    expected = pillow.place(img, 10, 5, rotation, 300, _filter)
+    result = vips.to_pil(vips.place(vips.from_pil(img), 10, 5, rotation, 300, _filter))
+    assert result.mode == expected.mode
+    assert_close(expected, result, mean=1.5)
+
+
+def test_paste_parity(backends):
+    """Collage d'une image grise et d'une image semi-transparente, y compris hors cadre."""
+    pillow, vips = backends
+    canvas = Image.new("RGB", (400, 300), "white")
+    grey = make_gradient(150, 100).convert("L")
+    transparent = Image.new("RGBA", (100, 100), (255, 0, 0, 128))
+
+    expected = pillow.paste(pillow.paste(canvas.copy(), grey, (300, 250)), transparent, (-20, 10))
+    result = vips.from_pil(canvas)
+    result = vips.paste(vips.paste(result, vips.from_pil(grey), (300, 250)), vips.from_pil(transparent), (-20, 10))
+    assert_close(expected, vips.to_pil(result), mean=0.1)
+
+
+def test_text_and_watermark_parity(backends):
+    """Texte et filigrane rastérisés comme avec Pillow."""
+    pillow, vips = backends
+    canvas = make_gradient(600, 400)
+
+    blocks = [imaging_utils.TextConfig(text="Bonjour<br>Monde", font_name="arial", font_size=40, x=10, y=20, color="FF0000")]
+    expected = pillow.text_layer(canvas.copy(), blocks)
+    result = vips.text_layer(vips.from_pil(canvas), blocks)
+    assert_close(expected, vips.to_pil(result), mean=0.1)
+
+    expected = pillow.watermark(canvas.copy(), "EPREUVE")
+    result = vips.watermark(vips.from_pil(canvas), "EPREUVE")
+    assert_close(expected, vips.to_pil(result), mean=0)
+
+
+def test_text_layer_parity(backends):
+    """Tous les blocs de texte composés en une seule opération libvips, comme avec Pillow."""
+    pillow, vips = backends
+    canvas = make_gradient(600, 400)
+    blocks = [imaging_utils.TextConfig(text=f"Bloc {i}<br>Ligne", font_size=24, x=10 + i * 20, y=10 + i * 15,
+                                       color="%02X0000" % (i * 60)) for i in range(4)]
+
+    expected = pillow.text_layer(canvas.copy(), blocks)
+    result = vips.text_layer(vips.from_pil(canvas), blocks)
+    assert_close(expected, vips.to_pil(result), mean=0.1)
+
+def test_save_jpeg_parity(backends):
+    """JPEG final : mêmes dimensions, même résolution déclarée."""
+    pillow, vips = backends
+    img = make_gradient(300, 200)
+    expected = Image.open(BytesIO(pillow.save_jpeg(img, 300)))
+    result = Image.open(BytesIO(vips.save_jpeg(vips.from_pil(img), 300)))
+    assert result.size == expected.size
+    assert tuple(round(v) for v in result.info["dpi"]) == (300, 300)
+    assert_close(expected, result, mean=0.5)
+
+
+@pytest.fixture
+def tiled():
+    """Moteur de rendu par bandes : nécessite pyvips et libvips."""
+    pytest.importorskip("pyvips")
+    return TiledBackend()
+
+
+def test_tiled_canvas_parity(tiled):
+    """Canevas lu en flux : template transparent aplati sur blanc et réduit comme avec Pillow."""
+    pillow = PillowBackend()
+    template = make_gradient(800, 600).convert("RGBA")
+    template.putalpha(Image.new("L", template.size, 128))
+    buffer = BytesIO()
+    template.save(buffer, "PNG")
+
+    expected = pillow.new_canvas(Image.alpha_composite(Image.new("RGBA", template.size, "white"), template).convert("RGB"), 400)
+    canvas = tiled.open_canvas(buffer.getvalue(), 400)
+    assert tiled.size(canvas) == expected.size
+    canvas = tiled.paste(canvas, make_gradient(100, 100).convert("L"), (50, 50))
+    expected = pillow.paste(expected, make_gradient(100, 100).convert("L"), (50, 50))
+    assert_close(expected, Image.open(BytesIO(tiled.save_jpeg(canvas, 300))), mean=1.5)
+
+
+def test_tiled_canvas_exif_orientation(tiled):
+    """Un template avec orientation EXIF est redressé avant la composition."""
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = BytesIO()
+    make_gradient(300, 200).save(buffer, "JPEG", exif=exif)
+    assert tiled.size(tiled.open_canvas(buffer.getvalue())) == (200, 300)
+
+
+def test_select_tiled_backend(monkeypatch):
+    """Le rendu par bandes n'est choisi qu'au-delà du seuil, et seulement avec libvips."""
+    monkeypatch.setattr(imaging_utils, "TILED_RENDER_MIN_PIXELS", 1000)
+    assert select_imaging_backend((10, 10)).name == "pillow"
+    if imaging_utils.pyvips is not None:
+        assert isinstance(select_imaging_backend((100, 100)), TiledBackend)
+
+    monkeypatch.setattr(imaging_utils, "pyvips", None)
+    assert select_imaging_backend((100, 100)).name == "pillow"
+    monkeypatch.setattr(imaging_utils, "TILED_RENDER_MIN_PIXELS", 0)
+    assert select_imaging_backend((100, 100)).name == "pillow"
+
+
+def test_tiled_pixel_budget(tiled, monkeypatch):
+    """Les templates rendus par bandes ont leur propre budget de pixels, au-delà de MAX_IMAGE_PIXELS."""
+    monkeypatch.setattr(photo_utils, "MAX_IMAGE_PIXELS", 1000)
+    monkeypatch.setattr(imaging_utils, "MAX_IMAGE_PIXELS", 1000)
+    buffer = BytesIO()
+    make_gradient(300, 200).save(buffer, "JPEG")
+
+    with pytest.raises(ValueError, match="trop grande"):
+        photo_utils.probe_image_header(buffer.getvalue())
+    assert photo_utils.probe_image_header(buffer.getvalue(), photo_utils.TILED_MAX_IMAGE_PIXELS)
+    assert tiled.size(tiled.open_canvas(buffer.getvalue())) == (300, 200)
+    # Un template que Pillow refuserait de décoder passe par le rendu par bandes, même pour une petite sortie
+    assert isinstance(select_imaging_backend((30, 20), (300, 200)), TiledBackend)
+
+    monkeypatch.setattr(photo_utils, "TILED_MAX_IMAGE_PIXELS", 1000)
+    monkeypatch.setattr(imaging_utils, "TILED_MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(ValueError, match="trop grande"):
+        tiled.open_canvas(buffer.getvalue())
+
+
+def test_template_budget_keeps_pillow_limit(tiled, monkeypatch):
+    """Le budget des templates ne relève la limite de Pillow que le temps de lire leur en-tête."""
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    buffer = BytesIO()
+    make_gradient(300, 200).save(buffer, "JPEG")
+    content = buffer.getvalue()
+
+    assert photo_utils.probe_template_header(content)
+    assert photo_utils.template_size(photo_utils.CachedContent(content, "sha")) == (300, 200)
+    assert tiled.size(tiled.open_canvas(content)) == (300, 200)
+    assert Image.MAX_IMAGE_PIXELS == 1000
+    # Les autres images (photos sources) restent soumises au garde-fou de Pillow
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(BytesIO(content))
+
+
+def test_unknown_backend():
+    """Un moteur inconnu est refusé."""
+    with pytest.raises(ValueError, match="inconnu"):
+        create_imaging_backend("gpu")
+
+
+def test_missing_vips_falls_back_to_pillow(monkeypatch):
+    """Sans libvips, un worker configuré pour vips reste sur Pillow."""
+    monkeypatch.setattr(imaging_utils, "pyvips", None)
+    monkeypatch.setattr(imaging_utils, "IMAGING_BACKEND", "vips")
+    monkeypatch.setattr(imaging_utils, "_imaging_backend", None)
+    assert imaging_utils.get_imaging_backend().name == "pillow"
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from unittest.mock import patch
+from PIL import Image
+
+import photo_utils
+from photo_utils import (
+    plan_placement, render_placement, render_filtered_placement, apply_crop, apply_rotation,
+    apply_resize_template, resize_image, resolve_resize_quality, ResizeQuality,
+)
+
+
+def make_gradient(width, height):
+    """Image texturée (dégradés) pour comparer les rééchantillonnages."""
+    y, x = np.mgrid[0:height, 0:width]
+    arr = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], -1)
+    return Image.fromarray(arr.astype(np.uint8))
+
+
+def legacy_placement(img, top, bottom, rotation, width):
+    """Chaîne historique : rognage, rotation puis redimensionnement."""
+    result = apply_rotation(apply_crop(img, top, bottom), rotation)
+    return result.resize((width, int(width / (result.width / result.height))))
+
+
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270, 15, -30, 45, 200])
+@pytest.mark.parametrize("width", [150, 600])
+def test_fused_placement_matches_legacy(rotation, width):
+    """La passe unique donne la même taille et quasiment les mêmes pixels que la chaîne historique."""
+    img = make_gradient(1200, 800)
+
+    expected = legacy_placement(img, 10, 5, rotation, width)
+    plan = plan_placement(img.size, 10, 5, rotation, width)
+    result = render_placement(img, plan)
+
+    assert result.size == expected.size == plan.size
+    diff = np.abs(np.asarray(result).astype(int) - np.asarray(expected).astype(int))
+    assert diff.mean() < 3
+
+
+def test_arbitrary_angle_reduces_before_transform():
+    """Une forte réduction passe d'abord par une réduction entière par blocs."""
+    plan = plan_placement((2560, 1707), 0, 0, 15, 300)
+
+    assert plan.reduce_factor >= 4
+    assert plan.matrix is not None
+
+
+def test_invalid_dimensions():
+    """Un rognage total ou une largeur nulle est refusé."""
+    with pytest.raises(ValueError, match="Dimensions invalides"):
+        plan_placement((100, 100), 50, 50, 0, 50)
+    with pytest.raises(ValueError, match="Dimensions invalides"):
+        plan_placement((100, 100), 0, 0, 0, 0)
+
+
+def test_cartoon_runs_at_placement_resolution():
+    """Le filtre cartoon traite l'image placée suréchantillonnée, pas la source."""
+    img = make_gradient(2400, 1600)
+    seen_sizes = []
+
+    def fake_cartoon(pil_img):
+        seen_sizes.append(pil_img.size)
+        return pil_img
+
+    with patch('photo_utils.apply_cartoon_filter', side_effect=fake_cartoon):
+        result = render_filtered_placement(img, 0, 0, 15, 400, 'cartoon', oversampling=1.5)
+
+    assert result.size == plan_placement(img.size, 0, 0, 15, 400).size
+    assert seen_sizes == [plan_placement(img.size, 0, 0, 15, 600).size]
+
+
+def test_pointwise_filter_applied_after_placement():
+    """Le noir et blanc est appliqué directement à la taille finale."""
+    img = make_gradient(1200, 800)
+
+    result = render_filtered_placement(img, 0, 0, 90, 200, 'nb')
+
+    assert result.mode == 'L'
+    assert result.size == plan_placement(img.size, 0, 0, 90, 200).size
+
+
+def test_resize_image_matches_direct_filter():
+    """La réduction entière préalable reste proche d'un redimensionnement direct."""
+    rng = np.random.default_rng(3)
+    base = rng.integers(0, 256, (30, 40, 3), dtype=np.uint8)
+    img = Image.fromarray(base).resize((4000, 3000), Image.Resampling.BICUBIC)
+    for quality in ResizeQuality:
+        result = resize_image(img, (400, 300), quality)
+        assert result.size == (400, 300)
+        reference = np.asarray(img.resize((400, 300), Image.Resampling.LANCZOS), dtype=float)
+        assert np.abs(np.asarray(result, dtype=float) - reference).mean() < 2.5, quality
+
+
+def test_resize_quality_resolution():
+    """La qualité vient du job, sinon de RESIZE_QUALITY ; une valeur inconnue est refusée."""
+    assert resolve_resize_quality("high") is ResizeQuality.HIGH
+    assert resolve_resize_quality(None) is ResizeQuality(photo_utils.RESIZE_QUALITY)
+    with pytest.raises(ValueError, match="inconnue"):
+        resolve_resize_quality("ultra")
+
+
+def test_apply_resize_template_uses_quality():
+    """Le redimensionnement final respecte le ratio pour chaque qualité."""
+    img = Image.new('RGB', (3000, 2000), 'red')
+    for quality in ("fast", "balanced", "high"):
+        result = apply_resize_template(img, 300, quality)
+        assert result.size == (300, 200)
+        assert result.getpixel((150, 100)) == (255, 0, 0)
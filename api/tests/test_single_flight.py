@@ -0,0 +1,79 @@
+import threading
+import time
+
+from cache_utils import SingleFlight
+
+
+def run_concurrently(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_calls_share_one_fetch():
+    """Les appels simultanés d'une même clé ne déclenchent qu'un téléchargement."""
+    flight = SingleFlight(lock_dir=None)
+    calls = []
+    results = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return b"contenu"
+
+    run_concurrently([lambda: results.append(flight.do("url", fetch))] * 5)
+
+    assert results == [b"contenu"] * 5
+    assert len(calls) == 1
+    assert flight.get_stats() == {"executed": 1, "suppressed": 4}
+
+
+def test_error_shared_with_waiters():
+    """L'erreur du téléchargement est remontée à toutes les tâches en attente."""
+    flight = SingleFlight(lock_dir=None)
+    errors = []
+
+    def fetch():
+        time.sleep(0.1)
+        raise ValueError("indisponible")
+
+    def call():
+        try:
+            flight.do("url", fetch)
+        except ValueError as e:
+            errors.append(str(e))
+
+    run_concurrently([call] * 3)
+
+    assert errors == ["indisponible"] * 3
+    # La clé est libérée : un nouvel appel retente le téléchargement
+    assert flight.do("url", lambda: b"ok") == b"ok"
+
+
+def test_other_process_reuses_result(tmp_path):
+    """Un processus qui a attendu le verrou fichier réutilise le résultat déposé."""
+    # Deux instances simulent deux processus partageant le même dossier de verrous
+    first, second = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path))
+    shared_store = {}
+    calls = []
+    started = threading.Event()
+
+    def slow_fetch():
+        started.set()
+        calls.append(1)
+        time.sleep(0.2)
+        shared_store["url"] = b"contenu"
+        return b"contenu"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(first.do("url", slow_fetch, reuse=lambda: shared_store.get("url"))))
+    leader.start()
+    started.wait()
+    results.append(second.do("url", slow_fetch, reuse=lambda: shared_store.get("url")))
+    leader.join()
+
+    assert results == [b"contenu", b"contenu"]
+    assert len(calls) == 1
+    assert second.get_stats()["suppressed"] == 1
@@ -0,0 +1,212 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from PIL import Image
+
+import cache_utils
+from cache_utils import SourcePyramidCache
+from photo_utils import fetch_image, load_source, pyramid_factor, decode_level
+
+
+def make_jpeg_bytes(width, height, color='red'):
+    with BytesIO() as bio:
+        Image.new('RGB', (width, height), color=color).save(bio, format='JPEG')
+        return bio.getvalue()
+
+
+def test_pyramid_factor():
+    """Le niveau choisi est la plus forte réduction qui couvre encore la cible."""
+    assert pyramid_factor((2560, 1707), None) == 1
+    assert pyramid_factor((2560, 1707), (300, 300)) == 4
+    assert pyramid_factor((2560, 1707), (1000, 1000)) == 1
+    assert pyramid_factor((2560, 1707), (20, 20)) == 32
+
+
+def test_decode_level_beyond_jpeg_draft():
+    """Au-delà de 1/8, la réduction se poursuit après le décodage JPEG réduit."""
+    content = make_jpeg_bytes(2560, 1707)
+
+    assert decode_level(content, 4).size == (640, 427)
+    assert decode_level(content, 32).size == (80, 54)
+
+
+@pytest.mark.parametrize("mode, expected_mode", [("P", "RGB"), ("1", "L")])
+def test_reduced_level_from_non_reducible_modes(mode, expected_mode):
+    """Les PNG palette ou bilevel se réduisent aussi (reduce ne gère pas ces modes)."""
+    img = Image.new('RGB', (2560, 1707), 'red')
+    img.paste((0, 0, 255), (0, 0, 1280, 1707))
+    img = img.quantize(4) if mode == "P" else img.convert(mode)
+    with BytesIO() as bio:
+        img.save(bio, format='PNG')
+        content = bio.getvalue()
+
+    level = load_source("https://example.com/eleve.png", content, (300, 300))
+
+    assert level.size == (640, 427)
+    assert level.mode == expected_mode
+
+
+def test_level_reused_across_jobs():
+    """Un second job relit le niveau en cache au lieu de décoder la photo."""
+    content = make_jpeg_bytes(2560, 1707)
+    response = MagicMock(content=content, status_code=200, headers={})
+    response.raise_for_status.return_value = None
+    url = "https://example.com/eleve.jpg"
+
+    with patch('photo_utils.http_get', return_value=response):
+        first = load_source(url, fetch_image(url), (300, 300))
+        with patch('photo_utils.decode_level') as mock_decode:
+            second = load_source(url, fetch_image(url), (300, 300))
+
+    assert not mock_decode.called
+    assert first.size == second.size == (640, 427)
+
+
+def test_source_reused_without_download(tmp_path):
+    """Une photo déjà téléchargée n'est pas retéléchargée pendant le TTL."""
+    content = make_jpeg_bytes(200, 100)
+    response = MagicMock(content=content, status_code=200, headers={})
+    response.raise_for_status.return_value = None
+
+    with patch('photo_utils.http_get', return_value=response) as mock_get:
+        assert fetch_image("https://example.com/eleve.jpg") == content
+        assert fetch_image("https://example.com/eleve.jpg") == content
+
+    assert mock_get.call_count == 1
+
+
+def test_levels_written_and_invalidated(tmp_path):
+    """Les niveaux sont relus tant que le contenu de la source ne change pas."""
+    cache = SourcePyramidCache(str(tmp_path), max_bytes=10_000_000, ttl=3600)
+    url = "https://example.com/eleve.jpg"
+    cache.put_source(url, b"v1", (400, 200))
+    cache.put_level(url, 2, Image.new('RGB', (200, 100), 'green'))
+
+    level = cache.get_level(url, 2)
+    assert level.size == (200, 100)
+    assert level.getpixel((0, 0)) == (0, 128, 0)
+    assert cache.get_level(url, 4) is None
+
+    cache.put_source(url, b"v2", (400, 200))
+    assert cache.get_level(url, 2) is None
+
+
+def test_source_expires_after_ttl(tmp_path):
+    """Au-delà du TTL, la photo source doit être retéléchargée."""
+    cache = SourcePyramidCache(str(tmp_path), max_bytes=10_000_000, ttl=0)
+    cache.put_source("https://example.com/eleve.jpg", b"v1", (10, 10))
+    time.sleep(0.01)
+
+    assert cache.get_source("https://example.com/eleve.jpg") is None
+
+
+
+def make_response(content, status_code=200, headers=None):
+    response = MagicMock(content=content, status_code=status_code, headers=headers or {})
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    else:
+        response.raise_for_status.return_value = None
+    return response
+
+
+@pytest.fixture
+def expired_source_cache(tmp_path, monkeypatch):
+    """Cache des sources dont les copies doivent être revalidées à chaque accès."""
+    cache = SourcePyramidCache(str(tmp_path / "sources"), max_bytes=10_000_000, ttl=0)
+    monkeypatch.setattr(cache_utils, "_source_cache", cache)
+    return cache
+
+
+def test_full_resolution_level_not_persisted():
+    """La pleine résolution n'est pas stockée en pixels bruts : elle doublerait le .src."""
+    content = make_jpeg_bytes(400, 200)
+    url = "https://example.com/eleve.jpg"
+
+    with patch('photo_utils.http_get', return_value=make_response(content)):
+        img = load_source(url, fetch_image(url), None)
+
+    cache = cache_utils.get_source_cache()
+    assert img.size == (400, 200)
+    assert cache.get_level(url, 1) is None
+    assert not any(name.endswith(".1.raw") for name in os.listdir(cache.cache_dir))
+
+
+def test_expired_source_revalidated_with_validators(expired_source_cache):
+    """Au-delà du TTL, un 304 au GET conditionnel resert la copie en cache."""
+    content = make_jpeg_bytes(200, 100)
+    url = "https://example.com/eleve.jpg"
+    validators = {"ETag": '"v1"', "Last-Modified": "Mon, 05 Oct 2026 08:00:00 GMT"}
+
+    with patch('photo_utils.http_get', return_value=make_response(content, headers=validators)):
+        assert fetch_image(url) == content
+    time.sleep(0.01)
+    with patch('photo_utils.http_get', return_value=make_response(b"", 304)) as mock_get:
+        assert fetch_image(url) == content
+
+    headers = mock_get.call_args.kwargs["headers"]
+    assert headers == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 05 Oct 2026 08:00:00 GMT"}
+    assert expired_source_cache.stats["revalidated"] == 1
+
+
+def test_changed_source_replaces_cached_copy(expired_source_cache):
+    """Une photo modifiée sur le serveur remplace la copie en cache et ses niveaux."""
+    url = "https://example.com/eleve.jpg"
+    old, new = make_jpeg_bytes(200, 100, 'red'), make_jpeg_bytes(200, 100, 'blue')
+
+    with patch('photo_utils.http_get', return_value=make_response(old, headers={"ETag": '"v1"'})):
+        fetch_image(url)
+    expired_source_cache.put_level(url, 2, Image.new('RGB', (100, 50), 'red'))
+    time.sleep(0.01)
+    with patch('photo_utils.http_get', return_value=make_response(new, headers={"ETag": '"v2"'})):
+        assert fetch_image(url) == new
+
+    assert expired_source_cache.get_level(url, 2) is None
+    assert expired_source_cache.revalidation_headers(url) == {"If-None-Match": '"v2"'}
+
+
+def test_stale_source_only_on_transient_error(expired_source_cache):
+    """Copie en cache servie si le serveur est indisponible, mais pas s'il a supprimé la photo."""
+    content = make_jpeg_bytes(200, 100)
+    url = "https://example.com/eleve.jpg"
+
+    with patch('photo_utils.http_get', return_value=make_response(content, headers={"ETag": '"v1"'})):
+        fetch_image(url)
+    time.sleep(0.01)
+    with patch('photo_utils.http_get', return_value=make_response(b"", 503)):
+        assert fetch_image(url) == content
+    with patch('photo_utils.http_get', return_value=make_response(b"", 404)):
+        with pytest.raises(ValueError):
+            fetch_image(url)
+
+
+
+def test_other_process_download_reused():
+    """Une photo téléchargée par un autre processus du nœud pendant l'attente n'est pas retéléchargée."""
+    content = make_jpeg_bytes(200, 100)
+    url = "https://example.com/eleve.jpg"
+    lock_dir = cache_utils.get_single_flight().lock_dir
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, hashlib.sha256(f"image:{url}".encode("utf-8")).hexdigest() + ".lock")
+    results = []
+
+    with patch('photo_utils.http_get') as mock_get:
+        # Le verrou fichier est tenu par « l'autre processus » pendant son téléchargement
+        with open(lock_path, "a") as other_process:
+            fcntl.flock(other_process, fcntl.LOCK_EX)
+            waiter = threading.Thread(target=lambda: results.append(fetch_image(url)))
+            waiter.start()
+            time.sleep(0.1)
+            cache_utils.get_source_cache().put_source(url, content, (200, 100))
+            fcntl.flock(other_process, fcntl.LOCK_UN)
+        waiter.join()
+
+    assert results == [content]
+    assert not mock_get.called
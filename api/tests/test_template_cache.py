@@ -0,0 +1,201 @@
+import hashlib
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from PIL import Image
+
+from cache_utils import TemplateDiskCache, DecodedTemplateCache, CachedContent
+from photo_utils import load_template, decode_image
+
+
+class FakeServer:
+    """Simule un serveur de templates supportant ETag / If-None-Match."""
+
+    def __init__(self):
+        self.contents = {}
+        self.calls = []
+        self.down = False
+        self.status = None
+        self.rejected = False
+
+    def get(self, url, timeout=None, headers=None, **kwargs):
+        self.calls.append((url, dict(headers or {})))
+        if self.down:
+            raise requests.exceptions.ConnectionError("serveur indisponible")
+        if self.rejected:
+            raise ValueError("Image trop grande")
+        if self.status:
+            response = MagicMock(status_code=self.status)
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{self.status}", response=response)
+            return response
+        content = self.contents[url]
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        response = MagicMock()
+        response.headers = {"ETag": etag, "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"}
+        if (headers or {}).get("If-None-Match") == etag:
+            response.status_code = 304
+            response.content = b""
+        else:
+            response.status_code = 200
+            response.content = content
+        response.raise_for_status.return_value = None
+        return response
+
+
+@pytest.fixture
+def server():
+    fake = FakeServer()
+    with patch('cache_utils.http_get', side_effect=fake.get):
+        yield fake
+
+
+def test_miss_then_revalidated_hit(server, tmp_path):
+    """Le second accès envoie un GET conditionnel et sert le contenu du cache."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=10_000)
+    server.contents["https://example.com/t.jpg"] = b"template-v1"
+
+    first = cache.fetch("https://example.com/t.jpg")
+    second = cache.fetch("https://example.com/t.jpg")
+
+    assert first.content == second.content == b"template-v1"
+    assert not first.from_cache and second.from_cache
+    assert "If-None-Match" in server.calls[1][1]
+    assert cache.get_stats()["misses"] == 1
+    assert cache.get_stats()["revalidated"] == 1
+
+
+def test_changed_content_is_refreshed(server, tmp_path):
+    """Un template modifié côté serveur remplace l'entrée en cache."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=10_000)
+    url = "https://example.com/t.jpg"
+    server.contents[url] = b"template-v1"
+    cache.fetch(url)
+    server.contents[url] = b"template-v2"
+
+    result = cache.fetch(url)
+
+    assert result.content == b"template-v2"
+    assert result.sha256 == hashlib.sha256(b"template-v2").hexdigest()
+    assert cache.fetch(url).from_cache
+
+
+def test_lru_eviction(server, tmp_path):
+    """Les blobs les moins récemment utilisés sont évincés au-delà de la taille maximale."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=25)
+    for name in "abc":
+        server.contents[f"https://example.com/{name}.jpg"] = name.encode() * 10
+
+    cache.fetch("https://example.com/a.jpg")
+    cache.fetch("https://example.com/b.jpg")
+    cache.fetch("https://example.com/c.jpg")
+
+    assert cache.get_stats()["evictions"] == 1
+    assert not cache.fetch("https://example.com/a.jpg").from_cache
+    assert cache.fetch("https://example.com/c.jpg").from_cache
+
+
+def test_stale_copy_served_when_server_down(server, tmp_path):
+    """Si la revalidation échoue, la dernière copie connue est servie."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=10_000)
+    server.contents["https://example.com/t.jpg"] = b"template-v1"
+    cache.fetch("https://example.com/t.jpg")
+    server.down = True
+
+    assert cache.fetch("https://example.com/t.jpg").content == b"template-v1"
+    with pytest.raises(requests.exceptions.ConnectionError):
+        cache.fetch("https://example.com/absent.jpg")
+
+
+def test_stale_copy_served_on_server_error(server, tmp_path):
+    """Une erreur 5xx est passagère : la dernière copie connue est servie."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=10_000)
+    server.contents["https://example.com/t.jpg"] = b"template-v1"
+    cache.fetch("https://example.com/t.jpg")
+    server.status = 503
+
+    assert cache.fetch("https://example.com/t.jpg").content == b"template-v1"
+    assert cache.get_stats()["stale"] == 1
+
+
+@pytest.mark.parametrize("status", [404, 410])
+def test_deleted_template_not_served_from_cache(server, tmp_path, status):
+    """Un template supprimé côté serveur n'est plus servi depuis le cache."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=10_000)
+    server.contents["https://example.com/t.jpg"] = b"template-v1"
+    cache.fetch("https://example.com/t.jpg")
+    server.status = status
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        cache.fetch("https://example.com/t.jpg")
+    assert cache.get_stats()["stale"] == 0
+
+
+def test_rejected_template_not_served_from_cache(server, tmp_path):
+    """Un template rejeté à la validation (budget de pixels) n'est pas remplacé par la copie en cache."""
+    cache = TemplateDiskCache(str(tmp_path), max_bytes=10_000)
+    server.contents["https://example.com/t.jpg"] = b"template-v1"
+    cache.fetch("https://example.com/t.jpg")
+    server.rejected = True
+
+    with pytest.raises(ValueError, match="trop grande"):
+        cache.fetch("https://example.com/t.jpg")
+
+
+def test_disabled_cache(server, tmp_path):
+    """Avec une taille maximale nulle, rien n'est écrit sur le disque."""
+    cache = TemplateDiskCache(str(tmp_path / "cache"), max_bytes=0)
+    server.contents["https://example.com/t.jpg"] = b"template-v1"
+
+    assert cache.fetch("https://example.com/t.jpg").content == b"template-v1"
+    assert not (tmp_path / "cache").exists()
+
+
+def test_decoded_cache_hit_and_version_replacement():
+    """Le template décodé est réutilisé tant que son contenu ne change pas."""
+    cache = DecodedTemplateCache(max_bytes=10_000_000)
+    img = Image.new('RGB', (100, 100))
+    cache.put("https://example.com/t.jpg", "v1", img)
+
+    assert cache.get("https://example.com/t.jpg", "v1") is img
+    assert cache.get("https://example.com/t.jpg", "v2") is None
+
+    cache.put("https://example.com/t.jpg", "v2", Image.new('RGB', (100, 100)))
+    assert cache.get("https://example.com/t.jpg", "v1") is None
+    assert cache.get_stats()["entries"] == 1
+
+
+def test_decoded_cache_memory_budget():
+    """Les templates les moins récemment utilisés sont évincés au-delà du budget."""
+    # 100x100 RGB = 30 000 octets : deux images tiennent dans le budget
+    cache = DecodedTemplateCache(max_bytes=70_000)
+    for name in "abc":
+        cache.put(f"https://example.com/{name}.jpg", name, Image.new('RGB', (100, 100)))
+
+    assert cache.get("https://example.com/a.jpg", "a") is None
+    assert cache.get("https://example.com/c.jpg", "c") is not None
+    assert cache.get_stats()["bytes"] <= 70_000
+
+    cache.put("https://example.com/big.jpg", "big", Image.new('RGB', (1000, 1000)))
+    assert cache.get("https://example.com/big.jpg", "big") is None
+
+
+def test_load_template_decodes_once(tmp_path):
+    """Deux jobs sur le même template ne décodent l'image qu'une seule fois."""
+    with BytesIO() as bio:
+        Image.new('RGB', (40, 30), color='blue').save(bio, format='JPEG')
+        content = bio.getvalue()
+    cached = CachedContent(content, hashlib.sha256(content).hexdigest(), from_cache=True)
+    disk_cache = MagicMock()
+    disk_cache.fetch.return_value = cached
+
+    with patch('photo_utils.get_template_cache', return_value=disk_cache), \
+         patch('photo_utils.get_decoded_template_cache', return_value=DecodedTemplateCache()), \
+         patch('photo_utils.decode_image', wraps=decode_image) as mock_decode:
+        first = load_template("https://example.com/t.jpg")
+        second = load_template("https://example.com/t.jpg")
+
+    assert first is second
+    assert first.size == (40, 30)
+    assert mock_decode.call_count == 1
@@ -1,8 +1,10 @@
 import pytest
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
-from photo_utils import TextRenderer, TextConfig, TextRenderStrategy, add_text
+from photo_utils import TextRenderer, TextConfig, TextRenderStrategy, add_text, add_text_layer
 from unittest.mock import patch
+import cache_utils
+import photo_utils
 
 def test_text_size_consistency():
     """Vérifie que la taille du texte est cohérente après le rendu haute résolution."""
@@ -219,8 +221,9 @@ def test_font_fallback():
     result_array = np.array(result)
     assert not np.all(result_array == 255), "Le texte devrait être visible avec la police de secours"
     
-    # Test avec Arial comme police de secours
-    with patch('PIL.ImageFont.truetype') as mock_truetype:
+    # Test avec Arial comme police de secours (cache de polices vidé : chaque police est rechargée)
+    with patch('cache_utils._font_cache', cache_utils.FontCache()), \
+         patch('PIL.ImageFont.truetype') as mock_truetype:
         # Simuler l'échec du chargement de la première police
         mock_truetype.side_effect = [
             IOError("Police non trouvée"),
@@ -377,4 +380,162 @@ def test_text_alignment_with_default_font():
         assert positions[0][0] < positions[1][0], \
             "Le texte aligné à gauche devrait commencer avant le texte centré"
         assert positions[2][1] > positions[1][1], \
-            "Le texte aligné à droite devrait finir après le texte centré" 
\ No newline at end of file
+            "Le texte aligné à droite devrait finir après le texte centré" 
+
+def test_add_text_in_place():
+    """Vérifie que add_text ne copie le canevas que si on ne lui demande pas d'écrire en place."""
+    img = Image.new('RGB', (400, 200), 'white')
+
+    copied = add_text(img, "Copie", x=10, y=10, color="000000")
+    assert copied is not img
+    assert np.all(np.array(img) == 255), "L'image d'origine ne doit pas être modifiée"
+
+    drawn = add_text(img, "En place", x=10, y=10, color="000000", in_place=True)
+    assert drawn is img
+    assert not np.all(np.array(img) == 255), "Le texte doit être dessiné sur le canevas"
+
+
+def test_basic_render_touches_only_text_region():
+    """Vérifie que le rendu basique ne modifie que la zone couverte par le texte."""
+    img = Image.new('RGB', (400, 200), (10, 120, 200))
+    config = TextConfig(text="Zone", font_name="arial", font_size=20, x=50, y=50,
+                        color="FFFFFF", strategy=TextRenderStrategy.BASIC)
+    result = TextRenderer(config)._render_basic(img)
+
+    assert result is img and result.mode == 'RGB'
+    changed = np.any(np.array(result) != (10, 120, 200), axis=2)
+    ys, xs = np.nonzero(changed)
+    assert len(xs) > 0, "Le texte doit être visible"
+    assert xs.min() >= 200 and ys.min() >= 100, "Rien ne doit changer avant la position du texte"
+
+
+def _full_canvas_overlay(img, renderer):
+    """Rendu de référence : calque RGBA de la taille de la page, composé en entier."""
+    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    x, y = renderer.config.x / 100 * img.width, renderer.config.y / 100 * img.height
+    for i, line in enumerate(renderer.config.text.split("<br>")):
+        draw.text((x, y + i * (renderer.config.font_size + 5)), line, font=renderer.font,
+                  fill="#" + renderer.config.color)
+    return Image.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
+
+
+@pytest.mark.parametrize("x, y", [(12.3, 40.7), (95, 97), (0, 0)])
+def test_bbox_overlay_matches_full_canvas_overlay(x, y):
+    """Le calque limité à l'emprise du texte donne les mêmes pixels qu'un calque pleine page."""
+    img = Image.new('RGB', (600, 400), (200, 220, 240))
+    renderer = TextRenderer(TextConfig(text="Bonjour<br>Le Monde ÉÀ", font_size=40, x=x, y=y, color="AA2233"))
+    expected = _full_canvas_overlay(img, renderer)
+    assert np.array_equal(np.array(renderer._render_basic(img.copy())), np.array(expected))
+
+
+@pytest.mark.parametrize("fallback", [False, True])
+def test_basic_render_allocates_text_sized_overlays(fallback):
+    """Une légende sur une grande page n'alloue que des calques de la taille du texte."""
+    img = Image.new('RGB', (3508, 4961), 'white')
+    renderer = TextRenderer(TextConfig(text="Classe de CM2<br>2026", font_size=60, x=10, y=10, color="000000"))
+    if fallback:
+        renderer.font = ImageFont.load_default()
+        renderer.scale_factor = renderer.config.font_size / 10
+
+    with patch('photo_utils.Image.new', wraps=Image.new) as new_spy:
+        result = renderer._render_basic(img)
+    largest = max(call.args[1][0] * call.args[1][1] for call in new_spy.call_args_list)
+    assert largest < img.width * img.height // 100
+    assert not np.all(np.array(result) == 255), "Le texte doit être visible"
+
+
+def test_high_res_supersamples_only_text_region():
+    """Le rendu haute résolution ne suréchantillonne que l'emprise du texte et garde le fond."""
+    img = Image.new('RGB', (2480, 3508), (10, 120, 200))
+    renderer = TextRenderer(TextConfig(text="Classe de CM2<br>2026", font_size=60, x=10, y=10,
+                                       color="FFFFFF", strategy=TextRenderStrategy.HIGH_RES))
+    with patch('photo_utils.Image.new', wraps=Image.new) as new_spy:
+        result = renderer.render(img)
+    largest = max(call.args[1][0] * call.args[1][1] for call in new_spy.call_args_list)
+    assert largest < img.width * img.height // 10
+
+    changed = np.any(np.array(result) != (10, 120, 200), axis=2)
+    ys, xs = np.nonzero(changed)
+    assert len(xs) > 0, "Le texte doit être visible"
+    assert xs.min() >= 248 and ys.min() >= 350, "Le fond doit être conservé hors du texte"
+
+
+def test_high_res_close_to_basic():
+    """Le rendu haute résolution reste visuellement équivalent au rendu basique."""
+    img = Image.new('RGB', (800, 600), 'white')
+    config = dict(text="Bonjour<br>Le Monde", font_size=48, x=12.3, y=40.7, color="AA2233")
+    basic = TextRenderer(TextConfig(**config)).render(img.copy())
+    high_res = TextRenderer(TextConfig(strategy=TextRenderStrategy.HIGH_RES, **config)).render(img.copy())
+    assert np.abs(np.array(basic, dtype=float) - np.array(high_res, dtype=float)).mean() < 1
+
+
+def test_font_cache_shared_between_text_paths():
+    """Une police n'est analysée qu'une fois par taille pour add_text, TextRenderer et les filigranes."""
+    from photo_utils import apply_watermark, get_font, warm_font_cache
+
+    assert warm_font_cache([24]) > 0
+    img = Image.new('RGB', (600, 480), 'white')  # filigrane en taille 480 // 20 = 24
+    with patch('PIL.ImageFont.truetype', wraps=ImageFont.truetype) as spy:
+        add_text(img, "Test", font_name="arial", font_size=24)
+        TextRenderer(TextConfig(text="Test", font_name="arial", font_size=24)).render(img.copy())
+        apply_watermark(img, "EPREUVE", font_name="arial")
+        assert spy.call_count == 0
+    assert get_font("ARIAL", 24) is get_font("arial", 24)
+    assert cache_utils.get_font_cache().get_stats()["hits"] >= 3
+
+
+def test_warm_font_cache_fills_cache_and_reports_missing(tmp_path, monkeypatch):
+    """Chaque police de l'API est mise en cache aux tailles demandées ; un dossier vide ne charge rien."""
+    import photo_utils
+
+    assert photo_utils.warm_font_cache([20, 32]) == 2 * len(photo_utils._FONT_FILES)
+    assert cache_utils.get_font_cache().get_stats()["entries"] == 2 * len(photo_utils._FONT_FILES)
+    with patch('PIL.ImageFont.truetype', wraps=ImageFont.truetype) as spy:
+        photo_utils.get_font("verdana", 32)
+        assert spy.call_count == 0
+
+    monkeypatch.setattr(photo_utils, "FONT_DIR", str(tmp_path))
+    assert photo_utils.warm_font_cache([20]) == 0
+
+
+def test_text_layer_matches_sequential_add_text():
+    """Tous les blocs d'un job dessinés en une passe : mêmes pixels et une seule copie du canevas."""
+    img = Image.new('RGB', (800, 600), (230, 230, 230))
+    blocks = [TextConfig(text=f"Légende {i}<br>Ligne {i}", font_size=20 + i, x=5 + i * 9, y=4 + i * 9,
+                         color="%02X2040" % (i * 20)) for i in range(10)]
+    blocks.append(TextConfig(text=None))
+
+    expected = img.copy()
+    for block in blocks:
+        expected = add_text(expected, block.text, block.font_name, block.font_size, block.x, block.y,
+                            block.color, in_place=True)
+
+    with patch.object(Image.Image, 'copy', autospec=True, side_effect=Image.Image.copy) as copy_spy:
+        result = add_text_layer(img, blocks)
+    assert copy_spy.call_count == 1
+    assert np.array_equal(np.array(result), np.array(expected))
+    assert np.all(np.array(img) == 230), "L'image d'origine ne doit pas être modifiée"
+
+
+def test_text_mask_cache_reuses_rasterised_lines():
+    """Un texte répété d'un job à l'autre n'est rastérisé qu'une fois, avec les mêmes pixels."""
+    blocks = [TextConfig(text="École Jean Moulin<br>2025-2026", font_size=36, x=12.3, y=40.7, color="AA2233")]
+    page = Image.new('RGB', (800, 600), (230, 230, 230))
+
+    # Référence : rendu direct par ImageDraw à la même position
+    expected = page.copy()
+    font = ImageFont.truetype(photo_utils.resolve_font_path("arial"), 36)
+    for i, line in enumerate(["École Jean Moulin", "2025-2026"]):
+        ImageDraw.Draw(expected).text((98.4, 244.2 + i * 41), line, font=font, fill="#AA2233")
+
+    first = add_text_layer(page, blocks)
+    with patch('photo_utils.ImageDraw.Draw', wraps=ImageDraw.Draw) as draw_spy:
+        second = add_text_layer(page, blocks)
+    assert draw_spy.call_count == 0, "Les lignes déjà rastérisées viennent du cache"
+    assert np.array_equal(np.array(first), np.array(expected))
+    assert np.array_equal(np.array(second), np.array(expected))
+
+    stats = cache_utils.get_text_mask_cache().get_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["hit_rate"] == 0.5
+
@@ -0,0 +1,76 @@
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import cache_utils
+from photo_utils import apply_watermark
+
+
+def reference_watermark(img, text, transparency=100, repeat_count=5):
+    """Ancienne implémentation : calque RGBA pleine taille puis alpha_composite."""
+    font_size = max(min(img.size) // 20, 10)
+    font = ImageFont.truetype("arial.ttf", font_size)
+    layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(layer)
+    step_x = img.width // (repeat_count + 1)
+    step_y = img.height // (repeat_count + 1)
+    for i in range(repeat_count + 1):
+        draw.text((step_x * i, step_y * i), text, font=font, fill=(0, 0, 0, transparency))
+    return Image.alpha_composite(img.convert("RGBA"), layer).convert("RGB")
+
+
+def random_image(width, height):
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def test_watermark_matches_full_layer_composite(monkeypatch):
+    """Le filigrane fusionné par tuiles est identique au calque pleine taille."""
+    # Police par défaut des deux côtés, que les polices du conteneur soient installées ou non
+    default_font = ImageFont.load_default()
+    monkeypatch.setattr(ImageFont, "truetype", lambda *args, **kwargs: default_font)
+
+    img = random_image(600, 400)
+    expected = np.asarray(reference_watermark(img, "EPREUVE"))
+    result = np.asarray(apply_watermark(img, "EPREUVE"))
+    assert np.array_equal(result, expected)
+
+
+def test_watermark_tile_is_cached():
+    """Le texte n'est rastérisé qu'une fois pour des images de même taille."""
+    for _ in range(3):
+        apply_watermark(random_image(600, 400), "EPREUVE")
+    stats = cache_utils.get_watermark_cache().get_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+    assert stats["entries"] == 1
+
+
+def test_watermark_in_place():
+    """Sans in_place l'image d'origine est intacte ; avec, elle est modifiée directement."""
+    img = random_image(300, 300)
+    before = np.asarray(img).copy()
+
+    result = apply_watermark(img, "EPREUVE")
+    assert result is not img
+    assert np.array_equal(np.asarray(img), before)
+
+    result = apply_watermark(img, "EPREUVE", in_place=True)
+    assert result is img
+    assert not np.array_equal(np.asarray(img), before)
+
+
+def test_watermark_keeps_image_modes():
+    """Les niveaux de gris restent sur un canal et la transparence est conservée."""
+    gray = Image.new("L", (300, 200), 200)
+    result = apply_watermark(gray, "EPREUVE", in_place=True)
+    assert result is gray and result.mode == "L"
+    assert np.asarray(result).min() < 200
+
+    # Un filigrane coloré impose le RGB
+    assert apply_watermark(gray, "EPREUVE", color="FF0000").mode == "RGB"
+
+    transparent = Image.new("RGBA", (300, 200), (255, 255, 255, 0))
+    result = apply_watermark(transparent, "EPREUVE")
+    assert result.mode == "RGBA"
+    alpha = np.asarray(result.getchannel("A"))
+    assert alpha.min() == 0 and alpha.max() > 0
@@ -4,17 +4,26 @@ from ftplib import FTP
 from typing import List, Dict
 from PIL import Image
 from photo_utils import (
-    apply_watermark, 
-    apply_resize_template, 
-    add_text, 
-    apply_filter, 
-    apply_crop, 
-    apply_rotation, 
-    load_image,
-    TextRenderStrategy
+    add_text_layer,
+    TextConfig,
+    TextRenderStrategy,
+    load_template,
+    fetch_template,
+    template_size,
+    fetch_images,
+    compute_target_size,
+    largest_target_size,
+    resolve_resize_quality,
+    get_conversion_stats,
 )
+from imaging_utils import TiledBackend, select_imaging_backend
 from ftp_utils import log_request_to_ftp, log_to_ftp, upload_file_ftp
+from http_utils import get_connection_stats, get_fetch_stats
+from cache_utils import (
+    get_template_cache, get_decoded_template_cache, get_single_flight, get_source_cache, get_watermark_cache, get_text_mask_cache
+)
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 
@@ -34,18 +43,19 @@ def process_intercalaire(result_file: str, background_color: str, width: int, he
         background_color = "#" + background_color
         img = Image.new('RGB', (width, height), background_color)
 
-        # Add each text block
-        for block in text_blocks:
-            img = add_text(
-                img=img,
+        # Add all text blocks in a single pass
+        img = add_text_layer(img, [
+            TextConfig(
                 text=block["text"],
                 font_name=block.get("font_name", "arial"),
                 font_size=block.get("font_size", 20),
                 x=block["x"],
                 y=block["y"],
                 color=block.get("color", "black"),
-                align=block.get("align", "left")
+                align=block.get("align", "left"),
             )
+            for block in text_blocks
+        ], in_place=True)
 
         # Sauvegarder directement dans un BytesIO
         with BytesIO() as bio:
@@ -118,6 +128,7 @@ def process_and_upload(template_url, image_url, result_file, result_w, xs, ys, r
     """
     logger = logging.getLogger(__name__)
     logger.info("=== DÉBUT DU PROCESSUS ===")
+    conversions_before = get_conversion_stats()
 
     try:
         # Log des paramètres
@@ -127,32 +138,41 @@ def process_and_upload(template_url, image_url, result_file, result_w, xs, ys, r
         logger.info(f"Paramètres images: xs={xs}, ys={ys}, ws={ws}, rs={rs}, cs={cs}")
         logger.info(f"Paramètres texte: texts={ts}, fonts={tfs}, colors={tcs}, sizes={tts}, positions_x={txs}, positions_y={tys}")
         
-        # Charger le template
-        try:
-            template = load_image(template_url, is_template=True)
-            logger.info(f"Template chargé avec succès. Dimensions: {template.size}")
-        except ValueError as e:
-            logger.error(f"Erreur lors du chargement du template: {str(e)}")
-            raise ValueError(f"Impossible de charger le template. Erreur: {str(e)}")
-        
-        # Charger les images
-        try:
-            # S'assurer que image_url est une liste
-            if not isinstance(image_url, list):
-                image_url = [image_url]
-            images = load_image(image_url)
-            logger.info(f"Images source chargées avec succès. Nombre: {len(images)}")
-        except ValueError as e:
-            logger.error(f"Erreur lors du chargement des images: {str(e)}")
-            raise ValueError(f"Impossible de charger une ou plusieurs images. Erreur: {str(e)}")
+        # S'assurer que image_url est une liste
+        if not isinstance(image_url, list):
+            image_url = [image_url]
+
+        # Télécharger le template (via le cache disque) et les images en parallèle ; le
+        # template n'est décodé qu'une fois le moteur choisi selon la taille de sortie
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="process_and_upload") as executor:
+            template_future = executor.submit(fetch_template, template_url)
+            # Les images sont seulement téléchargées ici : leur décodage attend la
+            # largeur du template pour pouvoir se faire à échelle réduite
+            images_future = executor.submit(fetch_images, image_url)
+
+            try:
+                cached_template = template_future.result()
+                template_w, template_h = template_size(cached_template)
+                logger.info(f"Template chargé avec succès. Dimensions: {(template_w, template_h)}")
+            except ValueError as e:
+                images_future.cancel()
+                logger.error(f"Erreur lors du chargement du template: {str(e)}")
+                raise ValueError(f"Impossible de charger le template. Erreur: {str(e)}")
+
+            try:
+                contents = images_future.result()
+                logger.info(f"Images source téléchargées avec succès. Nombre: {len(contents)}")
+            except ValueError as e:
+                logger.error(f"Erreur lors du chargement des images: {str(e)}")
+                raise ValueError(f"Impossible de charger une ou plusieurs images. Erreur: {str(e)}")
 
         # Vérifier que nous avons le bon nombre d'images
-        if len(images) != len(xs):
-            raise ValueError(f"Le nombre d'images ({len(images)}) ne correspond pas au nombre de positions ({len(xs)})")
+        if len(contents) != len(xs):
+            raise ValueError(f"Le nombre d'images ({len(contents)}) ne correspond pas au nombre de positions ({len(xs)})")
 
         # Calculer le facteur d'échelle
         reference_width = 1000
-        target_width = result_w if result_w else template.width
+        target_width = result_w if result_w else template_w
         scale_factor = target_width / reference_width
         logger.info(f"Facteur d'échelle calculé: {scale_factor} (target_width={target_width}, reference_width={reference_width})")
 
@@ -162,107 +182,144 @@ def process_and_upload(template_url, image_url, result_file, result_w, xs, ys, r
         default_filter = 'none'
         default_dh = 0
         default_db = 0
+        # Compromis vitesse/qualité des redimensionnements, choisi par job (RESIZE_QUALITY sinon)
+        resize_quality = resolve_resize_quality((params or {}).get("resize_quality"))
+        logger.info(f"Qualité de redimensionnement: {resize_quality.value}")
+
+        # Canevas mutable unique du job (le template est partagé par le cache mémoire).
+        # Si result_w réduit le template, la composition se fait directement dans l'espace de
+        # sortie : le template est réduit une fois ici et les placements sont calculés pour ce canevas.
+        # Les très grandes sorties sont rendues par bandes : le template n'est jamais décodé
+        # en entier et l'image finale est encodée en flux.
+        output_size = (target_width, max(1, round(template_h * target_width / template_w)))
+        backend = select_imaging_backend(output_size, (template_w, template_h))
+        if isinstance(backend, TiledBackend):
+            logger.info(f"Rendu par bandes pour une sortie de {output_size}")
+            current_template = backend.open_canvas(cached_template.content, result_w, resize_quality)
+        else:
+            try:
+                template = load_template(template_url, cached_template)
+            except ValueError as e:
+                logger.error(f"Erreur lors du chargement du template: {str(e)}")
+                raise ValueError(f"Impossible de charger le template. Erreur: {str(e)}")
+            current_template = backend.new_canvas(template, result_w, resize_quality)
+            del template
+        del cached_template
+        canvas_width, canvas_height = backend.size(current_template)
+        # Rapport entre le canevas de composition et le template d'origine
+        canvas_ratio = canvas_width / template_w
+        if result_w and result_w < template_w:
+            logger.info(f"Composition à la taille de sortie: {(template_w, template_h)} -> {(canvas_width, canvas_height)}")
 
         # Fonction pour récupérer une valeur ou la valeur par défaut
         def get_value_with_default(values, index, default):
             return values[index] if index < len(values) and values[index] is not None else default
 
-        # Transformation des images et application sur le template
-        current_template = template.copy()
-        
-        # Transformation de chaque image
+        # Charger chaque image au plus petit niveau de pyramide couvrant sa taille placée.
+        # Une URL placée plusieurs fois n'est décodée qu'une fois, à la plus grande taille
+        # demandée : chaque placement repart de cette source partagée.
+        try:
+            target_sizes = {}
+            for i, url in enumerate(image_url):
+                target_sizes.setdefault(url, []).append(compute_target_size(
+                    canvas_width,
+                    get_value_with_default(ws, i, default_width_percentage),
+                    get_value_with_default(dhs, i, default_dh),
+                    get_value_with_default(dbs, i, default_db),
+                ))
+            decoded = {}
+            for url, content in zip(image_url, contents):
+                if url not in decoded:
+                    decoded[url] = backend.load_source(url, content, largest_target_size(target_sizes[url]))
+            images = [decoded[url] for url in image_url]
+            if len(decoded) < len(images):
+                logger.info(f"{len(images) - len(decoded)} placement(s) réutilisent une image déjà décodée")
+            del contents, decoded
+        except Exception as e:
+            logger.error(f"Erreur lors du décodage des images: {str(e)}")
+            raise ValueError(f"Impossible de charger une ou plusieurs images. Erreur: {str(e)}")
+
+        # Transformation de chaque image et application sur le canevas
         for i, image in enumerate(images):
             try:
                 logger.info(f"Traitement de l'image {i+1}/{len(images)}")
-                # Copie indépendante de l'image originale
-                new_image = image.copy()
-
-                # Appliquer le rognage (les pourcentages restent les mêmes)
                 top = get_value_with_default(dhs, i, default_dh)
                 bottom = get_value_with_default(dbs, i, default_db)
-                new_image = apply_crop(new_image, top, bottom)
-
-                # Appliquer la rotation (les angles restent les mêmes)
                 rotation = get_value_with_default(rs, i, default_rotation)
-                new_image = apply_rotation(new_image, rotation)
-
-                # Appliquer le filtre
                 filter_ = get_value_with_default(cs, i, default_filter)
-                new_image = apply_filter(new_image, filter_)
-
-                # Appliquer le redimensionnement en tenant compte du facteur d'échelle
                 width_factor = get_value_with_default(ws, i, default_width_percentage)
-                scaled_width = int((width_factor / 100) * current_template.width)
-                aspect_ratio = new_image.width / new_image.height
-                scaled_height = int(scaled_width / aspect_ratio)
-
-                if scaled_width <= 0 or scaled_height <= 0:
-                    raise ValueError(f"Dimensions invalides à l'étape {i} : width={scaled_width}, height={scaled_height}")
+                scaled_width = int((width_factor / 100) * canvas_width)
 
-                new_image = new_image.resize((scaled_width, scaled_height))
+                # Rognage, rotation et redimensionnement ; le filtre est appliqué à la taille
+                # placée (avec une marge pour cartoon), jamais à la résolution source
+                new_image = backend.place(image, top, bottom, rotation, scaled_width, filter_, resize_quality)
 
                 # Appliquer le filigrane avec une taille adaptée
                 if watermark_text:
-                    new_image = apply_watermark(new_image, watermark_text)
+                    new_image = backend.watermark(new_image, watermark_text)
 
-                # Positionner l'image sur le template (les pourcentages restent les mêmes)
-                x = int(get_value_with_default(xs, i, 0) / 100 * current_template.width)
-                y = int(get_value_with_default(ys, i, 0) / 100 * current_template.height)
-                current_template.paste(new_image, (x, y))
+                # Positionner l'image sur le template (les pourcentages restent les mêmes).
+                # Les niveaux de gris ne sont étendus en RGB qu'ici ; masque alpha seulement si
+                # l'image placée a réellement des zones transparentes
+                x = int(get_value_with_default(xs, i, 0) / 100 * canvas_width)
+                y = int(get_value_with_default(ys, i, 0) / 100 * canvas_height)
+                current_template = backend.paste(current_template, new_image, (x, y))
 
             except Exception as e:
                 log_message = f"Erreur à l'étape {i} : {e}"
                 log_to_ftp(ftp_host, ftp_username, ftp_password, log_message, log_folder="/error_logs")
                 raise e
 
-        # Traitement des paramètres de texte
+        # Traitement des paramètres de texte : tous les blocs sont préparés puis
+        # dessinés en une seule passe sur le canevas
         if ts and len(ts) > 0:
             logger.info(f"Ajout de {len(ts)} textes")
+            text_blocks = []
             for i in range(len(ts)):
-                try:
-                    # Vérifier que tous les paramètres nécessaires sont disponibles
-                    if (i < len(ts) and i < len(tfs) and i < len(tcs) and 
-                        i < len(tts) and i < len(txs) and i < len(tys)):
-                        
-                        text = ts[i]
-                        font_name = tfs[i]
-                        color = tcs[i]
-                        font_size = tts[i]
-                        tx = txs[i]
-                        ty = tys[i]
+                # Vérifier que tous les paramètres nécessaires sont disponibles
+                if (i < len(ts) and i < len(tfs) and i < len(tcs) and 
+                    i < len(tts) and i < len(txs) and i < len(tys)):
+                    
+                    text = ts[i]
+                    font_name = tfs[i]
+                    color = tcs[i]
+                    font_size = tts[i]
+                    tx = txs[i]
+                    ty = tys[i]
 
-                        # Ajuster la taille de la police en fonction de la taille finale
-                        adjusted_font_size = int(font_size * scale_factor)
-                        logger.info(f"Texte {i+1}: '{text}', police={font_name}, taille={font_size}->{adjusted_font_size}, position=({tx}%, {ty}%)")
-                        
-                        current_template = add_text(
-                            img=current_template,
-                            text=text,
-                            font_name=font_name,
-                            color=color,
-                            font_size=adjusted_font_size,
-                            x=tx,
-                            y=ty,
-                            strategy=TextRenderStrategy.COMBINED,
-                            dpi=dpi
-                        )
-                except Exception as e:
-                    log_message = f"Erreur ajout texte à l'étape {i} : {e}"
-                    log_to_ftp(ftp_host, ftp_username, ftp_password, log_message, log_folder="/error_logs")
-                    raise e
+                    # Ajuster la taille de la police en fonction de la taille finale. La taille
+                    # est définie sur le template : si la composition se fait à la taille de
+                    # sortie, police et interligne sont réduits comme les images placées
+                    adjusted_font_size = int(font_size * scale_factor)
+                    line_gap = 5
+                    if canvas_width != template_w:
+                        adjusted_font_size = max(1, round(adjusted_font_size * canvas_ratio))
+                        line_gap = 5 * canvas_ratio
+                    logger.info(f"Texte {i+1}: '{text}', police={font_name}, taille={font_size}->{adjusted_font_size}, position=({tx}%, {ty}%)")
+                    
+                    text_blocks.append(TextConfig(
+                        text=text, font_name=font_name, font_size=adjusted_font_size,
+                        x=tx, y=ty, color=color, strategy=TextRenderStrategy.COMBINED, dpi=dpi,
+                        line_gap=line_gap
+                    ))
+            try:
+                current_template = backend.text_layer(current_template, text_blocks)
+            except Exception as e:
+                log_message = f"Erreur ajout des textes : {e}"
+                log_to_ftp(ftp_host, ftp_username, ftp_password, log_message, log_folder="/error_logs")
+                raise e
 
-        # Redimensionner le template final si spécifié
-        if result_w:
+        # Redimensionner le template final si spécifié (agrandissement seulement : une
+        # réduction a déjà été faite avant la composition)
+        if result_w and canvas_width != result_w:
             logger.debug(f"Redimensionnement du template à {result_w}px de large...")
-            current_template = apply_resize_template(current_template, result_w)
+            current_template = backend.resize_to_width(current_template, result_w, resize_quality)
 
         # Sauvegarder et uploader le fichier
         if result_file:
             logger.info(f"Début de l'upload du fichier final: {result_file}")
-            with BytesIO() as bio:
-                logger.debug("Sauvegarde de l'image en mémoire")
-                current_template.save(bio, format='JPEG', dpi=(dpi, dpi))
-                bio.seek(0)
+            logger.debug("Sauvegarde de l'image en mémoire")
+            with BytesIO(backend.save_jpeg(current_template, dpi)) as bio:
                 
                 try:
                     logger.info("Tentative de connexion FTP")
@@ -318,5 +375,18 @@ def process_and_upload(template_url, image_url, result_file, result_w, xs, ys, r
         raise
 
     finally:
+        logger.info(f"Connexions HTTP du worker: {get_connection_stats()}, relances: {get_fetch_stats()}")
+        logger.info(f"Cache disque des templates: {get_template_cache().get_stats()}")
+        logger.info(f"Cache mémoire des templates: {get_decoded_template_cache().get_stats()}")
+        logger.info(f"Téléchargements dédoublonnés (single-flight): {get_single_flight().get_stats()}")
+        logger.info(f"Cache des photos sources: {get_source_cache().get_stats()}")
+        logger.info(f"Cache des filigranes: {get_watermark_cache().get_stats()}")
+        logger.info(f"Cache des masques de texte: {get_text_mask_cache().get_stats()}")
+        conversions = {
+            key: count - conversions_before.get(key, 0)
+            for key, count in get_conversion_stats().items()
+            if count != conversions_before.get(key, 0)
+        }
+        logger.info(f"Conversions de mode du job: {conversions}")
         if result_file and os.path.exists(result_file):
             clean_up_files([result_file])